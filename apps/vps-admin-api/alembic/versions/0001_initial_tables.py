@@ -8,9 +8,10 @@ Create Date: 2026-02-03
 
 from __future__ import annotations
 
-from alembic import op
 import sqlalchemy as sa
 
+from alembic import op
+
 revision: str = "0001"
 down_revision: str | None = None
 branch_labels: tuple[str, ...] | None = None
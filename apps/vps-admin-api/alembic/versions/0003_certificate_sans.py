@@ -0,0 +1,29 @@
+"""Add SANs to certificates.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+from alembic import op
+
+revision: str = "0003"
+down_revision: str = "0002"
+branch_labels: tuple[str, ...] | None = None
+depends_on: str | None = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "certificates",
+        sa.Column("sans", sa.Text, nullable=False, server_default="[]"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("certificates", "sans")
@@ -0,0 +1,38 @@
+"""Add sync_fingerprints table.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+from alembic import op
+
+revision: str = "0004"
+down_revision: str = "0003"
+branch_labels: tuple[str, ...] | None = None
+depends_on: str | None = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "sync_fingerprints",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("vps_id", sa.String(64), nullable=False),
+        sa.Column("section", sa.String(32), nullable=False),
+        sa.Column("fingerprint", sa.String(64), nullable=False),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.func.now(),
+        ),
+        sa.UniqueConstraint("vps_id", "section", name="uq_sync_fingerprints_vps_section"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("sync_fingerprints")
@@ -0,0 +1,80 @@
+"""Upsert traffic_stats per (vps_id, domain, period_start) bucket.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+from alembic import op
+
+revision: str = "0005"
+down_revision: str = "0004"
+branch_labels: tuple[str, ...] | None = None
+depends_on: str | None = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "traffic_stats",
+        sa.Column("request_time_ms_total", sa.BigInteger, nullable=False, server_default="0"),
+    )
+    op.execute(
+        "UPDATE traffic_stats SET request_time_ms_total = avg_request_time_ms::bigint * requests"
+    )
+
+    # Fold rows that already share a bucket into the newest one before the
+    # unique constraint goes on.
+    op.execute(
+        """
+        UPDATE traffic_stats AS t
+        SET requests = d.requests,
+            status_2xx = d.status_2xx,
+            status_3xx = d.status_3xx,
+            status_4xx = d.status_4xx,
+            status_5xx = d.status_5xx,
+            bytes_sent = d.bytes_sent,
+            request_time_ms_total = d.request_time_ms_total,
+            avg_request_time_ms = d.request_time_ms_total / GREATEST(d.requests, 1),
+            period_end = d.period_end
+        FROM (
+            SELECT MAX(id) AS keep_id,
+                   SUM(requests) AS requests,
+                   SUM(status_2xx) AS status_2xx,
+                   SUM(status_3xx) AS status_3xx,
+                   SUM(status_4xx) AS status_4xx,
+                   SUM(status_5xx) AS status_5xx,
+                   SUM(bytes_sent) AS bytes_sent,
+                   SUM(request_time_ms_total) AS request_time_ms_total,
+                   MAX(period_end) AS period_end
+            FROM traffic_stats
+            GROUP BY vps_id, domain, period_start
+            HAVING COUNT(*) > 1
+        ) AS d
+        WHERE t.id = d.keep_id
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM traffic_stats AS t
+        USING traffic_stats AS k
+        WHERE t.vps_id = k.vps_id
+          AND t.domain = k.domain
+          AND t.period_start = k.period_start
+          AND t.id < k.id
+        """
+    )
+    op.create_unique_constraint(
+        "uq_traffic_stats_vps_domain_period",
+        "traffic_stats",
+        ["vps_id", "domain", "period_start"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint("uq_traffic_stats_vps_domain_period", "traffic_stats", type_="unique")
+    op.drop_column("traffic_stats", "request_time_ms_total")
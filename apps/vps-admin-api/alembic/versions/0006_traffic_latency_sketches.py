@@ -0,0 +1,28 @@
+"""Add latency histogram columns to traffic_stats.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+from alembic import op
+
+revision: str = "0006"
+down_revision: str = "0005"
+branch_labels: tuple[str, ...] | None = None
+depends_on: str | None = None
+
+
+def upgrade() -> None:
+    op.add_column("traffic_stats", sa.Column("latency_sketch", sa.Text, nullable=True))
+    op.add_column("traffic_stats", sa.Column("upstream_latency_sketch", sa.Text, nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("traffic_stats", "upstream_latency_sketch")
+    op.drop_column("traffic_stats", "latency_sketch")
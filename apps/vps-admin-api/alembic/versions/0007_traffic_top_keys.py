@@ -0,0 +1,30 @@
+"""Add heavy-hitter (top-K) summary columns to traffic_stats.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+from alembic import op
+
+revision: str = "0007"
+down_revision: str = "0006"
+branch_labels: tuple[str, ...] | None = None
+depends_on: str | None = None
+
+
+def upgrade() -> None:
+    op.add_column("traffic_stats", sa.Column("top_uris", sa.Text, nullable=True))
+    op.add_column("traffic_stats", sa.Column("top_clients", sa.Text, nullable=True))
+    op.add_column("traffic_stats", sa.Column("top_user_agents", sa.Text, nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("traffic_stats", "top_user_agents")
+    op.drop_column("traffic_stats", "top_clients")
+    op.drop_column("traffic_stats", "top_uris")
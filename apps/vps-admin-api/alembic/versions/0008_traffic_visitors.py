@@ -0,0 +1,26 @@
+"""Add a unique-visitor HyperLogLog column to traffic_stats.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17
+
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+from alembic import op
+
+revision: str = "0008"
+down_revision: str = "0007"
+branch_labels: tuple[str, ...] | None = None
+depends_on: str | None = None
+
+
+def upgrade() -> None:
+    op.add_column("traffic_stats", sa.Column("visitors_sketch", sa.Text, nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("traffic_stats", "visitors_sketch")
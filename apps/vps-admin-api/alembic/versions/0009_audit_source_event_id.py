@@ -0,0 +1,31 @@
+"""Deduplicate agent audit events on (vps_id, source_event_id).
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17
+
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+from alembic import op
+
+revision: str = "0009"
+down_revision: str = "0008"
+branch_labels: tuple[str, ...] | None = None
+depends_on: str | None = None
+
+
+def upgrade() -> None:
+    # Existing rows keep NULL, which never conflicts.
+    op.add_column("audit_logs", sa.Column("source_event_id", sa.BigInteger, nullable=True))
+    op.create_unique_constraint(
+        "uq_audit_logs_vps_source_event", "audit_logs", ["vps_id", "source_event_id"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint("uq_audit_logs_vps_source_event", "audit_logs", type_="unique")
+    op.drop_column("audit_logs", "source_event_id")
@@ -0,0 +1,48 @@
+"""Scope certificates to the reporting VPS: unique (vps_id, domain).
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-17
+
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+from alembic import op
+
+revision: str = "0010"
+down_revision: str = "0009"
+branch_labels: tuple[str, ...] | None = None
+depends_on: str | None = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "certificates",
+        sa.Column("vps_id", sa.String(64), nullable=False, server_default=""),
+    )
+    # Attribute existing certs to the VPS serving the domain; the rest were
+    # only ever a cache of agent syncs and are dropped. Forgetting the certs
+    # fingerprints makes every agent resend its full list on the next sync.
+    op.execute(
+        "UPDATE certificates AS c SET vps_id = d.vps_id FROM domains AS d WHERE d.domain = c.domain"
+    )
+    op.execute("DELETE FROM certificates WHERE vps_id = ''")
+    op.execute("DELETE FROM sync_fingerprints WHERE section = 'certs'")
+    op.drop_constraint("certificates_domain_key", "certificates", type_="unique")
+    op.create_unique_constraint(
+        "uq_certificates_vps_domain", "certificates", ["vps_id", "domain"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint("uq_certificates_vps_domain", "certificates", type_="unique")
+    # Keep one row per domain before the old constraint goes back on.
+    op.execute(
+        "DELETE FROM certificates AS c USING certificates AS newer "
+        "WHERE newer.domain = c.domain AND newer.id > c.id"
+    )
+    op.create_unique_constraint("certificates_domain_key", "certificates", ["domain"])
+    op.drop_column("certificates", "vps_id")
@@ -0,0 +1,56 @@
+"""Diff-based container snapshots and the container_events log.
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-17
+
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+from alembic import op
+
+revision: str = "0011"
+down_revision: str = "0010"
+branch_labels: tuple[str, ...] | None = None
+depends_on: str | None = None
+
+
+def upgrade() -> None:
+    # Snapshots were rewritten on every sync; start clean (the containers
+    # fingerprints go too, so that every agent resends its full list).
+    op.execute("DELETE FROM container_snapshots")
+    op.execute("DELETE FROM sync_fingerprints WHERE section = 'containers'")
+    op.add_column(
+        "container_snapshots",
+        sa.Column("state_since", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_unique_constraint(
+        "uq_container_snapshots_vps_name", "container_snapshots", ["vps_id", "container_name"]
+    )
+
+    op.create_table(
+        "container_events",
+        sa.Column("id", sa.BigInteger, primary_key=True, autoincrement=True),
+        sa.Column("vps_id", sa.String(64), nullable=False),
+        sa.Column("container_name", sa.String(255), nullable=False),
+        sa.Column("at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("event", sa.String(16), nullable=False),
+        sa.Column("from_status", sa.String(64), nullable=True),
+        sa.Column("to_status", sa.String(64), nullable=True),
+        sa.Column("image", sa.String(512), nullable=False, server_default=""),
+    )
+    op.create_index(
+        "ix_container_events_vps_name_at", "container_events", ["vps_id", "container_name", "at"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_container_events_vps_name_at", table_name="container_events")
+    op.drop_table("container_events")
+    op.drop_constraint(
+        "uq_container_snapshots_vps_name", "container_snapshots", type_="unique"
+    )
+    op.drop_column("container_snapshots", "state_since")
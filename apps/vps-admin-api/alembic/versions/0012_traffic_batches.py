@@ -0,0 +1,42 @@
+"""Remember applied agent traffic batches so that resent ones are skipped.
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-17
+
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+from alembic import op
+
+revision: str = "0012"
+down_revision: str = "0011"
+branch_labels: tuple[str, ...] | None = None
+depends_on: str | None = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "traffic_batches",
+        sa.Column("id", sa.BigInteger, primary_key=True, autoincrement=True),
+        sa.Column("vps_id", sa.String(64), nullable=False),
+        sa.Column("batch_id", sa.String(64), nullable=False),
+        sa.Column(
+            "applied_at",
+            sa.DateTime(timezone=True),
+            nullable=False,
+            server_default=sa.func.now(),
+        ),
+        sa.UniqueConstraint("vps_id", "batch_id", name="uq_traffic_batches_vps_batch"),
+    )
+    op.create_index(
+        "ix_traffic_batches_vps_applied", "traffic_batches", ["vps_id", "applied_at"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_traffic_batches_vps_applied", table_name="traffic_batches")
+    op.drop_table("traffic_batches")
@@ -13,6 +13,15 @@ class Settings(BaseSettings):
     cors_origins: list[str] = ["http://localhost:3000"]
     api_token: str = ""  # Pre-shared token for agent auth
     loki_url: str = "http://loki:3100"
+    max_request_body: int = 64 * 1024 * 1024  # Decoded agent payload cap (bytes)
+    agent_max_concurrent_syncs: int = 8  # Agent writes applied at once; more get 503
+    agent_retry_after: int = 10  # Retry-After (s) sent with that 503
+    agent_next_sync_in: float = 0.0  # Suggested agent sync interval (s), 0 = none
+    agent_busy_next_sync_in: float = 60.0  # Suggested interval while >= 3/4 of slots busy
+    agent_writers: int = 4  # Background snapshot writer tasks; 0 = write in the request
+    agent_write_queue_size: int = 1000  # Agent payloads waiting to be written; more get 503
+    agent_write_batch: int = 50  # Agent payloads committed per writer transaction
+    heartbeat_flush_interval: float = 30.0  # Batch last_seen writes (s), 0 = write each heartbeat
 
     model_config = {"env_prefix": "VSA_"}
 
@@ -4,7 +4,7 @@ from __future__ import annotations
 
 from datetime import datetime, timezone
 
-from sqlalchemy import BigInteger, DateTime, Integer, String, Text, func
+from sqlalchemy import BigInteger, DateTime, Index, Integer, String, Text, UniqueConstraint, func
 from sqlalchemy.orm import Mapped, mapped_column
 
 from vsa_api.db.session import Base
@@ -41,16 +41,22 @@ class Domain(Base):
 
 class Certificate(Base):
     __tablename__ = "certificates"
+    __table_args__ = (UniqueConstraint("vps_id", "domain", name="uq_certificates_vps_domain"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    domain: Mapped[str] = mapped_column(String(255), unique=True, nullable=False)
+    vps_id: Mapped[str] = mapped_column(String(64), nullable=False, default="")
+    domain: Mapped[str] = mapped_column(String(255), nullable=False)
     issuer: Mapped[str] = mapped_column(String(255), nullable=False, default="Let's Encrypt")
     expiry: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
     status: Mapped[str] = mapped_column(String(32), nullable=False, default="valid")
+    sans: Mapped[str] = mapped_column(Text, nullable=False, default="[]")  # JSON list of DNS names
 
 
 class AuditLog(Base):
     __tablename__ = "audit_logs"
+    __table_args__ = (
+        UniqueConstraint("vps_id", "source_event_id", name="uq_audit_logs_vps_source_event"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     timestamp: Mapped[datetime] = mapped_column(
@@ -64,24 +70,57 @@ class AuditLog(Base):
     result: Mapped[str] = mapped_column(String(32), nullable=False, default="success")
     error: Mapped[str | None] = mapped_column(Text, nullable=True)
     duration_ms: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    # Row id in the agent's local audit DB; makes re-sent batches idempotent.
+    source_event_id: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
 
 
 class ContainerSnapshot(Base):
+    """Current state of each container, updated only when it changes."""
+
     __tablename__ = "container_snapshots"
+    __table_args__ = (
+        UniqueConstraint("vps_id", "container_name", name="uq_container_snapshots_vps_name"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     vps_id: Mapped[str] = mapped_column(String(64), nullable=False)
     container_name: Mapped[str] = mapped_column(String(255), nullable=False)
     image: Mapped[str] = mapped_column(String(512), nullable=False, default="")
+    # Docker status without its durations, e.g. "Up (healthy)", "Exited (0)".
     status: Mapped[str] = mapped_column(String(64), nullable=False, default="")
     ports: Mapped[str] = mapped_column(Text, nullable=False, default="")
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now()
     )
+    # When the container entered its current state (Up, Exited, ...).
+    state_since: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class ContainerEvent(Base):
+    """Append-only log of container changes seen by agent syncs."""
+
+    __tablename__ = "container_events"
+    __table_args__ = (Index("ix_container_events_vps_name_at", "vps_id", "container_name", "at"),)
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    vps_id: Mapped[str] = mapped_column(String(64), nullable=False)
+    container_name: Mapped[str] = mapped_column(String(255), nullable=False)
+    at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    event: Mapped[str] = mapped_column(String(16), nullable=False)  # added|changed|removed
+    from_status: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    to_status: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    image: Mapped[str] = mapped_column(String(512), nullable=False, default="")
 
 
 class TrafficStat(Base):
+    """Traffic totals per VPS, domain and bucket (one minute from current agents)."""
+
     __tablename__ = "traffic_stats"
+    __table_args__ = (
+        UniqueConstraint(
+            "vps_id", "domain", "period_start", name="uq_traffic_stats_vps_domain_period"
+        ),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     domain: Mapped[str] = mapped_column(String(255), nullable=False, index=True)
@@ -99,3 +138,50 @@ class TrafficStat(Base):
     status_5xx: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
     bytes_sent: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
     avg_request_time_ms: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    request_time_ms_total: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    # JSON vsa_common.sketches.LatencyHistogram of request_time / upstream_response_time.
+    latency_sketch: Mapped[str | None] = mapped_column(Text, nullable=True)
+    upstream_latency_sketch: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # JSON vsa_common.sketches.TopK of uri / remote_addr / http_user_agent.
+    top_uris: Mapped[str | None] = mapped_column(Text, nullable=True)
+    top_clients: Mapped[str | None] = mapped_column(Text, nullable=True)
+    top_user_agents: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # JSON vsa_common.sketches.HyperLogLog of remote_addr (unique visitors).
+    visitors_sketch: Mapped[str | None] = mapped_column(Text, nullable=True)
+
+
+class TrafficBatch(Base):
+    """Agent traffic batches already applied, so that a resent one is not counted twice."""
+
+    __tablename__ = "traffic_batches"
+    __table_args__ = (
+        UniqueConstraint("vps_id", "batch_id", name="uq_traffic_batches_vps_batch"),
+        Index("ix_traffic_batches_vps_applied", "vps_id", "applied_at"),
+    )
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    vps_id: Mapped[str] = mapped_column(String(64), nullable=False)
+    # Agent-computed hash of the log positions the batch was read between.
+    batch_id: Mapped[str] = mapped_column(String(64), nullable=False)
+    applied_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+
+
+class SyncFingerprint(Base):
+    """Fingerprint of the last snapshot applied per VPS and sync section."""
+
+    __tablename__ = "sync_fingerprints"
+    __table_args__ = (
+        UniqueConstraint("vps_id", "section", name="uq_sync_fingerprints_vps_section"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    vps_id: Mapped[str] = mapped_column(String(64), nullable=False)
+    section: Mapped[str] = mapped_column(String(32), nullable=False)
+    fingerprint: Mapped[str] = mapped_column(String(64), nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+    )
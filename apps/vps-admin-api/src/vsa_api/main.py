@@ -8,8 +8,11 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from vsa_api.config import settings
-from vsa_api.db.session import engine, Base
+from vsa_api.db.session import async_session, engine, Base
+from vsa_api.middleware import RequestDecodingMiddleware
 from vsa_api.routers import containers, domains, certs, audit_logs, stacks, vps, agent, traffic
+from vsa_api.services.heartbeats import heartbeats
+from vsa_api.services.ingest import ingest
 
 
 @asynccontextmanager
@@ -17,7 +20,16 @@ async def lifespan(app: FastAPI):
     # Create tables on startup (in production, use Alembic)
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    heartbeats.start(async_session, settings.heartbeat_flush_interval)
+    ingest.start(
+        async_session,
+        writers=settings.agent_writers,
+        size=settings.agent_write_queue_size,
+        batch=settings.agent_write_batch,
+    )
     yield
+    await ingest.stop()
+    await heartbeats.stop(async_session)
     await engine.dispose()
 
 
@@ -28,6 +40,7 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+app.add_middleware(RequestDecodingMiddleware, max_body_size=settings.max_request_body)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.cors_origins,
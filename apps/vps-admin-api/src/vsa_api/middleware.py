@@ -0,0 +1,154 @@
+"""ASGI middleware — transparent decoding of compressed / msgpack agent bodies.
+
+Agents may send request bodies with ``Content-Encoding: gzip`` or ``zstd``
+and/or ``Content-Type: application/msgpack``. The body is decoded here and
+handed to the routers as plain JSON, so endpoint code never sees the wire
+format. Which encodings this hub accepts is advertised by
+``GET /api/agent/capabilities``.
+"""
+
+from __future__ import annotations
+
+import io
+import json
+import zlib
+from collections.abc import Callable
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import zstandard
+except ImportError:  # optional: pip install vsa-api[compression]
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:  # optional: pip install vsa-api[compression]
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+
+class BodyTooLargeError(Exception):
+    """Decoded request body exceeds the configured limit."""
+
+
+def _gunzip(data: bytes, limit: int) -> bytes:
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    out = decompressor.decompress(data, limit + 1)
+    if len(out) > limit:
+        raise BodyTooLargeError
+    return out
+
+
+def _unzstd(data: bytes, limit: int) -> bytes:
+    reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data))
+    out = reader.read(limit + 1)
+    if len(out) > limit:
+        raise BodyTooLargeError
+    return out
+
+
+def supported_encodings() -> list[str]:
+    """Content-Encodings this hub can decode, preferred first."""
+    return (["zstd"] if zstandard is not None else []) + ["gzip"]
+
+
+def supported_formats() -> list[str]:
+    """Request body media types accepted by the agent endpoints."""
+    return ["application/json"] + ([MSGPACK_MEDIA_TYPE] if msgpack is not None else [])
+
+
+def _decoders() -> dict[str, Callable[[bytes, int], bytes]]:
+    decoders: dict[str, Callable[[bytes, int], bytes]] = {"gzip": _gunzip}
+    if zstandard is not None:
+        decoders["zstd"] = _unzstd
+    return decoders
+
+
+class RequestDecodingMiddleware:
+    """Decompress and/or msgpack-decode request bodies before routing."""
+
+    def __init__(self, app: ASGIApp, max_body_size: int = 64 * 1024 * 1024) -> None:
+        self.app = app
+        self.max_body_size = max_body_size
+        self.decoders = _decoders()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        encoding = headers.get("content-encoding", "identity").strip().lower()
+        is_msgpack = headers.get("content-type", "").startswith(MSGPACK_MEDIA_TYPE)
+        if encoding == "identity" and not is_msgpack:
+            await self.app(scope, receive, send)
+            return
+
+        if encoding != "identity" and encoding not in self.decoders:
+            await _error(415, f"Unsupported Content-Encoding '{encoding}'")(scope, receive, send)
+            return
+        if is_msgpack and msgpack is None:
+            await _error(415, "msgpack bodies are not supported by this hub")(
+                scope, receive, send
+            )
+            return
+
+        try:
+            body = await _read_body(receive, self.max_body_size)
+            if encoding != "identity":
+                body = self.decoders[encoding](body, self.max_body_size)
+            if is_msgpack:
+                # Routers validate JSON; re-encoding keeps them format-agnostic.
+                body = json.dumps(msgpack.unpackb(body), separators=(",", ":")).encode()
+        except BodyTooLargeError:
+            await _error(413, "Decoded request body too large")(scope, receive, send)
+            return
+        except Exception as exc:
+            await _error(400, f"Could not decode request body: {exc}")(scope, receive, send)
+            return
+
+        raw_headers: list[tuple[bytes, bytes]] = [
+            (k, v)
+            for k, v in scope["headers"]
+            if k not in (b"content-encoding", b"content-length", b"content-type")
+        ]
+        raw_headers.append((b"content-type", b"application/json"))
+        raw_headers.append((b"content-length", str(len(body)).encode()))
+
+        await self.app(dict(scope, headers=raw_headers), _replay(body), send)
+
+
+async def _read_body(receive: Receive, limit: int) -> bytes:
+    chunks: list[bytes] = []
+    size = 0
+    more = True
+    while more:
+        message = await receive()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > limit:
+            raise BodyTooLargeError
+        chunks.append(chunk)
+        more = message.get("more_body", False)
+    return b"".join(chunks)
+
+
+def _replay(body: bytes) -> Receive:
+    sent = False
+
+    async def receive() -> Message:
+        nonlocal sent
+        if sent:
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return receive
+
+
+def _error(status_code: int, detail: str) -> JSONResponse:
+    return JSONResponse({"detail": detail}, status_code=status_code)
@@ -2,17 +2,38 @@
 
 from __future__ import annotations
 
-from datetime import datetime, timezone
+import asyncio
+import json
+import re
+from collections.abc import Awaitable, Callable
+from datetime import UTC, datetime, timedelta
 from typing import Any
 
-from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
 from pydantic import BaseModel
-from sqlalchemy import delete, select
+from sqlalchemy import String, all_, any_, bindparam, delete, func, or_, select, tuple_, update
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from vsa_common import HyperLogLog, LatencyHistogram, TopK
 
 from vsa_api.config import settings
 from vsa_api.db.session import get_db
-from vsa_api.db.tables import AuditLog, Certificate, ContainerSnapshot, Domain, TrafficStat, VpsNode
+from vsa_api.db.tables import (
+    AuditLog,
+    Certificate,
+    ContainerEvent,
+    ContainerSnapshot,
+    Domain,
+    SyncFingerprint,
+    TrafficBatch,
+    TrafficStat,
+    VpsNode,
+)
+from vsa_api.middleware import supported_encodings, supported_formats
+from vsa_api.routers.vps import node_summary
+from vsa_api.services.heartbeats import heartbeats
+from vsa_api.services.ingest import ingest
 
 router = APIRouter(tags=["agent"])
 
@@ -24,6 +45,59 @@ def _verify_token(authorization: str = Header("")):
         raise HTTPException(status_code=401, detail="Invalid agent token")
 
 
+# ---------------------------------------------------------------------------
+# Backpressure
+# ---------------------------------------------------------------------------
+
+NEXT_SYNC_HEADER = "X-Next-Sync-In"
+
+# Agent writes being applied right now. Checked and bumped without an await
+# in between, so the event loop makes this safe without a lock.
+_syncs_in_flight = 0
+
+
+def _next_sync_in() -> float:
+    """Interval to suggest to agents, longer while most sync slots or queue slots are taken."""
+    if (
+        _syncs_in_flight * 4 >= settings.agent_max_concurrent_syncs * 3
+        or ingest.load() >= 0.75
+    ):
+        return max(settings.agent_next_sync_in, settings.agent_busy_next_sync_in)
+    return settings.agent_next_sync_in
+
+
+def _busy() -> HTTPException:
+    """503 asking the agent to spool its payload and retry after the advertised delay."""
+    return HTTPException(
+        status_code=503,
+        detail="Hub busy, retry later",
+        headers={
+            "Retry-After": str(settings.agent_retry_after),
+            NEXT_SYNC_HEADER: f"{_next_sync_in():g}",
+        },
+    )
+
+
+async def _sync_slot(response: Response):
+    """Admit an agent write, or answer 503 + Retry-After when the hub is saturated.
+
+    Rejecting early keeps a fleet-wide burst from piling up on the database
+    pool; agents spool the payload and retry after the advertised delay.
+    Admitted responses carry ``X-Next-Sync-In`` when there is a suggestion.
+    """
+    global _syncs_in_flight
+    if _syncs_in_flight >= settings.agent_max_concurrent_syncs:
+        raise _busy()
+    _syncs_in_flight += 1
+    try:
+        hint = _next_sync_in()
+        if hint > 0:
+            response.headers[NEXT_SYNC_HEADER] = f"{hint:g}"
+        yield
+    finally:
+        _syncs_in_flight -= 1
+
+
 class HeartbeatPayload(BaseModel):
     vps_id: str
     hostname: str = ""
@@ -32,35 +106,114 @@ class HeartbeatPayload(BaseModel):
 
 class AuditSyncPayload(BaseModel):
     events: list[dict[str, Any]]
+    # Owner of every event; older agents send none (see _audit_row).
+    vps_id: str = ""
+
+
+# Snapshot payloads may omit the item list and send only the fingerprint of
+# the snapshot the agent believes the hub already has.
 
 
 class ContainerSyncPayload(BaseModel):
     vps_id: str
-    containers: list[dict[str, Any]]
+    containers: list[dict[str, Any]] | None = None
+    fingerprint: str | None = None
 
 
 class CertSyncPayload(BaseModel):
     vps_id: str
-    certs: list[dict[str, Any]]
+    certs: list[dict[str, Any]] | None = None
+    fingerprint: str | None = None
 
 
 class DomainSyncPayload(BaseModel):
     vps_id: str
-    domains: list[dict[str, Any]]
+    domains: list[dict[str, Any]] | None = None
+    fingerprint: str | None = None
 
 
 class TrafficSyncPayload(BaseModel):
     vps_id: str
     stats: list[dict[str, Any]]
+    # Identifies the log ranges the stats were read from; older agents send none.
+    batch_id: str | None = None
 
 
-@router.post("/agent/heartbeat")
-async def agent_heartbeat(
-    payload: HeartbeatPayload,
-    db: AsyncSession = Depends(get_db),
-    _: None = Depends(_verify_token),
-):
-    """Register or update a VPS agent heartbeat."""
+class SyncBundlePayload(BaseModel):
+    """All sections of one agent cycle; absent sections are left untouched."""
+
+    vps_id: str
+    heartbeat: HeartbeatPayload | None = None
+    containers: ContainerSyncPayload | None = None
+    certs: CertSyncPayload | None = None
+    domains: DomainSyncPayload | None = None
+    audit: AuditSyncPayload | None = None
+    traffic: TrafficSyncPayload | None = None
+
+
+# ---------------------------------------------------------------------------
+# Snapshot fingerprints
+# ---------------------------------------------------------------------------
+
+
+async def _snapshot_gate(
+    db: AsyncSession,
+    vps_id: str,
+    section: str,
+    fingerprint: str | None,
+    items: list[dict[str, Any]] | None,
+) -> dict[str, Any] | None:
+    """Short-circuit unchanged snapshots.
+
+    Returns ``unchanged`` when the stored fingerprint matches (no writes),
+    ``resend`` when only a fingerprint was sent but it does not match, and
+    None when the full snapshot should be applied.
+    """
+    if fingerprint:
+        stored = await db.scalar(
+            select(SyncFingerprint.fingerprint).where(
+                SyncFingerprint.vps_id == vps_id,
+                SyncFingerprint.section == section,
+            )
+        )
+        if stored == fingerprint:
+            return {"status": "unchanged"}
+    if items is None:
+        return {"status": "resend"}
+    return None
+
+
+async def _store_fingerprint(
+    db: AsyncSession, vps_id: str, section: str, fingerprint: str | None
+) -> None:
+    """Record the applied snapshot's fingerprint (cleared if it had none)."""
+    result = await db.execute(
+        select(SyncFingerprint).where(
+            SyncFingerprint.vps_id == vps_id,
+            SyncFingerprint.section == section,
+        )
+    )
+    row = result.scalar_one_or_none()
+    if fingerprint is None:
+        if row:
+            await db.delete(row)
+    elif row:
+        row.fingerprint = fingerprint
+    else:
+        db.add(SyncFingerprint(vps_id=vps_id, section=section, fingerprint=fingerprint))
+
+
+# ---------------------------------------------------------------------------
+# Section handlers — apply one payload to the session without committing, so
+# they can be combined into a single transaction by the bundle endpoint.
+# ---------------------------------------------------------------------------
+
+
+async def _apply_heartbeat(db: AsyncSession, payload: HeartbeatPayload) -> dict[str, Any]:
+    # Known, unchanged node: only last_seen moves, batched by the flush task.
+    if heartbeats.touch(payload.vps_id, payload.hostname, payload.ip_address):
+        return {"status": "ok"}
+
     result = await db.execute(
         select(VpsNode).where(VpsNode.vps_id == payload.vps_id)
     )
@@ -70,7 +223,7 @@ async def agent_heartbeat(
         node.hostname = payload.hostname or node.hostname
         node.ip_address = payload.ip_address or node.ip_address
         node.status = "active"
-        node.last_seen = datetime.now(timezone.utc)
+        node.last_seen = datetime.now(UTC)
     else:
         node = VpsNode(
             vps_id=payload.vps_id,
@@ -80,68 +233,639 @@ async def agent_heartbeat(
         )
         db.add(node)
 
-    await db.commit()
     return {"status": "ok"}
 
 
-@router.post("/agent/audit-sync")
+_AUDIT_INSERT_CHUNK = 1000
+
+
+def _parse_timestamp(value: Any) -> datetime:
+    """Event time as an aware datetime; naive values are UTC, junk is now."""
+    if isinstance(value, datetime):
+        ts = value
+    else:
+        try:
+            ts = datetime.fromisoformat(str(value))
+        except ValueError:
+            return datetime.now(UTC)
+    return ts if ts.tzinfo is not None else ts.replace(tzinfo=UTC)
+
+
+def _audit_row(event: dict[str, Any], vps_id: str) -> dict[str, Any]:
+    """One audit_logs row, owned by the *vps_id* the payload was sent for.
+
+    The event body's own vps_id is only trusted from older agents that send
+    none in the payload, and then the event gets no dedup key: it could
+    otherwise claim, and suppress, another VPS's (vps_id, source_event_id).
+    """
+    params = event.get("params")
+    if params is None:
+        params = "{}"
+    elif not isinstance(params, str):
+        # Agents send the JSON text from their local DB; anything else is encoded
+        # here so that readers can always json.loads it.
+        params = json.dumps(params, default=str)
+    source_id = event.get("id") if vps_id else None
+    duration = event.get("duration_ms")
+    return {
+        "timestamp": _parse_timestamp(event.get("timestamp")),
+        "vps_id": vps_id or str(event.get("vps_id") or ""),
+        "actor": str(event.get("actor") or ""),
+        "action": str(event.get("action") or ""),
+        "target": str(event.get("target") or ""),
+        "params": params,
+        "result": str(event.get("result") or "success"),
+        "error": event.get("error"),
+        "duration_ms": int(duration) if duration is not None else None,
+        "source_event_id": int(source_id) if source_id is not None else None,
+    }
+
+
+async def _apply_audit(db: AsyncSession, payload: AuditSyncPayload) -> dict[str, Any]:
+    """Insert audit events in multi-row batches, skipping ones already stored.
+
+    Events are keyed by the agent's local row id, so a batch re-sent after a
+    lost response (or replayed from the outbox) inserts nothing twice.
+    """
+    rows = [_audit_row(event, payload.vps_id) for event in payload.events]
+    inserted = 0
+    for i in range(0, len(rows), _AUDIT_INSERT_CHUNK):
+        result = await db.execute(
+            pg_insert(AuditLog)
+            .values(rows[i : i + _AUDIT_INSERT_CHUNK])
+            .on_conflict_do_nothing(constraint="uq_audit_logs_vps_source_event")
+            .returning(AuditLog.id)
+        )
+        inserted += len(result.all())
+    return {"synced": len(rows), "inserted": inserted}
+
+
+async def _apply_containers(db: AsyncSession, payload: ContainerSyncPayload) -> dict[str, Any]:
+    gate = await _snapshot_gate(
+        db, payload.vps_id, "containers", payload.fingerprint, payload.containers
+    )
+    if gate is not None:
+        return gate
+
+    now = datetime.now(UTC)
+    incoming = {
+        c["name"]: {
+            "image": str(c.get("image", "")),
+            "status": _container_status(str(c.get("status", ""))),
+            "ports": str(c.get("ports", "")),
+        }
+        for c in payload.containers
+        if c.get("name")
+    }
+    result = await db.execute(
+        select(
+            ContainerSnapshot.id,
+            ContainerSnapshot.container_name,
+            ContainerSnapshot.image,
+            ContainerSnapshot.status,
+            ContainerSnapshot.ports,
+        ).where(ContainerSnapshot.vps_id == payload.vps_id)
+    )
+    stored = {name: (row_id, image, status, ports) for row_id, name, image, status, ports in result}
+
+    added: list[dict[str, Any]] = []
+    changed: list[dict[str, Any]] = []
+    events: list[dict[str, Any]] = []
+    for name, c in incoming.items():
+        old = stored.get(name)
+        if old is None:
+            added.append(
+                {"vps_id": payload.vps_id, "container_name": name, "state_since": now, **c}
+            )
+            events.append(_container_event(payload.vps_id, name, now, "added", None, c))
+            continue
+        row_id, image, status, ports = old
+        if (image, status, ports) == (c["image"], c["status"], c["ports"]):
+            continue
+        row = {"id": row_id, **c}
+        if _container_state(status) != _container_state(c["status"]):
+            row["state_since"] = now
+        changed.append(row)
+        events.append(_container_event(payload.vps_id, name, now, "changed", status, c))
+    removed = [name for name in stored if name not in incoming]
+    for name in removed:
+        _, image, status, _ = stored[name]
+        events.append(
+            _container_event(payload.vps_id, name, now, "removed", status, {"image": image})
+        )
+
+    if added:
+        await db.execute(pg_insert(ContainerSnapshot).values(added))
+    # Bulk UPDATE by primary key, grouped by the columns each row sets.
+    for columns in {tuple(row) for row in changed}:
+        await db.execute(
+            update(ContainerSnapshot), [row for row in changed if tuple(row) == columns]
+        )
+    if removed:
+        await db.execute(
+            delete(ContainerSnapshot).where(
+                ContainerSnapshot.vps_id == payload.vps_id,
+                ContainerSnapshot.container_name == any_(_array(removed)),
+            )
+        )
+    if events:
+        await db.execute(pg_insert(ContainerEvent).values(events))
+
+    await _store_fingerprint(db, payload.vps_id, "containers", payload.fingerprint)
+    return {
+        "synced": len(incoming),
+        "added": len(added),
+        "changed": len(changed),
+        "removed": len(removed),
+    }
+
+
+# Docker's status text carries durations ("Up 3 hours", "Exited (0) 2 days
+# ago") that change on every sync without anything happening; they are
+# stripped before comparing so that only real transitions are written.
+_DURATION_RE = re.compile(
+    r"\s*\b(?:less than a second|(?:about )?(?:an?|\d+) "
+    r"(?:second|minute|hour|day|week|month|year)s?)(?: ago)?",
+    re.IGNORECASE,
+)
+
+
+def _container_status(raw: str) -> str:
+    """``Up 3 hours (healthy)`` -> ``Up (healthy)``; ``Exited (0) 2 days ago`` -> ``Exited (0)``."""
+    return " ".join(_DURATION_RE.sub("", raw).split())[:64]
+
+
+def _container_state(status: str) -> str:
+    """First word of a status: Up, Exited, Restarting, Paused, Created..."""
+    return status.split(" ", 1)[0]
+
+
+def _container_event(
+    vps_id: str,
+    name: str,
+    at: datetime,
+    event: str,
+    from_status: str | None,
+    current: dict[str, Any],
+) -> dict[str, Any]:
+    return {
+        "vps_id": vps_id,
+        "container_name": name,
+        "at": at,
+        "event": event,
+        "from_status": from_status,
+        "to_status": current.get("status"),
+        "image": current.get("image", ""),
+    }
+
+
+def _array(values: list[str]) -> Any:
+    return bindparam(None, values, type_=ARRAY(String))
+
+
+def _not_in(column: Any, values: list[str]) -> Any:
+    """``column <> ALL(:values)``: one array parameter, whatever the list length."""
+    return column != all_(_array(values))
+
+
+def _changed(stmt: Any, columns: tuple[str, ...]) -> Any:
+    """Upsert guard: only rewrite a conflicting row when one of *columns* differs."""
+    table = stmt.table
+    return or_(*(table.c[col].is_distinct_from(stmt.excluded[col]) for col in columns))
+
+
+def _parse_expiry(raw: Any) -> datetime | None:
+    if not raw:
+        return None
+    try:
+        return datetime.fromisoformat(raw)
+    except (ValueError, TypeError):
+        return None
+
+
+async def _apply_certs(db: AsyncSession, payload: CertSyncPayload) -> dict[str, Any]:
+    """Upsert this VPS's certificates and delete the ones it no longer reports.
+
+    One ``INSERT ... ON CONFLICT (vps_id, domain) DO UPDATE`` and one scoped
+    ``DELETE``, so the cost does not grow with the number of domains.
+    """
+    gate = await _snapshot_gate(db, payload.vps_id, "certs", payload.fingerprint, payload.certs)
+    if gate is not None:
+        return gate
+
+    # Keyed by domain: a statement may not upsert the same row twice.
+    rows = {
+        cert["domain"]: {
+            "vps_id": payload.vps_id,
+            "domain": cert["domain"],
+            "issuer": cert.get("issuer") or "Let's Encrypt",
+            "expiry": _parse_expiry(cert.get("expiry")),
+            "status": cert.get("status", "valid"),
+            "sans": json.dumps(cert.get("sans") or []),
+        }
+        for cert in payload.certs
+        if cert.get("domain")
+    }
+    if rows:
+        stmt = pg_insert(Certificate).values(list(rows.values()))
+        columns = ("issuer", "expiry", "status", "sans")
+        await db.execute(
+            stmt.on_conflict_do_update(
+                constraint="uq_certificates_vps_domain",
+                set_={col: stmt.excluded[col] for col in columns},
+                where=_changed(stmt, columns),
+            )
+        )
+    await db.execute(
+        delete(Certificate).where(
+            Certificate.vps_id == payload.vps_id, _not_in(Certificate.domain, list(rows))
+        )
+    )
+
+    await _store_fingerprint(db, payload.vps_id, "certs", payload.fingerprint)
+    return {"synced": len(rows)}
+
+
+async def _apply_domains(db: AsyncSession, payload: DomainSyncPayload) -> dict[str, Any]:
+    """Upsert the domains served by this VPS and delete the ones it no longer reports.
+
+    A domain moved from another VPS is taken over by this one.
+    """
+    gate = await _snapshot_gate(db, payload.vps_id, "domains", payload.fingerprint, payload.domains)
+    if gate is not None:
+        return gate
+
+    rows = {
+        d["domain"]: {
+            "domain": d["domain"],
+            "vps_id": payload.vps_id,
+            "container": d.get("container", ""),
+            "port": d.get("port", 3000),
+            "status": "active",
+        }
+        for d in payload.domains
+        if d.get("domain")
+    }
+    if rows:
+        stmt = pg_insert(Domain).values(list(rows.values()))
+        columns = ("vps_id", "container", "port", "status")
+        await db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[Domain.domain],
+                set_={col: stmt.excluded[col] for col in columns},
+                where=_changed(stmt, columns),
+            )
+        )
+    # Remove stale domains: entries for this VPS that are no longer in vhost files
+    await db.execute(
+        delete(Domain).where(Domain.vps_id == payload.vps_id, _not_in(Domain.domain, list(rows)))
+    )
+
+    await _store_fingerprint(db, payload.vps_id, "domains", payload.fingerprint)
+    return {"synced": len(rows)}
+
+
+_TRAFFIC_COUNTERS = (
+    "requests",
+    "status_2xx",
+    "status_3xx",
+    "status_4xx",
+    "status_5xx",
+    "bytes_sent",
+    "request_time_ms_total",
+)
+Sketch = HyperLogLog | LatencyHistogram | TopK
+# Column holding a JSON-serialised sketch -> (its path in a stat entry, type).
+_TRAFFIC_SKETCHES: dict[str, tuple[tuple[str, ...], type[Sketch]]] = {
+    "latency_sketch": (("latency",), LatencyHistogram),
+    "upstream_latency_sketch": (("upstream_latency",), LatencyHistogram),
+    "top_uris": (("top", "uri"), TopK),
+    "top_clients": (("top", "remote_addr"), TopK),
+    "top_user_agents": (("top", "user_agent"), TopK),
+    "visitors_sketch": (("visitors",), HyperLogLog),
+}
+_TRAFFIC_UPSERT_CHUNK = 1000
+# Applied batch ids are kept this long; an outbox replay older than that
+# would be counted again.
+_TRAFFIC_BATCH_RETENTION = timedelta(days=7)
+
+
+def _sketch(col: str, data: Any) -> Sketch | None:
+    if not isinstance(data, dict):
+        return None
+    try:
+        return _TRAFFIC_SKETCHES[col][1].from_dict(data)
+    except ValueError:
+        return None
+
+
+def _stored_sketch(col: str, raw: str) -> Sketch | None:
+    """Decode a sketch column; None if the stored value is corrupt."""
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return None
+    return _sketch(col, data)
+
+
+def _stat_sketch(stat: dict[str, Any], col: str) -> Sketch | None:
+    data: Any = stat
+    for key in _TRAFFIC_SKETCHES[col][0]:
+        data = data.get(key) if isinstance(data, dict) else None
+    return _sketch(col, data)
+
+
+def _traffic_row(vps_id: str, stat: dict[str, Any]) -> dict[str, Any]:
+    period_start = stat.get("period_start", "")
+    period_end = stat.get("period_end", "")
+    try:
+        ps = datetime.fromisoformat(period_start) if period_start else datetime.now(UTC)
+        pe = datetime.fromisoformat(period_end) if period_end else datetime.now(UTC)
+    except (ValueError, TypeError):
+        ps = datetime.now(UTC)
+        pe = datetime.now(UTC)
+
+    requests = int(stat.get("requests", 0))
+    avg_ms = int(stat.get("avg_request_time_ms", 0))
+    return {
+        "domain": stat.get("domain", ""),
+        "vps_id": vps_id,
+        "period_start": ps,
+        "period_end": pe,
+        "requests": requests,
+        "status_2xx": int(stat.get("status_2xx", 0)),
+        "status_3xx": int(stat.get("status_3xx", 0)),
+        "status_4xx": int(stat.get("status_4xx", 0)),
+        "status_5xx": int(stat.get("status_5xx", 0)),
+        "bytes_sent": int(stat.get("bytes_sent", 0)),
+        # Older agents only send the average.
+        "request_time_ms_total": int(stat.get("request_time_ms_total", avg_ms * requests)),
+        **{col: _stat_sketch(stat, col) for col in _TRAFFIC_SKETCHES},
+    }
+
+
+def _merge_traffic_rows(rows: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Sum rows sharing a bucket (one upsert may not touch a row twice)."""
+    merged: dict[tuple[str, datetime], dict[str, Any]] = {}
+    for row in rows:
+        key = (row["domain"], row["period_start"])
+        existing = merged.get(key)
+        if existing is None:
+            merged[key] = row
+            continue
+        for col in _TRAFFIC_COUNTERS:
+            existing[col] += row[col]
+        for col in _TRAFFIC_SKETCHES:
+            existing[col] = _merge_sketch(existing[col], row[col])
+        existing["period_end"] = max(existing["period_end"], row["period_end"])
+    for row in merged.values():
+        row["avg_request_time_ms"] = row["request_time_ms_total"] // max(row["requests"], 1)
+    return list(merged.values())
+
+
+def _merge_sketch(a: Sketch | None, b: Sketch | None) -> Sketch | None:
+    if a is None or b is None:
+        return a or b
+    a.merge(b)
+    return a
+
+
+async def _merge_stored_sketches(
+    db: AsyncSession, vps_id: str, rows: list[dict[str, Any]]
+) -> None:
+    """Fold the sketches already stored for these buckets into *rows*.
+
+    Sketches cannot be added in SQL, so this is a read-modify-write; the
+    stored rows stay locked until the upsert commits.
+    """
+    columns = list(_TRAFFIC_SKETCHES)
+    if not any(row[col] for row in rows for col in columns):
+        return
+    keyed = {(row["domain"], row["period_start"]): row for row in rows}
+    result = await db.execute(
+        select(
+            TrafficStat.domain,
+            TrafficStat.period_start,
+            *[TrafficStat.__table__.c[col] for col in columns],
+        )
+        .where(
+            TrafficStat.vps_id == vps_id,
+            tuple_(TrafficStat.domain, TrafficStat.period_start).in_(list(keyed)),
+        )
+        .with_for_update()
+    )
+    for domain, period_start, *stored in result.all():
+        row = keyed.get((domain, period_start))
+        if row is None:
+            continue
+        for col, raw in zip(columns, stored):
+            if row[col] is not None and raw:
+                row[col] = _merge_sketch(_stored_sketch(col, raw), row[col])
+
+
+async def _claim_traffic_batch(db: AsyncSession, vps_id: str, batch_id: str) -> bool:
+    """Record *batch_id* as applied; False if it already was (a resent batch)."""
+    claimed = await db.scalar(
+        pg_insert(TrafficBatch)
+        .values(vps_id=vps_id, batch_id=batch_id)
+        .on_conflict_do_nothing(constraint="uq_traffic_batches_vps_batch")
+        .returning(TrafficBatch.id)
+    )
+    if claimed is None:
+        return False
+    await db.execute(
+        delete(TrafficBatch).where(
+            TrafficBatch.vps_id == vps_id,
+            TrafficBatch.applied_at < func.now() - _TRAFFIC_BATCH_RETENTION,
+        )
+    )
+    return True
+
+
+async def _apply_traffic(db: AsyncSession, payload: TrafficSyncPayload) -> dict[str, Any]:
+    """Upsert traffic buckets on (vps_id, domain, period_start), adding counters.
+
+    A bucket may arrive in several parts (the agent reads the log every few
+    seconds), so counters are summed into the stored row, the average
+    request time is recomputed from the summed total and latency sketches
+    are merged. A batch whose ``batch_id`` was already applied (a retry
+    after a lost response, an outbox replay) is skipped.
+    """
+    if payload.batch_id and not await _claim_traffic_batch(
+        db, payload.vps_id, payload.batch_id
+    ):
+        return {"synced": 0, "duplicate": True}
+    rows = _merge_traffic_rows([_traffic_row(payload.vps_id, stat) for stat in payload.stats])
+    table = TrafficStat.__table__.c
+    for i in range(0, len(rows), _TRAFFIC_UPSERT_CHUNK):
+        await _merge_stored_sketches(db, payload.vps_id, rows[i : i + _TRAFFIC_UPSERT_CHUNK])
+    for row in rows:
+        for col in _TRAFFIC_SKETCHES:
+            if row[col] is not None:
+                row[col] = json.dumps(row[col].to_dict(), separators=(",", ":"))
+    # Chunked to stay under the driver's bind-parameter limit after a backlog.
+    for i in range(0, len(rows), _TRAFFIC_UPSERT_CHUNK):
+        stmt = pg_insert(TrafficStat).values(rows[i : i + _TRAFFIC_UPSERT_CHUNK])
+        excluded = stmt.excluded
+        total_ms = table.request_time_ms_total + excluded.request_time_ms_total
+        requests = table.requests + excluded.requests
+        await db.execute(
+            stmt.on_conflict_do_update(
+                constraint="uq_traffic_stats_vps_domain_period",
+                set_={
+                    **{col: table[col] + excluded[col] for col in _TRAFFIC_COUNTERS},
+                    "period_end": func.greatest(table.period_end, excluded.period_end),
+                    "avg_request_time_ms": total_ms // func.greatest(requests, 1),
+                    **{
+                        col: func.coalesce(excluded[col], table[col])
+                        for col in _TRAFFIC_SKETCHES
+                    },
+                },
+            )
+        )
+    return {"synced": len(rows)}
+
+
+# ---------------------------------------------------------------------------
+# Ingestion — deltas are committed inside the request; snapshots and heartbeat
+# write-throughs are queued for the background writers (services/ingest.py).
+# ---------------------------------------------------------------------------
+
+Handler = Callable[[AsyncSession, Any], Awaitable[dict[str, Any]]]
+
+# In the order a bundle applies them.
+_SECTION_HANDLERS: dict[str, Handler] = {
+    "heartbeat": _apply_heartbeat,
+    "containers": _apply_containers,
+    "certs": _apply_certs,
+    "domains": _apply_domains,
+    "audit": _apply_audit,
+    "traffic": _apply_traffic,
+}
+
+# Sections whose acknowledgement lets the agent advance a cursor and drop its
+# copy; they must be committed before the response.
+_DELTA_SECTIONS = frozenset({"audit", "traffic"})
+
+# Snapshot section -> payload attribute holding its items.
+_SNAPSHOT_ITEMS = {"containers": "containers", "certs": "certs", "domains": "domains"}
+
+
+async def _answer_now(db: AsyncSession, name: str, section: Any) -> dict[str, Any] | None:
+    """The result of a section that needs no write, or None if it must be applied.
+
+    Coalesced heartbeats only touch memory. A snapshot whose fingerprint
+    matches the stored one is ``unchanged`` whether or not its items were
+    sent, so the agent can remember the fingerprint; a fingerprint-only
+    snapshot that does not match needs its ``resend`` answer now.
+    """
+    if name == "heartbeat" and heartbeats.touch(
+        section.vps_id, section.hostname, section.ip_address
+    ):
+        return {"status": "ok"}
+    items = _SNAPSHOT_ITEMS.get(name)
+    if items is not None and (section.fingerprint or getattr(section, items) is None):
+        return await _snapshot_gate(
+            db, section.vps_id, name, section.fingerprint, getattr(section, items)
+        )
+    return None
+
+
+async def _apply_sections(db: AsyncSession, sections: dict[str, Any]) -> dict[str, dict[str, Any]]:
+    return {name: await _SECTION_HANDLERS[name](db, section) for name, section in sections.items()}
+
+
+async def _ingest(
+    response: Response, db: AsyncSession, vps_id: str, sections: dict[str, Any]
+) -> dict[str, dict[str, Any]]:
+    """Apply or queue the writes of *sections* and return their results.
+
+    Audit events and traffic aggregates are committed before the response,
+    so a failure answers 5xx and the agent keeps them in its outbox.
+    Heartbeat write-throughs and changed snapshots are queued as one job and
+    report ``accepted`` (HTTP 202). Losing such a job is harmless: the agent
+    does not remember the fingerprint of an ``accepted`` snapshot and resends
+    it in full until the hub answers ``unchanged``, and the fingerprint is
+    only stored in the transaction that writes the rows. When no writers are
+    running everything is applied inline. A saturated queue answers 503 +
+    Retry-After before anything is written.
+    """
+    results: dict[str, dict[str, Any]] = {}
+    queued: dict[str, Any] = {}
+    inline: dict[str, Any] = {}
+    for name, section in sections.items():
+        answer = await _answer_now(db, name, section)
+        if answer is not None:
+            results[name] = answer
+        elif name in _DELTA_SECTIONS:
+            inline[name] = section
+        else:
+            queued[name] = section
+
+    if queued:
+        async def apply(session: AsyncSession) -> dict[str, dict[str, Any]]:
+            return await _apply_sections(session, queued)
+
+        try:
+            accepted = ingest.submit(vps_id, apply)
+        except asyncio.QueueFull:
+            raise _busy() from None
+        if accepted:
+            response.status_code = 202
+            results.update({name: {"status": "accepted"} for name in queued})
+        else:
+            inline = {**queued, **inline}
+    if inline:
+        results.update(await _apply_sections(db, inline))
+        await db.commit()
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Endpoints
+# ---------------------------------------------------------------------------
+
+
+@router.post("/agent/heartbeat", dependencies=[Depends(_sync_slot)])
+async def agent_heartbeat(
+    payload: HeartbeatPayload,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+    _: None = Depends(_verify_token),
+):
+    """Register or update a VPS agent heartbeat."""
+    results = await _ingest(response, db, payload.vps_id, {"heartbeat": payload})
+    return results["heartbeat"]
+
+
+@router.post("/agent/audit-sync", dependencies=[Depends(_sync_slot)])
 async def agent_audit_sync(
     payload: AuditSyncPayload,
+    response: Response,
     db: AsyncSession = Depends(get_db),
     _: None = Depends(_verify_token),
 ):
     """Receive batch audit events from a remote VPS agent."""
-    count = 0
-    for event_data in payload.events:
-        log = AuditLog(
-            timestamp=event_data.get("timestamp", datetime.now(timezone.utc)),
-            vps_id=event_data.get("vps_id", ""),
-            actor=event_data.get("actor", ""),
-            action=event_data.get("action", ""),
-            target=event_data.get("target", ""),
-            params=str(event_data.get("params", "{}")),
-            result=event_data.get("result", "success"),
-            error=event_data.get("error"),
-            duration_ms=event_data.get("duration_ms"),
-        )
-        db.add(log)
-        count += 1
-
-    await db.commit()
-    return {"synced": count}
+    results = await _ingest(response, db, payload.vps_id, {"audit": payload})
+    return results["audit"]
 
 
-@router.post("/agent/containers-sync")
+@router.post("/agent/containers-sync", dependencies=[Depends(_sync_slot)])
 async def agent_containers_sync(
     payload: ContainerSyncPayload,
+    response: Response,
     db: AsyncSession = Depends(get_db),
     _: None = Depends(_verify_token),
 ):
-    """Receive container snapshot from a remote VPS agent (full replacement)."""
-    # Delete stale snapshots for this VPS before inserting fresh ones
-    await db.execute(
-        delete(ContainerSnapshot).where(
-            ContainerSnapshot.vps_id == payload.vps_id
-        )
-    )
+    """Receive container snapshot from a remote VPS agent (diffed against stored rows)."""
+    results = await _ingest(response, db, payload.vps_id, {"containers": payload})
+    return results["containers"]
 
-    for c in payload.containers:
-        snapshot = ContainerSnapshot(
-            vps_id=payload.vps_id,
-            container_name=c.get("name", ""),
-            image=c.get("image", ""),
-            status=c.get("status", ""),
-            ports=str(c.get("ports", "")),
-        )
-        db.add(snapshot)
 
-    await db.commit()
-    return {"synced": len(payload.containers)}
-
-
-@router.post("/agent/certs-sync")
+@router.post("/agent/certs-sync", dependencies=[Depends(_sync_slot)])
 async def agent_certs_sync(
     payload: CertSyncPayload,
+    response: Response,
     db: AsyncSession = Depends(get_db),
     _: None = Depends(_verify_token),
 ):
@@ -149,58 +873,14 @@ async def agent_certs_sync(
 
     Upserts certs present in the payload and removes stale entries for this VPS.
     """
-    synced_domains: set[str] = set()
-    count = 0
-    for cert_data in payload.certs:
-        domain = cert_data.get("domain", "")
-        if not domain:
-            continue
+    results = await _ingest(response, db, payload.vps_id, {"certs": payload})
+    return results["certs"]
 
-        synced_domains.add(domain)
 
-        result = await db.execute(
-            select(Certificate).where(Certificate.domain == domain)
-        )
-        cert = result.scalar_one_or_none()
-
-        expiry_raw = cert_data.get("expiry")
-        expiry = None
-        if expiry_raw:
-            try:
-                expiry = datetime.fromisoformat(expiry_raw)
-            except (ValueError, TypeError):
-                pass
-
-        if cert:
-            cert.issuer = cert_data.get("issuer", "Let's Encrypt")
-            cert.expiry = expiry
-            cert.status = cert_data.get("status", "valid")
-        else:
-            cert = Certificate(
-                domain=domain,
-                issuer=cert_data.get("issuer", "Let's Encrypt"),
-                expiry=expiry,
-                status=cert_data.get("status", "valid"),
-            )
-            db.add(cert)
-        count += 1
-
-    # Remove stale certs: entries for domains no longer reported by this agent
-    stale = await db.execute(
-        select(Certificate).where(
-            Certificate.domain.notin_(synced_domains) if synced_domains else True,
-        )
-    )
-    for orphan in stale.scalars().all():
-        await db.delete(orphan)
-
-    await db.commit()
-    return {"synced": count}
-
-
-@router.post("/agent/domains-sync")
+@router.post("/agent/domains-sync", dependencies=[Depends(_sync_slot)])
 async def agent_domains_sync(
     payload: DomainSyncPayload,
+    response: Response,
     db: AsyncSession = Depends(get_db),
     _: None = Depends(_verify_token),
 ):
@@ -209,48 +889,56 @@ async def agent_domains_sync(
     Upserts domains present in the payload and removes any domains for this
     VPS that are no longer reported (i.e. their vhost was deleted).
     """
-    synced_domains: set[str] = set()
-    count = 0
-    for d in payload.domains:
-        domain_name = d.get("domain", "")
-        if not domain_name:
-            continue
+    results = await _ingest(response, db, payload.vps_id, {"domains": payload})
+    return results["domains"]
 
-        synced_domains.add(domain_name)
 
-        result = await db.execute(
-            select(Domain).where(Domain.domain == domain_name)
-        )
-        existing = result.scalar_one_or_none()
+@router.post("/agent/traffic-sync", dependencies=[Depends(_sync_slot)])
+async def agent_traffic_sync(
+    payload: TrafficSyncPayload,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+    _: None = Depends(_verify_token),
+):
+    """Receive aggregated traffic stats from a remote VPS agent."""
+    results = await _ingest(response, db, payload.vps_id, {"traffic": payload})
+    return results["traffic"]
 
-        if existing:
-            existing.container = d.get("container", existing.container)
-            existing.port = d.get("port", existing.port)
-            existing.vps_id = payload.vps_id
-            existing.status = "active"
-        else:
-            existing = Domain(
-                domain=domain_name,
-                container=d.get("container", ""),
-                port=d.get("port", 3000),
-                vps_id=payload.vps_id,
-                status="active",
-            )
-            db.add(existing)
-        count += 1
 
-    # Remove stale domains: entries for this VPS that are no longer in vhost files
-    stale = await db.execute(
-        select(Domain).where(
-            Domain.vps_id == payload.vps_id,
-            Domain.domain.notin_(synced_domains) if synced_domains else True,
-        )
-    )
-    for orphan in stale.scalars().all():
-        await db.delete(orphan)
+@router.get("/agent/capabilities")
+async def agent_capabilities(_: None = Depends(_verify_token)):
+    """Advertise the sync features this hub supports (agent handshake)."""
+    return {
+        "bundle": True,
+        "fingerprints": True,
+        "encodings": supported_encodings(),
+        "formats": supported_formats(),
+    }
 
-    await db.commit()
-    return {"synced": count}
+
+@router.post("/agent/sync", dependencies=[Depends(_sync_slot)])
+async def agent_sync_bundle(
+    payload: SyncBundlePayload,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+    _: None = Depends(_verify_token),
+):
+    """Receive every section of an agent cycle in one request.
+
+    Audit and traffic are committed before the response; snapshots and heartbeat
+    write-throughs are queued together as one transaction (see ``_ingest``).
+
+    Each section has the same shape as the body of its dedicated endpoint;
+    the response carries the per-section results under ``sections``.
+    """
+    sections = {
+        name: getattr(payload, name)
+        for name in _SECTION_HANDLERS
+        if getattr(payload, name) is not None
+    }
+    results = await _ingest(response, db, payload.vps_id, sections)
+    status = "accepted" if response.status_code == 202 else "ok"
+    return {"status": status, "sections": results}
 
 
 @router.get("/agent/vps")
@@ -260,18 +948,7 @@ async def list_vps_nodes(
 ):
     """List all registered VPS nodes (token-authenticated for CLI use)."""
     result = await db.execute(select(VpsNode).order_by(VpsNode.vps_id))
-    nodes = result.scalars().all()
-    return [
-        {
-            "id": n.id,
-            "vps_id": n.vps_id,
-            "hostname": n.hostname,
-            "ip_address": n.ip_address,
-            "status": n.status,
-            "last_seen": n.last_seen.isoformat() if n.last_seen else None,
-        }
-        for n in nodes
-    ]
+    return [node_summary(n) for n in result.scalars().all()]
 
 
 @router.delete("/agent/vps/{vps_id}")
@@ -283,56 +960,23 @@ async def remove_vps(
     """Remove a VPS node and all its associated data (domains, certs, snapshots)."""
     # Delete associated data
     await db.execute(delete(Domain).where(Domain.vps_id == vps_id))
+    await db.execute(delete(Certificate).where(Certificate.vps_id == vps_id))
     await db.execute(
         delete(ContainerSnapshot).where(ContainerSnapshot.vps_id == vps_id)
     )
+    await db.execute(delete(ContainerEvent).where(ContainerEvent.vps_id == vps_id))
     await db.execute(delete(TrafficStat).where(TrafficStat.vps_id == vps_id))
+    await db.execute(delete(TrafficBatch).where(TrafficBatch.vps_id == vps_id))
+    await db.execute(delete(SyncFingerprint).where(SyncFingerprint.vps_id == vps_id))
 
     # Delete the node itself
     result = await db.execute(
         delete(VpsNode).where(VpsNode.vps_id == vps_id)
     )
     await db.commit()
+    heartbeats.forget(vps_id)
 
     if result.rowcount == 0:  # type: ignore[attr-defined]
         raise HTTPException(status_code=404, detail=f"VPS '{vps_id}' not found")
 
     return {"status": "ok", "vps_id": vps_id}
-
-
-@router.post("/agent/traffic-sync")
-async def agent_traffic_sync(
-    payload: TrafficSyncPayload,
-    db: AsyncSession = Depends(get_db),
-    _: None = Depends(_verify_token),
-):
-    """Receive aggregated traffic stats from a remote VPS agent."""
-    count = 0
-    for stat in payload.stats:
-        period_start = stat.get("period_start", "")
-        period_end = stat.get("period_end", "")
-        try:
-            ps = datetime.fromisoformat(period_start) if period_start else datetime.now(timezone.utc)
-            pe = datetime.fromisoformat(period_end) if period_end else datetime.now(timezone.utc)
-        except (ValueError, TypeError):
-            ps = datetime.now(timezone.utc)
-            pe = datetime.now(timezone.utc)
-
-        entry = TrafficStat(
-            domain=stat.get("domain", ""),
-            vps_id=payload.vps_id,
-            period_start=ps,
-            period_end=pe,
-            requests=stat.get("requests", 0),
-            status_2xx=stat.get("status_2xx", 0),
-            status_3xx=stat.get("status_3xx", 0),
-            status_4xx=stat.get("status_4xx", 0),
-            status_5xx=stat.get("status_5xx", 0),
-            bytes_sent=stat.get("bytes_sent", 0),
-            avg_request_time_ms=stat.get("avg_request_time_ms", 0),
-        )
-        db.add(entry)
-        count += 1
-
-    await db.commit()
-    return {"synced": count}
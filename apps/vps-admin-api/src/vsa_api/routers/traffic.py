@@ -2,12 +2,38 @@
 
 from __future__ import annotations
 
-from fastapi import APIRouter, Query
+import json
+from datetime import UTC, datetime, timedelta
+from typing import TypeVar
 
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from vsa_common import HyperLogLog, LatencyHistogram, TopK
+
+from vsa_api.db.session import get_db
+from vsa_api.db.tables import TrafficStat
 from vsa_api.services.loki import query_logs, query_traffic_stats
 
 router = APIRouter(tags=["traffic"])
 
+_PERIODS = {
+    "1h": timedelta(hours=1),
+    "6h": timedelta(hours=6),
+    "24h": timedelta(hours=24),
+    "7d": timedelta(days=7),
+    "30d": timedelta(days=30),
+}
+
+# ?dimension= of /traffic/top -> column holding the TopK sketch.
+_TOP_COLUMNS = {
+    "uri": TrafficStat.top_uris,
+    "remote_addr": TrafficStat.top_clients,
+    "user_agent": TrafficStat.top_user_agents,
+}
+
+S = TypeVar("S", HyperLogLog, LatencyHistogram, TopK)
+
 
 @router.get("/traffic/stats")
 async def get_traffic_stats(
@@ -27,3 +53,184 @@ async def get_traffic_logs(
     """Get raw traffic logs from Loki."""
     entries = await query_logs(domain=domain, limit=limit, since=since)
     return entries
+
+
+def _merge_into(
+    target: dict[str, S], key: str, raw: str | None, cls: type[S] = LatencyHistogram
+) -> None:
+    if not raw:
+        return
+    try:
+        sketch = cls.from_dict(json.loads(raw))
+    except ValueError:
+        return
+    if key in target:
+        target[key].merge(sketch)
+    else:
+        target[key] = sketch
+
+
+def _window(
+    since: datetime | None, until: datetime | None, period: str
+) -> tuple[datetime, datetime]:
+    until = until or datetime.now(UTC)
+    if since is None:
+        if period not in _PERIODS:
+            raise HTTPException(status_code=400, detail=f"Unknown period '{period}'")
+        since = until - _PERIODS[period]
+    return since, until
+
+
+@router.get("/traffic/latency")
+async def get_traffic_latency(
+    domain: list[str] | None = Query(None),
+    vps_id: list[str] | None = Query(None),
+    since: datetime | None = Query(None),
+    until: datetime | None = Query(None),
+    period: str = Query("24h"),
+    db: AsyncSession = Depends(get_db),
+):
+    """Latency percentiles (ms) merged from the agents' per-minute histograms.
+
+    Covers ``[since, until)``; without ``since`` the last ``period``. Both
+    ``domain`` and ``vps_id`` may be repeated; omitted means all.
+    """
+    since, until = _window(since, until, period)
+
+    query = select(
+        TrafficStat.domain, TrafficStat.latency_sketch, TrafficStat.upstream_latency_sketch
+    ).where(TrafficStat.period_start >= since, TrafficStat.period_start < until)
+    if domain:
+        query = query.where(TrafficStat.domain.in_(domain))
+    if vps_id:
+        query = query.where(TrafficStat.vps_id.in_(vps_id))
+
+    request_time: dict[str, LatencyHistogram] = {}
+    upstream: dict[str, LatencyHistogram] = {}
+    result = await db.stream(query.execution_options(yield_per=1000))
+    async for name, latency_raw, upstream_raw in result:
+        _merge_into(request_time, name, latency_raw)
+        _merge_into(upstream, name, upstream_raw)
+
+    total, total_upstream = LatencyHistogram(), LatencyHistogram()
+    for hist in request_time.values():
+        total.merge(hist)
+    for hist in upstream.values():
+        total_upstream.merge(hist)
+
+    empty = LatencyHistogram()
+    return {
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "request_time": total.percentiles(),
+        "upstream_response_time": total_upstream.percentiles(),
+        "domains": {
+            name: {
+                "request_time": request_time.get(name, empty).percentiles(),
+                "upstream_response_time": upstream.get(name, empty).percentiles(),
+            }
+            for name in sorted(request_time.keys() | upstream.keys())
+        },
+    }
+
+
+@router.get("/traffic/visitors")
+async def get_traffic_visitors(
+    domain: list[str] | None = Query(None),
+    vps_id: list[str] | None = Query(None),
+    since: datetime | None = Query(None),
+    until: datetime | None = Query(None),
+    period: str = Query("24h"),
+    db: AsyncSession = Depends(get_db),
+):
+    """Estimated unique client IPs, from the union of per-minute HyperLogLogs.
+
+    Same window and filters as ``/traffic/latency``. A client seen on two
+    domains counts once in ``unique_visitors`` and once per domain.
+    """
+    since, until = _window(since, until, period)
+
+    query = select(TrafficStat.domain, TrafficStat.visitors_sketch).where(
+        TrafficStat.period_start >= since,
+        TrafficStat.period_start < until,
+        TrafficStat.visitors_sketch.is_not(None),
+    )
+    if domain:
+        query = query.where(TrafficStat.domain.in_(domain))
+    if vps_id:
+        query = query.where(TrafficStat.vps_id.in_(vps_id))
+
+    per_domain: dict[str, HyperLogLog] = {}
+    result = await db.stream(query.execution_options(yield_per=1000))
+    async for name, raw in result:
+        _merge_into(per_domain, name, raw, HyperLogLog)
+
+    total = HyperLogLog()
+    for sketch in per_domain.values():
+        total.merge(sketch)
+
+    return {
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "unique_visitors": total.estimate(),
+        "domains": {name: per_domain[name].estimate() for name in sorted(per_domain)},
+    }
+
+
+def _top_items(sketch: TopK, limit: int) -> list[dict]:
+    return [
+        {"value": value, "count": count, "error": error}
+        for value, count, error in sketch.top(limit)
+    ]
+
+
+@router.get("/traffic/top")
+async def get_traffic_top(
+    dimension: str = Query("uri"),
+    domain: list[str] | None = Query(None),
+    vps_id: list[str] | None = Query(None),
+    since: datetime | None = Query(None),
+    until: datetime | None = Query(None),
+    period: str = Query("24h"),
+    limit: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_db),
+):
+    """Most frequent URIs, client IPs or user agents (``dimension``).
+
+    Merged from the agents' per-minute top-K summaries over the same window
+    and filters as ``/traffic/latency``. Counts are upper bounds: the true
+    count lies within ``error`` below.
+    """
+    column = _TOP_COLUMNS.get(dimension)
+    if column is None:
+        raise HTTPException(status_code=400, detail=f"Unknown dimension '{dimension}'")
+    since, until = _window(since, until, period)
+
+    query = select(TrafficStat.domain, column).where(
+        TrafficStat.period_start >= since,
+        TrafficStat.period_start < until,
+        column.is_not(None),
+    )
+    if domain:
+        query = query.where(TrafficStat.domain.in_(domain))
+    if vps_id:
+        query = query.where(TrafficStat.vps_id.in_(vps_id))
+
+    per_domain: dict[str, TopK] = {}
+    result = await db.stream(query.execution_options(yield_per=1000))
+    async for name, raw in result:
+        _merge_into(per_domain, name, raw, TopK)
+
+    total = TopK()
+    for sketch in per_domain.values():
+        total.merge(sketch)
+
+    return {
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "dimension": dimension,
+        "items": _top_items(total, limit),
+        "domains": {
+            name: _top_items(per_domain[name], limit) for name in sorted(per_domain)
+        },
+    }
@@ -2,29 +2,34 @@
 
 from __future__ import annotations
 
+from typing import Any
+
 from fastapi import APIRouter, Depends
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from vsa_api.db.session import get_db
 from vsa_api.db.tables import VpsNode
+from vsa_api.services.heartbeats import heartbeats
 
 router = APIRouter(tags=["vps"])
 
 
+def node_summary(node: VpsNode) -> dict[str, Any]:
+    """A VPS node as listed by the API, with ``last_seen`` merged from the heartbeat cache."""
+    last_seen = heartbeats.last_seen(node.vps_id, node.last_seen)
+    return {
+        "id": node.id,
+        "vps_id": node.vps_id,
+        "hostname": node.hostname,
+        "ip_address": node.ip_address,
+        "status": node.status,
+        "last_seen": last_seen.isoformat() if last_seen else None,
+    }
+
+
 @router.get("/vps")
 async def list_vps_nodes(db: AsyncSession = Depends(get_db)):
     """List all registered VPS nodes."""
     result = await db.execute(select(VpsNode).order_by(VpsNode.vps_id))
-    nodes = result.scalars().all()
-    return [
-        {
-            "id": n.id,
-            "vps_id": n.vps_id,
-            "hostname": n.hostname,
-            "ip_address": n.ip_address,
-            "status": n.status,
-            "last_seen": n.last_seen.isoformat() if n.last_seen else None,
-        }
-        for n in nodes
-    ]
+    return [node_summary(n) for n in result.scalars().all()]
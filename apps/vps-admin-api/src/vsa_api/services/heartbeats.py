@@ -0,0 +1,134 @@
+"""Coalesced agent heartbeats.
+
+A heartbeat from a known node only moves ``vps_nodes.last_seen`` forward, and
+that column is only ever read as "recent or not". So the hub keeps these
+heartbeats in memory. A background task writes them to the database in one
+batched UPDATE every ``VSA_HEARTBEAT_FLUSH_INTERVAL`` seconds. The same task
+reloads the committed identity of every active node. A heartbeat is only
+coalesced when its hostname and IP match that identity. New nodes, changed
+nodes and heartbeats that arrive before the first flush are written
+immediately, as before. Without the task (interval 0, or outside the app
+lifespan) nothing is known and every heartbeat is written through.
+
+Each worker process keeps its own cache. ``/vps`` merges it with the table,
+so a node's ``last_seen`` as seen through another worker lags by at most one
+interval.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+from datetime import UTC, datetime
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from vsa_api.db.tables import VpsNode
+
+log = logging.getLogger(__name__)
+
+_nodes_table = VpsNode.__table__
+
+
+class HeartbeatCache:
+    """In-memory last-seen times, flushed to ``vps_nodes`` in batches."""
+
+    def __init__(self) -> None:
+        # vps_id -> (id, hostname, ip_address), as last read from the table.
+        self._nodes: dict[str, tuple[int, str, str]] = {}
+        self._pending: dict[str, datetime] = {}
+        self._task: asyncio.Task[None] | None = None
+
+    def touch(self, vps_id: str, hostname: str = "", ip_address: str = "") -> bool:
+        """Record a heartbeat in memory; False if it must be written now."""
+        node = self._nodes.get(vps_id)
+        if node is None:
+            return False
+        if (hostname and hostname != node[1]) or (ip_address and ip_address != node[2]):
+            return False
+        self._pending[vps_id] = datetime.now(UTC)
+        return True
+
+    def last_seen(self, vps_id: str, stored: datetime | None) -> datetime | None:
+        """The later of the stored and the pending last-seen time."""
+        pending = self._pending.get(vps_id)
+        if pending is None or (stored is not None and stored >= pending):
+            return stored
+        return pending
+
+    def forget(self, vps_id: str) -> None:
+        self._nodes.pop(vps_id, None)
+        self._pending.pop(vps_id, None)
+
+    async def flush(self, db: AsyncSession) -> int:
+        """Write pending heartbeats and reload the node identities.
+
+        Returns the number of heartbeats written. On error the pending times
+        are kept for the next flush.
+        """
+        pending, self._pending = self._pending, {}
+        rows = [
+            {"node_id": self._nodes[vps_id][0], "seen": seen}
+            for vps_id, seen in pending.items()
+            if vps_id in self._nodes
+        ]
+        try:
+            if rows:
+                # Core executemany: rows deleted in the meantime match nothing,
+                # and last_seen never moves backwards.
+                await db.execute(
+                    update(_nodes_table)
+                    .where(
+                        _nodes_table.c.id == bindparam("node_id"),
+                        _nodes_table.c.last_seen < bindparam("seen"),
+                    )
+                    .values(last_seen=bindparam("seen")),
+                    rows,
+                )
+            result = await db.execute(
+                select(VpsNode.vps_id, VpsNode.id, VpsNode.hostname, VpsNode.ip_address)
+                .where(VpsNode.status == "active")
+            )
+            nodes = result.all()
+            await db.commit()
+        except Exception:
+            for vps_id, seen in pending.items():
+                self._pending[vps_id] = max(seen, self._pending.get(vps_id, seen))
+            raise
+        self._nodes = {vps_id: (id_, hostname, ip) for vps_id, id_, hostname, ip in nodes}
+        return len(rows)
+
+    async def _flush_logged(self, sessionmaker: async_sessionmaker[AsyncSession]) -> None:
+        try:
+            async with sessionmaker() as db:
+                await self.flush(db)
+        except Exception:
+            log.exception("Heartbeat flush failed")
+
+    async def _run(
+        self, sessionmaker: async_sessionmaker[AsyncSession], interval: float
+    ) -> None:
+        while True:
+            await self._flush_logged(sessionmaker)
+            await asyncio.sleep(interval)
+
+    def start(self, sessionmaker: async_sessionmaker[AsyncSession], interval: float) -> None:
+        """Start flushing every *interval* seconds (no-op if *interval* <= 0)."""
+        if interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run(sessionmaker, interval))
+
+    async def stop(self, sessionmaker: async_sessionmaker[AsyncSession]) -> None:
+        """Stop the flush task, write what is pending and go back to write-through."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+        await self._flush_logged(sessionmaker)
+        self._nodes.clear()
+
+
+heartbeats = HeartbeatCache()
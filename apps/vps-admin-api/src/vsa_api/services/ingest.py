@@ -0,0 +1,162 @@
+"""Bounded in-process queue between the agent endpoints and the database.
+
+Agent endpoints queue the writes that are safe to lose (full snapshots and
+heartbeat write-throughs) and answer ``202``. Audit events and traffic
+aggregates are never queued: the agent drops its copy once they are
+acknowledged, so they are committed inside the request. Writer tasks started
+in the app lifespan take up to ``VSA_AGENT_WRITE_BATCH`` jobs at a time and
+commit them in one transaction. This keeps agent latency and fleet-wide
+bursts away from the database's commit rate.
+
+Every writer has its own queue. Jobs are routed by a hash of the VPS id, so
+the payloads of one VPS are applied in order and never concurrently, and two
+writers never race on the same rows. ``submit`` raises ``asyncio.QueueFull``
+when a writer is ``VSA_AGENT_WRITE_QUEUE_SIZE / VSA_AGENT_WRITERS`` jobs
+behind. The endpoints turn that into ``503`` + ``Retry-After``, and agents
+keep the payload in their outbox. Without running writers (outside the app
+lifespan) ``submit`` returns False, and callers apply the payload inline.
+
+A failed batch is retried job by job, so one bad payload cannot block the
+others. Connection errors are retried with back-off until the database is
+back, while the queue fills up and applies backpressure. A payload that
+fails on its own is logged and dropped. Queued jobs live in memory: on
+shutdown the writers get ``_DRAIN_TIMEOUT`` seconds to finish them, and a
+crash loses what was still queued. Nothing is lost for good: agents resend a
+snapshot until the hub answers ``unchanged`` for its fingerprint.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import zlib
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+log = logging.getLogger(__name__)
+
+Job = Callable[[AsyncSession], Awaitable[Any]]
+
+_DRAIN_TIMEOUT = 30.0
+_MAX_BACKOFF = 30.0
+
+
+def _transient(exc: BaseException) -> bool:
+    """Database unreachable (retry later) rather than a payload it rejects."""
+    if isinstance(exc, DBAPIError) and exc.connection_invalidated:
+        return True
+    return isinstance(exc, (OperationalError, InterfaceError, OSError, TimeoutError))
+
+
+class IngestQueue:
+    """Per-writer bounded queues of jobs, committed in batches."""
+
+    def __init__(self) -> None:
+        self._queues: list[asyncio.Queue[Job]] = []
+        self._writers: list[asyncio.Task[None]] = []
+        self._batch = 1
+
+    @property
+    def running(self) -> bool:
+        return bool(self._writers)
+
+    def load(self) -> float:
+        """Fill level of the fullest writer queue, from 0 to 1."""
+        return max((q.qsize() / q.maxsize for q in self._queues), default=0.0)
+
+    def submit(self, key: str, job: Job) -> bool:
+        """Queue *job* on the writer for *key*; False if no writers are running.
+
+        Raises ``asyncio.QueueFull`` when that writer is saturated.
+        """
+        if not self._writers:
+            return False
+        queue = self._queues[zlib.crc32(key.encode()) % len(self._queues)]
+        queue.put_nowait(job)
+        return True
+
+    async def _commit(
+        self, sessionmaker: async_sessionmaker[AsyncSession], jobs: list[Job]
+    ) -> None:
+        async with sessionmaker() as db:
+            for job in jobs:
+                await job(db)
+            await db.commit()
+
+    async def _apply(
+        self, sessionmaker: async_sessionmaker[AsyncSession], jobs: list[Job]
+    ) -> None:
+        delay = 1.0
+        while True:
+            try:
+                await self._commit(sessionmaker, jobs)
+                return
+            except Exception as exc:
+                if not _transient(exc):
+                    if len(jobs) == 1:
+                        log.exception("Dropping agent payload the database rejected")
+                        return
+                    break
+                log.warning("Agent write failed, retrying in %.0fs: %s", delay, exc)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, _MAX_BACKOFF)
+        for job in jobs:
+            await self._apply(sessionmaker, [job])
+
+    async def _write(
+        self, queue: asyncio.Queue[Job], sessionmaker: async_sessionmaker[AsyncSession]
+    ) -> None:
+        while True:
+            jobs = [await queue.get()]
+            while len(jobs) < self._batch:
+                try:
+                    jobs.append(queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                await self._apply(sessionmaker, jobs)
+            finally:
+                for _ in jobs:
+                    queue.task_done()
+
+    def start(
+        self,
+        sessionmaker: async_sessionmaker[AsyncSession],
+        writers: int,
+        size: int,
+        batch: int,
+    ) -> None:
+        """Start *writers* tasks sharing *size* queue slots (no-op if either is <= 0)."""
+        if writers <= 0 or size <= 0 or self._writers:
+            return
+        self._batch = max(batch, 1)
+        self._queues = [asyncio.Queue(maxsize=max(size // writers, 1)) for _ in range(writers)]
+        self._writers = [
+            asyncio.create_task(self._write(queue, sessionmaker)) for queue in self._queues
+        ]
+
+    async def stop(self) -> None:
+        """Stop accepting jobs, let the writers drain the queues, then cancel them."""
+        writers, self._writers = self._writers, []
+        if not writers:
+            return
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues)), _DRAIN_TIMEOUT
+            )
+        except TimeoutError:
+            lost = sum(queue.qsize() for queue in self._queues)
+            log.error("Shutting down with %d agent payload(s) not written", lost)
+        for task in writers:
+            task.cancel()
+        for task in writers:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._queues = []
+
+
+ingest = IngestQueue()
@@ -0,0 +1,329 @@
+"""Tests for applying agent sync payloads to the database."""
+
+from __future__ import annotations
+
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from sqlalchemy import String, literal_column, select
+
+from vsa_api.db.tables import (
+    AuditLog,
+    Certificate,
+    ContainerEvent,
+    ContainerSnapshot,
+    Domain,
+    TrafficBatch,
+    TrafficStat,
+)
+from vsa_api.routers.agent import (
+    AuditSyncPayload,
+    CertSyncPayload,
+    ContainerSyncPayload,
+    DomainSyncPayload,
+    TrafficSyncPayload,
+    _apply_audit,
+    _apply_certs,
+    _apply_containers,
+    _apply_domains,
+    _apply_traffic,
+    _audit_row,
+    _container_state,
+    _container_status,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+def _event(source_id: int, **extra) -> dict:
+    return {
+        "id": source_id,
+        "timestamp": "2026-01-01T10:00:00+00:00",
+        "actor": "root",
+        "action": "site.provision",
+        "target": "example.com",
+        "params": {"port": 3000},
+        **extra,
+    }
+
+
+class TestAuditRow:
+    def test_payload_vps_id_wins_over_event(self):
+        row = _audit_row(_event(7, vps_id="vps-02"), "vps-01")
+        assert (row["vps_id"], row["source_event_id"]) == ("vps-01", 7)
+        assert row["params"] == '{"port": 3000}'
+
+    def test_legacy_payload_without_vps_id_has_no_dedup_key(self):
+        row = _audit_row(_event(7, vps_id="vps-02"), "")
+        assert (row["vps_id"], row["source_event_id"]) == ("vps-02", None)
+
+
+class TestApplyAudit:
+    async def _rows(self, db) -> list[tuple[str, int | None, str]]:
+        result = await db.execute(
+            select(AuditLog.vps_id, AuditLog.source_event_id, AuditLog.action).order_by(
+                AuditLog.vps_id, AuditLog.source_event_id
+            )
+        )
+        return [tuple(row) for row in result]
+
+    async def test_reingest_is_idempotent(self, db):
+        payload = AuditSyncPayload(vps_id="vps-01", events=[_event(1), _event(2)])
+        assert await _apply_audit(db, payload) == {"synced": 2, "inserted": 2}
+        await db.commit()
+
+        again = AuditSyncPayload(vps_id="vps-01", events=[_event(2), _event(3)])
+        assert await _apply_audit(db, again) == {"synced": 2, "inserted": 1}
+        await db.commit()
+        rows = [r[:2] for r in await self._rows(db)]
+        assert rows == [("vps-01", 1), ("vps-01", 2), ("vps-01", 3)]
+
+    async def test_other_vps_cannot_claim_or_drop_events(self, db):
+        await _apply_audit(db, AuditSyncPayload(vps_id="vps-01", events=[_event(1)]))
+        await db.commit()
+
+        # vps-02 sends the same local id and names vps-01 in the event body.
+        spoofed = AuditSyncPayload(
+            vps_id="vps-02", events=[_event(1, vps_id="vps-01", action="x")]
+        )
+        assert await _apply_audit(db, spoofed) == {"synced": 1, "inserted": 1}
+        await db.commit()
+        assert await self._rows(db) == [
+            ("vps-01", 1, "site.provision"),
+            ("vps-02", 1, "x"),
+        ]
+
+
+async def _snapshot(db, model, *columns) -> dict[str, tuple]:
+    """Rows of *model* by domain, with their xmin (changes whenever a row is rewritten)."""
+    result = await db.execute(
+        select(model.domain, literal_column("xmin").cast(String), model.id, *columns)
+    )
+    return {row[0]: tuple(row[1:]) for row in result}
+
+
+class TestApplyCerts:
+    def _payload(self, vps_id: str, *certs: dict) -> CertSyncPayload:
+        return CertSyncPayload(vps_id=vps_id, certs=list(certs))
+
+    def _cert(self, domain: str, expiry: str = "2026-03-01T00:00:00+00:00", **extra) -> dict:
+        return {"domain": domain, "expiry": expiry, "sans": [domain], **extra}
+
+    async def _apply(self, db, payload: CertSyncPayload) -> dict:
+        result = await _apply_certs(db, payload)
+        await db.commit()
+        return result
+
+    async def test_empty_list_clears_only_this_vps(self, db):
+        await self._apply(db, self._payload("vps-01", self._cert("a.com"), self._cert("b.com")))
+        await self._apply(db, self._payload("vps-02", self._cert("a.com")))
+
+        assert await self._apply(db, self._payload("vps-01")) == {"synced": 0}
+        rows = (await db.execute(select(Certificate.vps_id, Certificate.domain))).all()
+        assert rows == [("vps-02", "a.com")]
+
+    async def test_unchanged_list_leaves_rows_untouched(self, db):
+        payload = self._payload("vps-01", self._cert("a.com"), self._cert("b.com"))
+        await self._apply(db, payload)
+        before = await _snapshot(db, Certificate, Certificate.expiry)
+
+        await self._apply(db, payload)
+        assert await _snapshot(db, Certificate, Certificate.expiry) == before
+
+    async def test_changed_cert_updated_in_place(self, db):
+        await self._apply(db, self._payload("vps-01", self._cert("a.com"), self._cert("b.com")))
+        before = await _snapshot(db, Certificate, Certificate.expiry)
+
+        renewed = self._cert("a.com", expiry="2026-06-01T00:00:00+00:00")
+        await self._apply(db, self._payload("vps-01", renewed, self._cert("b.com")))
+        after = await _snapshot(db, Certificate, Certificate.expiry)
+        assert after["a.com"][1] == before["a.com"][1]  # same id
+        assert after["a.com"][2].month == 6
+        assert after["b.com"] == before["b.com"]
+
+
+class TestApplyDomains:
+    async def _apply(self, db, vps_id: str, *domains: dict) -> dict:
+        result = await _apply_domains(db, DomainSyncPayload(vps_id=vps_id, domains=list(domains)))
+        await db.commit()
+        return result
+
+    async def test_empty_list_clears_only_this_vps(self, db):
+        await self._apply(db, "vps-01", {"domain": "a.com"}, {"domain": "b.com"})
+        await self._apply(db, "vps-02", {"domain": "c.com"})
+
+        assert await self._apply(db, "vps-01") == {"synced": 0}
+        rows = (await db.execute(select(Domain.vps_id, Domain.domain))).all()
+        assert rows == [("vps-02", "c.com")]
+
+    async def test_unchanged_list_leaves_rows_untouched(self, db):
+        domains = [{"domain": "a.com", "container": "web", "port": 8080}, {"domain": "b.com"}]
+        await self._apply(db, "vps-01", *domains)
+        before = await _snapshot(db, Domain, Domain.container)
+
+        await self._apply(db, "vps-01", *domains)
+        assert await _snapshot(db, Domain, Domain.container) == before
+
+    async def test_renamed_container_and_moved_domain_update_in_place(self, db):
+        await self._apply(db, "vps-01", {"domain": "a.com", "container": "web"})
+        await self._apply(db, "vps-02", {"domain": "b.com", "container": "api"})
+        before = await _snapshot(db, Domain, Domain.vps_id, Domain.container)
+
+        await self._apply(
+            db, "vps-01", {"domain": "a.com", "container": "web-v2"}, {"domain": "b.com"}
+        )
+        after = await _snapshot(db, Domain, Domain.vps_id, Domain.container)
+        assert after["a.com"][1:] == (before["a.com"][1], "vps-01", "web-v2")
+        assert after["b.com"][1:] == (before["b.com"][1], "vps-01", "")
+
+
+class TestContainerStatus:
+    @pytest.mark.parametrize(
+        ("raw", "status"),
+        [
+            ("Up 3 minutes", "Up"),
+            ("Up 4 minutes", "Up"),
+            ("Up About an hour (healthy)", "Up (healthy)"),
+            ("Up Less than a second", "Up"),
+            ("Exited (0) 2 days ago", "Exited (0)"),
+            ("Exited (137) About a minute ago", "Exited (137)"),
+            ("Restarting (1) 5 seconds ago", "Restarting (1)"),
+            ("Created", "Created"),
+        ],
+    )
+    def test_durations_stripped(self, raw: str, status: str):
+        assert _container_status(raw) == status
+
+    def test_state_is_first_word(self):
+        assert _container_state("Up (healthy)") == _container_state("Up (unhealthy)") == "Up"
+        assert _container_state("Exited (0)") == "Exited"
+
+
+class TestApplyContainers:
+    async def _sync(self, db, *containers: dict, vps_id: str = "vps-01") -> dict:
+        payload = ContainerSyncPayload(vps_id=vps_id, containers=list(containers))
+        result = await _apply_containers(db, payload)
+        await db.commit()
+        return result
+
+    async def _events(self, db) -> list[tuple]:
+        result = await db.execute(
+            select(
+                ContainerEvent.container_name,
+                ContainerEvent.event,
+                ContainerEvent.from_status,
+                ContainerEvent.to_status,
+            ).order_by(ContainerEvent.id)
+        )
+        return [tuple(row) for row in result]
+
+    async def _snapshots(self, db) -> dict[str, tuple]:
+        result = await db.execute(
+            select(
+                ContainerSnapshot.container_name,
+                ContainerSnapshot.id,
+                ContainerSnapshot.status,
+                ContainerSnapshot.state_since,
+            )
+        )
+        return {row[0]: tuple(row[1:]) for row in result}
+
+    async def test_only_real_transitions_create_events(self, db):
+        web = {"name": "web", "image": "nginx:1.25", "status": "Up 3 minutes", "ports": "80"}
+        assert await self._sync(db, web) == {"synced": 1, "added": 1, "changed": 0, "removed": 0}
+        first = await self._snapshots(db)
+
+        # Only the uptime moved: nothing is written.
+        result = await self._sync(db, {**web, "status": "Up 4 minutes"})
+        assert result == {"synced": 1, "added": 0, "changed": 0, "removed": 0}
+        assert await self._snapshots(db) == first
+
+        # Health changes within the same state: state_since is kept.
+        await self._sync(db, {**web, "status": "Up 5 minutes (unhealthy)"})
+        await self._sync(db, {**web, "status": "Exited (137) 1 second ago"})
+        await self._sync(db, {**web, "status": "Up Less than a second"})
+        last = await self._snapshots(db)
+        assert last["web"][:2] == (first["web"][0], "Up")
+        assert last["web"][2] > first["web"][2]
+
+        assert await self._events(db) == [
+            ("web", "added", None, "Up"),
+            ("web", "changed", "Up", "Up (unhealthy)"),
+            ("web", "changed", "Up (unhealthy)", "Exited (137)"),
+            ("web", "changed", "Exited (137)", "Up"),
+        ]
+
+    async def test_state_since_kept_within_a_state(self, db):
+        web = {"name": "web", "image": "nginx", "status": "Up 1 minute"}
+        await self._sync(db, web)
+        since = (await self._snapshots(db))["web"][2]
+        await self._sync(db, {**web, "status": "Up 2 minutes (healthy)"})
+        assert (await self._snapshots(db))["web"][1:] == ("Up (healthy)", since)
+
+    async def test_removed_container_deleted_with_event(self, db):
+        web = {"name": "web", "image": "nginx", "status": "Up 1 minute"}
+        worker = {"name": "worker", "image": "app", "status": "Exited (0) 3 hours ago"}
+        await self._sync(db, web, worker)
+        await self._sync(db, web, vps_id="vps-02")
+
+        result = await self._sync(db, {**web, "status": "Up 2 minutes"})
+        assert result == {"synced": 1, "added": 0, "changed": 0, "removed": 1}
+        rows = (
+            await db.execute(select(ContainerSnapshot.vps_id, ContainerSnapshot.container_name))
+        ).all()
+        assert sorted(rows) == [("vps-01", "web"), ("vps-02", "web")]
+        assert (await self._events(db))[-1] == ("worker", "removed", "Exited (0)", None)
+
+        assert (await self._sync(db))["removed"] == 1
+        assert (await self._events(db))[-1] == ("web", "removed", "Up", None)
+
+
+class TestApplyTraffic:
+    def _stat(self, requests: int, domain: str = "example.com") -> dict:
+        return {
+            "domain": domain,
+            "period_start": "2026-01-01T10:00:00+00:00",
+            "period_end": "2026-01-01T10:01:00+00:00",
+            "requests": requests,
+            "status_2xx": requests,
+            "request_time_ms_total": 10 * requests,
+        }
+
+    async def _apply(self, db, requests: int, batch_id: str | None, vps_id: str = "vps-01"):
+        payload = TrafficSyncPayload(
+            vps_id=vps_id, stats=[self._stat(requests)], batch_id=batch_id
+        )
+        result = await _apply_traffic(db, payload)
+        await db.commit()
+        return result
+
+    async def _requests(self, db) -> dict[str, int]:
+        db.expire_all()
+        result = await db.execute(select(TrafficStat.vps_id, TrafficStat.requests))
+        return dict(result.all())
+
+    async def test_resent_batch_counted_once(self, db):
+        assert await self._apply(db, 3, "batch-1") == {"synced": 1}
+        assert await self._apply(db, 3, "batch-1") == {"synced": 0, "duplicate": True}
+        assert await self._apply(db, 2, "batch-2") == {"synced": 1}
+        assert await self._requests(db) == {"vps-01": 5}
+
+    async def test_batch_ids_are_per_vps(self, db):
+        await self._apply(db, 3, "batch-1")
+        await self._apply(db, 4, "batch-1", vps_id="vps-02")
+        assert await self._requests(db) == {"vps-01": 3, "vps-02": 4}
+
+    async def test_batches_without_id_are_summed(self, db):
+        await self._apply(db, 3, None)
+        await self._apply(db, 3, None)
+        assert await self._requests(db) == {"vps-01": 6}
+
+    async def test_old_batch_ids_are_pruned(self, db):
+        old = datetime.now(UTC) - timedelta(days=30)
+        db.add(TrafficBatch(vps_id="vps-01", batch_id="old", applied_at=old))
+        db.add(TrafficBatch(vps_id="vps-02", batch_id="old", applied_at=old))
+        await db.commit()
+
+        await self._apply(db, 1, "new")
+        rows = (await db.execute(select(TrafficBatch.vps_id, TrafficBatch.batch_id))).all()
+        assert sorted(rows) == [("vps-01", "new"), ("vps-02", "old")]
@@ -0,0 +1,159 @@
+"""Tests for the coalesced heartbeat cache."""
+
+from __future__ import annotations
+
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from vsa_api.db.tables import VpsNode
+from vsa_api.routers import vps
+from vsa_api.services.heartbeats import HeartbeatCache
+
+pytestmark = pytest.mark.anyio
+
+_T0 = datetime(2026, 1, 1, 10, 0, tzinfo=UTC)
+
+
+def _known(*vps_ids: str) -> HeartbeatCache:
+    cache = HeartbeatCache()
+    cache._nodes = {
+        vps_id: (i, f"{vps_id}.host", "10.0.0.1") for i, vps_id in enumerate(vps_ids, 1)
+    }
+    return cache
+
+
+async def _add_node(db, vps_id: str, last_seen: datetime = _T0, **extra) -> VpsNode:
+    node = VpsNode(
+        vps_id=vps_id,
+        hostname=f"{vps_id}.host",
+        ip_address="10.0.0.1",
+        last_seen=last_seen,
+        **extra,
+    )
+    db.add(node)
+    await db.commit()
+    return node
+
+
+async def _last_seen(db, vps_id: str) -> datetime:
+    db.expire_all()
+    result = await db.execute(select(VpsNode.last_seen).where(VpsNode.vps_id == vps_id))
+    return result.scalar_one()
+
+
+class TestTouch:
+    def test_unknown_node_is_written_through(self):
+        cache = _known("vps-01")
+        assert cache.touch("vps-02") is False
+        assert cache.last_seen("vps-02", _T0) == _T0
+
+    def test_known_node_is_coalesced(self):
+        cache = _known("vps-01")
+        assert cache.touch("vps-01", "vps-01.host", "10.0.0.1") is True
+        assert cache.last_seen("vps-01", _T0) > _T0
+
+    @pytest.mark.parametrize("hostname, ip", [("renamed", "10.0.0.1"), ("vps-01.host", "10.0.0.9")])
+    def test_changed_identity_is_written_through(self, hostname, ip):
+        cache = _known("vps-01")
+        assert cache.touch("vps-01", hostname, ip) is False
+        assert cache.last_seen("vps-01", _T0) == _T0
+
+    def test_empty_identity_fields_match(self):
+        assert _known("vps-01").touch("vps-01") is True
+
+
+class TestLastSeen:
+    def test_later_value_wins(self):
+        cache = _known("vps-01")
+        cache.touch("vps-01")
+        pending = cache.last_seen("vps-01", None)
+        assert pending is not None
+        assert cache.last_seen("vps-01", _T0) == pending
+        later = pending + timedelta(seconds=5)
+        assert cache.last_seen("vps-01", later) == later
+
+    def test_forget_drops_pending_and_identity(self):
+        cache = _known("vps-01")
+        cache.touch("vps-01")
+        cache.forget("vps-01")
+        assert cache.last_seen("vps-01", _T0) == _T0
+        assert cache.touch("vps-01") is False
+
+
+class TestFlush:
+    async def test_loads_identities_of_active_nodes(self, db):
+        await _add_node(db, "vps-01")
+        await _add_node(db, "vps-02", status="removed")
+        cache = HeartbeatCache()
+
+        assert await cache.flush(db) == 0
+        assert cache.touch("vps-01", "vps-01.host", "10.0.0.1") is True
+        assert cache.touch("vps-02") is False
+
+    async def test_writes_pending_heartbeats_in_one_batch(self, db):
+        await _add_node(db, "vps-01")
+        await _add_node(db, "vps-02")
+        await _add_node(db, "vps-03")
+        cache = HeartbeatCache()
+        await cache.flush(db)
+        cache.touch("vps-01")
+        cache.touch("vps-02")
+        seen = cache.last_seen("vps-01", None)
+
+        assert await cache.flush(db) == 2
+        assert await _last_seen(db, "vps-01") == seen
+        assert await _last_seen(db, "vps-02") > _T0
+        assert await _last_seen(db, "vps-03") == _T0
+        # Nothing pending any more.
+        assert await cache.flush(db) == 0
+
+    async def test_never_moves_last_seen_backwards(self, db):
+        future = datetime.now(UTC) + timedelta(hours=1)
+        await _add_node(db, "vps-01", last_seen=future)
+        cache = HeartbeatCache()
+        await cache.flush(db)
+        cache.touch("vps-01")
+
+        await cache.flush(db)
+        assert await _last_seen(db, "vps-01") == future
+
+    async def test_deleted_node_matches_nothing(self, db):
+        node = await _add_node(db, "vps-01")
+        cache = HeartbeatCache()
+        await cache.flush(db)
+        cache.touch("vps-01")
+        await db.delete(node)
+        await db.commit()
+
+        await cache.flush(db)
+        assert cache.touch("vps-01") is False
+
+    async def test_failed_flush_keeps_pending(self):
+        cache = _known("vps-01")
+        cache.touch("vps-01")
+        seen = cache.last_seen("vps-01", None)
+
+        class Broken:
+            async def execute(self, *args, **kwargs):
+                raise RuntimeError("db down")
+
+        with pytest.raises(RuntimeError):
+            await cache.flush(Broken())
+        assert cache.last_seen("vps-01", None) == seen
+
+
+class TestListVps:
+    async def test_merges_cached_and_stored_last_seen(self, db, monkeypatch):
+        await _add_node(db, "vps-01")
+        await _add_node(db, "vps-02")
+        cache = HeartbeatCache()
+        await cache.flush(db)
+        monkeypatch.setattr(vps, "heartbeats", cache)
+        cache.touch("vps-01")
+        pending = cache.last_seen("vps-01", None)
+
+        nodes = {n["vps_id"]: n for n in await vps.list_vps_nodes(db)}
+        assert nodes["vps-01"]["last_seen"] == pending.isoformat()
+        assert nodes["vps-02"]["last_seen"] == _T0.isoformat()
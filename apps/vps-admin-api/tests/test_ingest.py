@@ -0,0 +1,219 @@
+"""Tests for the agent write queue and how the endpoints use it."""
+
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException, Response
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+
+from vsa_api.db.tables import AuditLog, ContainerSnapshot, SyncFingerprint
+from vsa_api.routers import agent
+from vsa_api.routers.agent import AuditSyncPayload, ContainerSyncPayload, DomainSyncPayload
+from vsa_api.services import ingest as ingest_module
+from vsa_api.services.ingest import IngestQueue
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeSession:
+    """Collects writes and publishes them to the store on commit."""
+
+    def __init__(self, store: list[str]) -> None:
+        self.store = store
+        self.writes: list[str] = []
+
+    async def __aenter__(self) -> FakeSession:
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.writes = []
+
+    async def commit(self) -> None:
+        self.store.extend(self.writes)
+        self.writes = []
+
+
+class FakeSessionmaker:
+    def __init__(self) -> None:
+        self.committed: list[str] = []
+        self.sessions = 0
+
+    def __call__(self) -> FakeSession:
+        self.sessions += 1
+        return FakeSession(self.committed)
+
+
+def _job(name: str, error: BaseException | None = None):
+    async def job(db: FakeSession) -> None:
+        if error is not None:
+            raise error
+        db.writes.append(name)
+
+    return job
+
+
+def _connection_lost() -> OperationalError:
+    return OperationalError("COMMIT", {}, ConnectionRefusedError("connection refused"))
+
+
+class TestSubmit:
+    def test_without_writers_returns_false(self):
+        assert IngestQueue().submit("vps-01", _job("a")) is False
+
+    async def test_one_vps_always_goes_to_the_same_writer(self):
+        queue = IngestQueue()
+        queue.start(FakeSessionmaker(), writers=4, size=100, batch=10)
+        for i in range(5):
+            assert queue.submit("vps-01", _job(f"a{i}")) is True
+        assert sorted(q.qsize() for q in queue._queues) == [0, 0, 0, 5]
+        await queue.stop()
+
+    async def test_full_writer_queue_raises(self):
+        queue = IngestQueue()
+        queue.start(FakeSessionmaker(), writers=2, size=2, batch=1)
+        queue.submit("vps-01", _job("a"))
+        assert queue.load() == 1.0
+        with pytest.raises(asyncio.QueueFull):
+            queue.submit("vps-01", _job("b"))
+        await queue.stop()
+
+
+class TestApply:
+    async def test_batch_is_one_transaction(self):
+        maker = FakeSessionmaker()
+        await IngestQueue()._apply(maker, [_job("a"), _job("b"), _job("c")])
+        assert (maker.committed, maker.sessions) == (["a", "b", "c"], 1)
+
+    async def test_rejected_payload_is_dropped_alone(self):
+        maker = FakeSessionmaker()
+        jobs = [_job("a"), _job("b", ValueError("bad payload")), _job("c")]
+        await IngestQueue()._apply(maker, jobs)
+        assert maker.committed == ["a", "c"]
+
+    async def test_transient_errors_back_off_until_written(self, monkeypatch):
+        delays: list[float] = []
+
+        async def sleep(delay: float) -> None:
+            delays.append(delay)
+
+        monkeypatch.setattr(ingest_module.asyncio, "sleep", sleep)
+        failures = [_connection_lost() for _ in range(3)]
+
+        async def flaky(db: FakeSession) -> None:
+            if failures:
+                raise failures.pop()
+            db.writes.append("a")
+
+        maker = FakeSessionmaker()
+        await IngestQueue()._apply(maker, [flaky, _job("b")])
+        assert maker.committed == ["a", "b"]
+        assert delays == [1.0, 2.0, 4.0]
+
+
+class TestStop:
+    async def test_drains_queued_jobs(self):
+        maker = FakeSessionmaker()
+        queue = IngestQueue()
+        queue.start(maker, writers=2, size=100, batch=3)
+        for i in range(10):
+            queue.submit(f"vps-{i % 3}", _job(str(i)))
+        await queue.stop()
+        assert sorted(maker.committed, key=int) == [str(i) for i in range(10)]
+        assert not queue.running
+        assert queue.submit("vps-01", _job("late")) is False
+
+    async def test_gives_up_after_drain_timeout(self, monkeypatch):
+        monkeypatch.setattr(ingest_module, "_DRAIN_TIMEOUT", 0.05)
+        stuck = asyncio.Event()
+
+        async def blocked(db: FakeSession) -> None:
+            await stuck.wait()
+
+        maker = FakeSessionmaker()
+        queue = IngestQueue()
+        queue.start(maker, writers=1, size=10, batch=1)
+        queue.submit("vps-01", blocked)
+        queue.submit("vps-01", _job("a"))
+        await queue.stop()
+        assert maker.committed == []
+        assert not queue.running
+
+
+class TestIngest:
+    async def test_full_queue_answers_503_before_writing(self, monkeypatch):
+        queue = IngestQueue()
+        queue.start(FakeSessionmaker(), writers=1, size=1, batch=1)
+        monkeypatch.setattr(agent, "ingest", queue)
+        queue.submit("vps-01", _job("a"))
+
+        sections = {
+            "containers": ContainerSyncPayload(vps_id="vps-01", containers=[]),
+            "audit": AuditSyncPayload(vps_id="vps-01", events=[{"id": 1}]),
+        }
+        # db=None: the audit section must not be applied once the queue is full.
+        with pytest.raises(HTTPException) as exc:
+            await agent._ingest(Response(), None, "vps-01", sections)
+        assert exc.value.status_code == 503
+        assert "Retry-After" in exc.value.headers
+        await queue.stop()
+
+    async def test_deltas_are_committed_before_the_response(
+        self, db, sessionmaker, monkeypatch
+    ):
+        queue = IngestQueue()
+        queue.start(sessionmaker, writers=1, size=10, batch=10)
+        monkeypatch.setattr(agent, "ingest", queue)
+        blocked = asyncio.Event()
+
+        async def hold(session) -> None:
+            await blocked.wait()
+
+        queue.submit("vps-01", hold)  # keeps the writer busy
+        event = {"id": 1, "timestamp": "2026-01-01T10:00:00+00:00", "action": "site.provision"}
+        sections = {
+            "containers": ContainerSyncPayload(
+                vps_id="vps-01", containers=[{"name": "web", "status": "Up 2 hours"}]
+            ),
+            "audit": AuditSyncPayload(vps_id="vps-01", events=[event]),
+        }
+        response = Response()
+        results = await agent._ingest(response, db, "vps-01", sections)
+
+        assert response.status_code == 202
+        assert results["containers"] == {"status": "accepted"}
+        assert results["audit"] == {"synced": 1, "inserted": 1}
+        async with sessionmaker() as other:
+            assert await other.scalar(select(AuditLog.action)) == "site.provision"
+            assert await other.scalar(select(ContainerSnapshot.container_name)) is None
+
+        blocked.set()
+        await queue.stop()
+        async with sessionmaker() as other:
+            assert await other.scalar(select(ContainerSnapshot.container_name)) == "web"
+
+    async def test_full_snapshot_with_stored_fingerprint_is_unchanged(
+        self, db, sessionmaker, monkeypatch
+    ):
+        queue = IngestQueue()
+        queue.start(sessionmaker, writers=1, size=10, batch=10)
+        monkeypatch.setattr(agent, "ingest", queue)
+        db.add(SyncFingerprint(vps_id="vps-01", section="domains", fingerprint="fp-1"))
+        await db.commit()
+        domains = [{"domain": "a.com", "container": "a", "port": 80}]
+
+        response = Response()
+        same = DomainSyncPayload(vps_id="vps-01", domains=domains, fingerprint="fp-1")
+        results = await agent._ingest(response, db, "vps-01", {"domains": same})
+        assert results["domains"] == {"status": "unchanged"}
+        assert response.status_code == 200
+        assert queue.load() == 0.0
+
+        changed = DomainSyncPayload(vps_id="vps-01", domains=domains, fingerprint="fp-2")
+        results = await agent._ingest(response, db, "vps-01", {"domains": changed})
+        assert results["domains"] == {"status": "accepted"}
+        await queue.stop()
+        async with sessionmaker() as other:
+            assert await other.scalar(select(SyncFingerprint.fingerprint)) == "fp-2"
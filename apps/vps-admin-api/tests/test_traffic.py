@@ -0,0 +1,51 @@
+"""Tests for decoding stored traffic sketches."""
+
+from __future__ import annotations
+
+import json
+
+import pytest
+from vsa_common import HyperLogLog, LatencyHistogram, TopK
+
+from vsa_api.routers.agent import _stored_sketch
+from vsa_api.routers.traffic import _merge_into
+
+_CORRUPT = [
+    "{not json",
+    "[1, 2]",
+    '{"gamma": 1.040816, "bins": 7}',
+    '{"items": [["a"]]}',
+    '{"p": 11, "registers": "eJzt"}',
+    '{"p": 11, "registers": 5}',
+]
+
+
+@pytest.mark.parametrize("cls", [LatencyHistogram, TopK, HyperLogLog])
+@pytest.mark.parametrize("raw", _CORRUPT)
+def test_merge_into_skips_corrupt_rows(cls, raw):
+    good = cls()
+    if isinstance(good, LatencyHistogram):
+        good.add(12.0)
+    else:
+        good.add("a")
+    target: dict = {}
+    _merge_into(target, "example.com", raw, cls)
+    _merge_into(target, "example.com", json.dumps(good.to_dict()), cls)
+    _merge_into(target, "example.com", raw, cls)
+    assert list(target) == ["example.com"]
+    assert target["example.com"].to_dict() == good.to_dict()
+
+
+@pytest.mark.parametrize(
+    ("col", "raw"),
+    [
+        ("latency_sketch", "{not json"),
+        ("latency_sketch", '{"gamma": 1.040816, "bins": 7}'),
+        ("top_uris", '{"items": [["a"]]}'),
+        ("top_clients", "[1, 2]"),
+        ("visitors_sketch", '{"p": 11, "registers": "eJzt"}'),
+        ("visitors_sketch", '{"p": 11, "registers": 5}'),
+    ],
+)
+def test_stored_sketch_corrupt_is_none(col, raw):
+    assert _stored_sketch(col, raw) is None
@@ -0,0 +1,216 @@
+"""Benchmark the access-log parser against the original line-by-line version.
+
+Generates a synthetic ``json_detailed`` access log (same layout as
+``stacks/reverse-proxy/nginx/snippets/log_format_json.conf``) and reports
+lines per second for both implementations, checking that they agree.
+
+    uv run python benchmarks/bench_access_log.py --size-mb 4096
+    uv run python benchmarks/bench_access_log.py --log /var/log/nginx/domains/x.access.json
+    uv run python benchmarks/bench_access_log.py --size-mb 2048 --parallel 4
+
+``--parallel N`` additionally times ``collect_traffic_stats`` over N domain
+logs, in-process versus the process pool (ranges within each file included).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+from vsa.services import agent_sync
+from vsa.services.access_log import orjson, parse_access_log
+
+_URIS = ["/", "/api/v1/items?page=2", "/static/app.3f9a1c.js", "/login", "/img/logo.svg"]
+_AGENTS = [
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148",
+    "curl/8.5.0",
+]
+_STATUSES = [200] * 80 + [301, 304] * 5 + [404] * 6 + [500, 502]
+
+
+def _line(rng: random.Random, ts: datetime) -> str:
+    # Built by hand (not json.dumps) to match nginx's key order and spacing.
+    return (
+        f'{{"time":"{ts.isoformat()}","domain":"example.com",'
+        f'"remote_addr":"203.0.113.{rng.randrange(256)}","method":"GET",'
+        f'"uri":"{rng.choice(_URIS)}","status":{rng.choice(_STATUSES)},'
+        f'"body_bytes_sent":{rng.randrange(100, 200_000)},'
+        f'"request_time":{rng.randrange(1, 3000) / 1000:.3f},'
+        f'"upstream_response_time":"0.002","upstream_addr":"172.18.0.5:3000",'
+        f'"http_referer":"","http_user_agent":"{rng.choice(_AGENTS)}",'
+        f'"http_x_forwarded_for":"","server_protocol":"HTTP/1.1"}}\n'
+    )
+
+
+def generate(path: Path, size_mb: int, seed: int = 1) -> None:
+    """Write roughly *size_mb* MiB of synthetic log lines to *path*."""
+    rng = random.Random(seed)
+    ts = datetime(2026, 1, 1, tzinfo=UTC)
+    target = size_mb * 1024 * 1024
+    written = 0
+    with open(path, "w") as f:
+        while written < target:
+            block = []
+            for _ in range(10_000):
+                ts += timedelta(milliseconds=rng.randrange(0, 50))
+                block.append(_line(rng, ts.replace(microsecond=0)))
+            data = "".join(block)
+            f.write(data)
+            written += len(data)
+
+
+def legacy_parse(path: Path) -> dict[str, Any]:
+    """The original ``collect_traffic_stats`` loop (text mode, json.loads per line)."""
+    requests = status_2xx = status_3xx = status_4xx = status_5xx = bytes_sent = 0
+    total_request_time = 0.0
+    period_start: str | None = None
+    period_end: str | None = None
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            requests += 1
+            status = entry.get("status", 0)
+            if isinstance(status, str):
+                try:
+                    status = int(status)
+                except ValueError:
+                    status = 0
+            if 200 <= status < 300:
+                status_2xx += 1
+            elif 300 <= status < 400:
+                status_3xx += 1
+            elif 400 <= status < 500:
+                status_4xx += 1
+            elif 500 <= status < 600:
+                status_5xx += 1
+            bs = entry.get("body_bytes_sent", 0)
+            if isinstance(bs, str):
+                try:
+                    bs = int(bs)
+                except ValueError:
+                    bs = 0
+            bytes_sent += bs
+            rt = entry.get("request_time", 0)
+            if isinstance(rt, str):
+                try:
+                    rt = float(rt)
+                except ValueError:
+                    rt = 0.0
+            total_request_time += rt
+            ts = entry.get("time", "")
+            if ts:
+                if period_start is None:
+                    period_start = ts
+                period_end = ts
+    return {
+        "domain": "example.com",
+        "requests": requests,
+        "status_2xx": status_2xx,
+        "status_3xx": status_3xx,
+        "status_4xx": status_4xx,
+        "status_5xx": status_5xx,
+        "bytes_sent": bytes_sent,
+        "avg_request_time_ms": int((total_request_time / requests) * 1000) if requests else 0,
+        "period_start": period_start or "",
+        "period_end": period_end or "",
+    }
+
+
+def fast_parse(path: Path) -> dict[str, Any]:
+    buckets, _ = parse_access_log(path, 0)
+    stat = buckets.total().to_stat("example.com")
+    # Fields the original implementation did not produce.
+    for key in ("request_time_ms_total", "latency", "upstream_latency", "top", "visitors"):
+        stat.pop(key, None)
+    return stat
+
+
+def _timed(fn, path: Path) -> tuple[dict[str, Any], float]:
+    started = time.perf_counter()
+    result = fn(path)
+    return result, time.perf_counter() - started
+
+
+def bench_parallel(path: Path, files: int) -> None:
+    """Time collect_traffic_stats over *files* copies of *path*, serial vs pool."""
+    log_dir = path.parent / "domains"
+    log_dir.mkdir(exist_ok=True)
+    for i in range(files):
+        target = log_dir / f"site{i}.example.com.access.json"
+        if not target.exists():
+            try:
+                os.link(path, target)
+            except OSError:
+                shutil.copy(path, target)
+    total_mb = files * path.stat().st_size / (1024 * 1024)
+    print(f"collect_traffic_stats over {files} logs ({total_mb:.0f} MiB), {os.cpu_count()} CPUs")
+
+    timings = {}
+    for label, threshold in (("in-process", 1 << 62), ("process pool", 0)):
+        agent_sync._PARALLEL_MIN_BYTES = threshold
+        started = time.perf_counter()
+        stats, _ = agent_sync.collect_traffic_stats(log_dir, {})
+        timings[label] = time.perf_counter() - started
+        lines = sum(s["requests"] for s in stats)
+        print(f"  {label:<12}: {lines / timings[label]:>12,.0f} lines/s")
+    agent_sync._traffic_pool().shutdown()
+    print(f"  speedup    : {timings['in-process'] / timings['process pool']:.1f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=512, help="synthetic log size (MiB)")
+    parser.add_argument("--log", type=Path, help="benchmark an existing log instead")
+    parser.add_argument("--skip-legacy", action="store_true", help="only time the new parser")
+    parser.add_argument(
+        "--parallel", type=int, metavar="N", help="also time N logs serial vs process pool"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.log
+        if path is None:
+            path = Path(tmp) / "example.com.access.json"
+            print(f"Generating {args.size_mb} MiB of json_detailed lines...")
+            generate(path, args.size_mb)
+        size_mb = path.stat().st_size / (1024 * 1024)
+        print(f"Log: {path} ({size_mb:.0f} MiB), orjson: {'yes' if orjson else 'no'}")
+
+        fast, fast_s = _timed(fast_parse, path)
+        lines = fast["requests"]
+        print(f"  new parser : {lines / fast_s:>12,.0f} lines/s  {size_mb / fast_s:>8.1f} MiB/s")
+
+        if not args.skip_legacy:
+            legacy, legacy_s = _timed(legacy_parse, path)
+            print(
+                f"  legacy     : {lines / legacy_s:>12,.0f} lines/s  "
+                f"{size_mb / legacy_s:>8.1f} MiB/s"
+            )
+            print(f"  speedup    : {legacy_s / fast_s:.1f}x")
+            if legacy != fast:
+                raise SystemExit(f"Results differ:\n  legacy {legacy}\n  new    {fast}")
+            print("  results identical")
+
+        if args.parallel:
+            if args.log is not None:
+                raise SystemExit("--parallel only works with a generated log")
+            bench_parallel(path, args.parallel)
+
+
+if __name__ == "__main__":
+    main()
@@ -36,12 +36,11 @@ def register(
         f"VSA_AGENT_TOKEN={token}\n"
     )
     console.print(f"[green]Agent registered.[/green] Config written to {AGENT_ENV_PATH}")
-    console.print("Start the agent with: vsa agent start")
+    console.print("Start the agent with: vsa agent run (or vsa agent start for a single cycle)")
 
 
-@app.command()
-def start() -> None:
-    """Run one sync cycle (heartbeat, containers, certs, domains, audit)."""
+def _require_hub_env() -> tuple[str, str]:
+    """Return (hub_url, token) from agent.env or exit with an error."""
     env = _load_agent_env()
     if not env:
         console.print("[red]Agent not registered. Run 'vsa agent register' first.[/red]")
@@ -52,12 +51,84 @@ def start() -> None:
     if not hub_url or not token:
         console.print("[red]Missing VSA_HUB_URL or VSA_AGENT_TOKEN in agent.env[/red]")
         raise typer.Exit(1)
+    return hub_url, token
+
+
+def _parse_intervals(values: list[str]) -> dict[str, float]:
+    """Parse ``key=seconds`` overrides (e.g. ``traffic=10``)."""
+    from vsa.services.agent_sync import _STEPS
+
+    known = {step.key for step in _STEPS}
+    intervals: dict[str, float] = {}
+    for value in values:
+        key, sep, seconds = value.partition("=")
+        key = key.strip()
+        if not sep or key not in known:
+            raise typer.BadParameter(
+                f"Expected KEY=SECONDS with KEY in {', '.join(sorted(known))}, got '{value}'"
+            )
+        try:
+            intervals[key] = float(seconds)
+        except ValueError:
+            raise typer.BadParameter(f"Invalid interval '{seconds}' for {key}") from None
+        if intervals[key] <= 0:
+            raise typer.BadParameter(f"Interval for {key} must be positive")
+    return intervals
+
+
+_SPLAY_HELP = "Spread agents over up to this many seconds (fixed offset per VPS id)"
+
+
+@app.command()
+def start(
+    splay: float = typer.Option(0.0, "--splay", min=0.0, help=_SPLAY_HELP),
+) -> None:
+    """Run one sync cycle (heartbeat, containers, certs, domains, audit)."""
+    hub_url, token = _require_hub_env()
 
     console.print(f"[bold]Syncing with {hub_url} ...[/bold]")
 
     from vsa.services.agent_sync import run_sync
 
-    run_sync(hub_url, token)
+    run_sync(hub_url, token, splay=splay)
+
+
+@app.command()
+def run(
+    interval: list[str] = typer.Option(
+        [],
+        "--interval",
+        "-i",
+        help="Override a collector interval, e.g. 'heartbeat=15' (repeatable)",
+    ),
+    stream_traffic: bool = typer.Option(
+        False,
+        "--stream-traffic",
+        help="Watch access logs with inotify and push traffic as lines arrive",
+    ),
+    stream_interval: float = typer.Option(
+        2.0,
+        "--stream-interval",
+        min=0.1,
+        help="Minimum seconds between streamed traffic pushes",
+    ),
+    splay: float = typer.Option(30.0, "--splay", min=0.0, help=_SPLAY_HELP),
+) -> None:
+    """Run the agent as a long-lived daemon with per-collector schedules."""
+    hub_url, token = _require_hub_env()
+    intervals = _parse_intervals(interval)
+
+    console.print(f"[bold]Agent running against {hub_url} (Ctrl-C or SIGTERM to stop)[/bold]")
+
+    from vsa.services.agent_sync import run_daemon
+
+    run_daemon(
+        hub_url,
+        token,
+        intervals,
+        stream_traffic=stream_interval if stream_traffic else None,
+        splay=splay,
+    )
 
 
 @app.command()
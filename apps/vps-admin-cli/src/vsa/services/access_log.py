@@ -0,0 +1,505 @@
+"""Fast incremental parser for the nginx ``json_detailed`` access logs.
+
+``json_detailed`` (``stacks/reverse-proxy/nginx/snippets/log_format_json.conf``)
+writes one JSON object per line with a fixed key order. The traffic
+aggregator only needs five of its fields (``time``, ``status``,
+``body_bytes_sent``, ``request_time``, ``upstream_response_time``) plus the
+keys of the heavy-hitter summaries, so instead of decoding every line into a
+dict, the log is read in binary chunks and those fields are pulled out of the
+whole chunk by one regular expression that walks each line once. Chunks in a
+slightly different layout (missing or extra keys) are retried with one
+expression per field; lines that match neither (hand-written entries, a
+different format) fall back to a full JSON decode per line, using ``orjson``
+when installed.
+
+Requests are aggregated into fixed one-minute buckets keyed by the bucket
+start (``2026-01-01T10:04:00+00:00``), so a spike keeps its own row instead
+of being averaged into whatever window the agent happened to read. Each
+bucket also carries mergeable latency histograms (``vsa_common.sketches``)
+of ``request_time`` and ``upstream_response_time`` for percentiles, and
+bounded top-K summaries of ``uri``, ``remote_addr`` and ``http_user_agent``
+to find whoever is hammering a domain, and a HyperLogLog of ``remote_addr``
+for unique-visitor counts over any range of buckets.
+
+Only complete lines are consumed: a line still being written by nginx is left
+for the next run, and the returned offset points just past the last newline.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from collections import Counter
+from collections.abc import Sequence
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+from vsa_common.sketches import HyperLogLog, LatencyHistogram, TopK
+
+try:
+    import orjson
+except ImportError:  # optional: pip install vsa-cli[speedups]
+    orjson = None
+
+CHUNK_SIZE = 1024 * 1024
+BUCKET_SECONDS = 60
+
+# escape=json escapes quotes inside values, so ``{"time":"`` and
+# ``"status":`` can only match the real keys, at most once per line.
+# Numbers are unquoted in json_detailed but tolerated quoted. Values that
+# may hold escaped quotes (\") but never bare ones match _ESCAPED.
+_ESCAPED = rb'[^"\\]*(?:\\.[^"\\]*)*'
+_TIME_RE = re.compile(rb'\{"time":"([^"]*)"')
+_FIELDS = (
+    rb'"status":"?(\d+)"?,'
+    rb'"body_bytes_sent":"?(\d+)"?,'
+    rb'"request_time":"?([\d.]+)"?'
+    rb'(?:,"upstream_response_time":"([^"]*)")?'
+)
+_FIELDS_RE = re.compile(_FIELDS)
+# The same fields preceded by the heavy-hitter keys, in one pass.
+_REQUEST_RE = re.compile(
+    rb'"remote_addr":"([^"]*)","method":"[^"]*","uri":"(' + _ESCAPED + rb')",' + _FIELDS
+)
+_AGENT_RE = re.compile(rb'"http_user_agent":"(' + _ESCAPED + rb')"')
+# Everything above from one json_detailed line, in key order: a single scan
+# of the chunk instead of one per expression.
+_LINE_RE = re.compile(
+    rb'\{"time":"([^"]*)","domain":"[^"]*",'
+    rb'"remote_addr":"([^"]*)","method":"[^"]*","uri":"(' + _ESCAPED + rb')",'
+    + _FIELDS
+    + rb',"upstream_addr":"[^"]*","http_referer":"' + _ESCAPED + rb'",'
+    rb'"http_user_agent":"(' + _ESCAPED + rb')"'
+)
+_NUMBER_RE = re.compile(rb"\d+(?:\.\d+)?")
+
+# Dimensions tracked by the top-K summaries, in ``/agent/traffic-sync`` order.
+TOP_DIMENSIONS = ("uri", "remote_addr", "user_agent")
+# Longer keys are cut so a scanner cannot blow up the summaries.
+_MAX_KEY_LENGTH = 256
+
+_decode = orjson.loads if orjson is not None else json.loads
+
+# One request as captured by _LINE_RE: time, remote_addr, uri, status,
+# body_bytes_sent, request_time, upstream_response_time, user agent (raw
+# bytes, "" when the layout lacks the key).
+Row = tuple[bytes, bytes, bytes, bytes, bytes, bytes, bytes, bytes]
+
+
+class TrafficAggregate:
+    """Running totals for one domain's access log."""
+
+    __slots__ = (
+        "requests",
+        "status_2xx",
+        "status_3xx",
+        "status_4xx",
+        "status_5xx",
+        "bytes_sent",
+        "total_request_time",
+        "period_start",
+        "period_end",
+        "latency",
+        "upstream_latency",
+        "top",
+        "visitors",
+    )
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.status_2xx = 0
+        self.status_3xx = 0
+        self.status_4xx = 0
+        self.status_5xx = 0
+        self.bytes_sent = 0
+        self.total_request_time = 0.0
+        self.period_start: str | None = None
+        self.period_end: str | None = None
+        self.latency = LatencyHistogram()
+        self.upstream_latency = LatencyHistogram()
+        self.top = {dimension: TopK() for dimension in TOP_DIMENSIONS}
+        self.visitors = HyperLogLog()
+
+    def add(
+        self,
+        ts: str,
+        status: int,
+        bytes_sent: int,
+        request_time: float,
+        upstream_time: float | None = None,
+        keys: tuple[str, str, str] | None = None,
+    ) -> None:
+        """Account for a single request (times in seconds, as nginx logs them).
+
+        *keys* are the request's ``(uri, remote_addr, user_agent)``.
+        """
+        self.requests += 1
+        if 200 <= status < 300:
+            self.status_2xx += 1
+        elif 300 <= status < 400:
+            self.status_3xx += 1
+        elif 400 <= status < 500:
+            self.status_4xx += 1
+        elif 500 <= status < 600:
+            self.status_5xx += 1
+        self.bytes_sent += bytes_sent
+        self.total_request_time += request_time
+        self.latency.add(request_time * 1000)
+        if upstream_time is not None:
+            self.upstream_latency.add(upstream_time * 1000)
+        if keys is not None:
+            for dimension, key in zip(TOP_DIMENSIONS, keys):
+                if key:
+                    self.top[dimension].add(key[:_MAX_KEY_LENGTH])
+            if keys[1]:
+                self.visitors.add(keys[1][:_MAX_KEY_LENGTH])
+        if ts:
+            if self.period_start is None:
+                self.period_start = ts
+            self.period_end = ts
+
+    def add_columns(self, columns: Sequence[Sequence[bytes]]) -> None:
+        """Account for a run of lines column-wise (no per-line Python calls).
+
+        *columns* holds one sequence per ``Row`` field; keys are raw
+        JSON-escaped bytes.
+        """
+        times, addrs, uris, statuses, sent, rtimes, upstreams, agents = columns
+        if not times:
+            return
+        self.requests += len(times)
+        classes: dict[bytes, int] = {}
+        for status, n in Counter(statuses).items():
+            if len(status) == 3:
+                head = status[:1]
+                classes[head] = classes.get(head, 0) + n
+        self.status_2xx += classes.get(b"2", 0)
+        self.status_3xx += classes.get(b"3", 0)
+        self.status_4xx += classes.get(b"4", 0)
+        self.status_5xx += classes.get(b"5", 0)
+        self.bytes_sent += sum(map(int, sent))
+        self.total_request_time += sum(map(float, rtimes))
+        # Millisecond-resolution times repeat a lot: count raw values in C,
+        # then bucket each distinct value once.
+        self.latency.add_many((float(raw) * 1000, n) for raw, n in Counter(rtimes).items())
+        for raw, n in Counter(upstreams).items():
+            upstream = _upstream_seconds(raw)
+            if upstream is not None:
+                self.upstream_latency.add(upstream * 1000, n)
+        self.top["uri"].add_many(_counted_keys(uris))
+        clients = _counted_keys(addrs)
+        self.top["remote_addr"].add_many(clients)
+        self.visitors.add_many(key for key, _ in clients)
+        self.top["user_agent"].add_many(_counted_keys(agents))
+        first = next((t for t in times if t), None)
+        if first is not None:
+            if self.period_start is None:
+                self.period_start = first.decode()
+            self.period_end = next(t for t in reversed(times) if t).decode()
+
+    def merge(self, other: TrafficAggregate) -> None:
+        """Fold in the totals of *other* (which covers later lines)."""
+        self.requests += other.requests
+        self.status_2xx += other.status_2xx
+        self.status_3xx += other.status_3xx
+        self.status_4xx += other.status_4xx
+        self.status_5xx += other.status_5xx
+        self.bytes_sent += other.bytes_sent
+        self.total_request_time += other.total_request_time
+        self.latency.merge(other.latency)
+        self.upstream_latency.merge(other.upstream_latency)
+        for dimension, summary in other.top.items():
+            self.top[dimension].merge(summary)
+        self.visitors.merge(other.visitors)
+        if other.period_start is not None:
+            if self.period_start is None:
+                self.period_start = other.period_start
+            self.period_end = other.period_end
+
+    def to_stat(self, domain: str) -> dict[str, Any]:
+        """Render as a ``/agent/traffic-sync`` stat entry."""
+        stat = {
+            "domain": domain,
+            "requests": self.requests,
+            "status_2xx": self.status_2xx,
+            "status_3xx": self.status_3xx,
+            "status_4xx": self.status_4xx,
+            "status_5xx": self.status_5xx,
+            "bytes_sent": self.bytes_sent,
+            "avg_request_time_ms": int((self.total_request_time / self.requests) * 1000),
+            "request_time_ms_total": round(self.total_request_time * 1000),
+            "period_start": self.period_start or "",
+            "period_end": self.period_end or "",
+        }
+        if self.latency:
+            stat["latency"] = self.latency.to_dict()
+        if self.upstream_latency:
+            stat["upstream_latency"] = self.upstream_latency.to_dict()
+        top = {dimension: summary.to_dict() for dimension, summary in self.top.items() if summary}
+        if top:
+            stat["top"] = top
+        if self.visitors:
+            stat["visitors"] = self.visitors.to_dict()
+        return stat
+
+
+def _counted_keys(column: Sequence[bytes]) -> list[tuple[str, int]]:
+    """Distinct raw keys of *column* with their counts, decoded and truncated."""
+    counted = []
+    for raw, n in Counter(column).items():
+        if not raw or raw == b"-":
+            continue
+        key = _unescape(raw) if b"\\" in raw else raw.decode(errors="replace")
+        counted.append((key[:_MAX_KEY_LENGTH], n))
+    return counted
+
+
+def _unescape(raw: bytes) -> str:
+    """Decode an ``escape=json`` value (``\\"``, ``\\u00XX``...)."""
+    try:
+        return json.loads(b'"' + raw + b'"')
+    except ValueError:
+        return raw.decode(errors="replace")
+
+
+def _upstream_seconds(raw: bytes) -> float | None:
+    """Total of an ``$upstream_response_time`` value ("0.004, 0.010 : 0.002").
+
+    Several numbers mean several upstreams were tried; "-" or "" means the
+    request never reached one (None).
+    """
+    numbers = _NUMBER_RE.findall(raw)
+    if not numbers:
+        return None
+    return sum(map(float, numbers))
+
+
+def bucket_start(ts: str) -> str:
+    """Start of the bucket containing ISO-8601 *ts*; "" if *ts* is not a timestamp."""
+    if len(ts) >= 19 and ts[10] == "T" and ts[16] == ":" and ts[19:20] in ("", "+", "-", "Z"):
+        # $time_iso8601 (no fractional seconds): just zero the seconds field.
+        return f"{ts[:17]}00{ts[19:]}"
+    try:
+        dt = datetime.fromisoformat(ts)
+    except ValueError:
+        return ""
+    return dt.replace(second=0, microsecond=0).isoformat()
+
+
+def bucket_end(start: str) -> str:
+    return (datetime.fromisoformat(start) + timedelta(seconds=BUCKET_SECONDS)).isoformat()
+
+
+class TrafficBuckets:
+    """Per-minute ``TrafficAggregate``s of one log, keyed by bucket start.
+
+    Lines whose time is missing or unparseable land in the ``""`` bucket,
+    which reports the raw first/last timestamps as its period.
+    """
+
+    __slots__ = ("buckets",)
+
+    def __init__(self) -> None:
+        self.buckets: dict[str, TrafficAggregate] = {}
+
+    @property
+    def requests(self) -> int:
+        return sum(agg.requests for agg in self.buckets.values())
+
+    def bucket(self, key: str) -> TrafficAggregate:
+        agg = self.buckets.get(key)
+        if agg is None:
+            agg = self.buckets[key] = TrafficAggregate()
+        return agg
+
+    def add(
+        self,
+        ts: str,
+        status: int,
+        bytes_sent: int,
+        request_time: float,
+        upstream_time: float | None = None,
+        keys: tuple[str, str, str] | None = None,
+    ) -> None:
+        self.bucket(bucket_start(ts)).add(
+            ts, status, bytes_sent, request_time, upstream_time, keys
+        )
+
+    def add_columns(self, columns: Sequence[Sequence[bytes]]) -> None:
+        """Split a run of lines into same-minute runs (logs are time-ordered)."""
+        times = columns[0] if columns else ()
+        start = 0
+        minute = times[0][:16] if times else b""
+        for i in range(1, len(times)):
+            if times[i][:16] != minute:
+                self._add_run(columns, start, i)
+                start = i
+                minute = times[i][:16]
+        if times:
+            self._add_run(columns, start, len(times))
+
+    def _add_run(self, columns: Sequence[Sequence[bytes]], start: int, end: int) -> None:
+        key = bucket_start(columns[0][start].decode())
+        self.bucket(key).add_columns([column[start:end] for column in columns])
+
+    def merge(self, other: TrafficBuckets) -> None:
+        for key, agg in other.buckets.items():
+            self.bucket(key).merge(agg)
+
+    def total(self) -> TrafficAggregate:
+        """All buckets folded into one aggregate."""
+        total = TrafficAggregate()
+        for key in sorted(self.buckets):
+            total.merge(self.buckets[key])
+        return total
+
+    def to_stats(self, domain: str) -> list[dict[str, Any]]:
+        """One ``/agent/traffic-sync`` stat entry per non-empty bucket, oldest first."""
+        stats: list[dict[str, Any]] = []
+        for key in sorted(self.buckets):
+            agg = self.buckets[key]
+            if not agg.requests:
+                continue
+            stat = agg.to_stat(domain)
+            if key:
+                stat["period_start"] = key
+                stat["period_end"] = bucket_end(key)
+            stats.append(stat)
+        return stats
+
+
+def _int(value: Any) -> int:
+    if isinstance(value, int):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _float(value: Any) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _add_line(agg: TrafficBuckets, line: bytes) -> None:
+    """Slow path: one line of unknown layout."""
+    line = line.strip()
+    if not line:
+        return
+    ts = _TIME_RE.match(line)
+    request = _REQUEST_RE.search(line)
+    row = request.groups() if request is not None else _fields_only(_FIELDS_RE.search(line))
+    if ts is not None and row is not None:
+        agent = _AGENT_RE.search(line)
+        fields = (ts.group(1), *row, agent.group(1) if agent is not None else b"")
+        agg.add_columns([(field,) for field in fields])
+        return
+    try:
+        entry = _decode(line)
+    except ValueError:
+        return
+    if not isinstance(entry, dict):
+        return
+    upstream = entry.get("upstream_response_time")
+    agg.add(
+        str(entry.get("time") or ""),
+        _int(entry.get("status", 0)),
+        _int(entry.get("body_bytes_sent", 0)),
+        _float(entry.get("request_time", 0)),
+        _upstream_seconds(str(upstream).encode()) if upstream is not None else None,
+        (
+            str(entry.get("uri") or ""),
+            str(entry.get("remote_addr") or ""),
+            str(entry.get("http_user_agent") or ""),
+        ),
+    )
+
+
+def _fields_only(match: re.Match[bytes] | None) -> tuple[bytes, ...] | None:
+    """Request fields without heavy-hitter keys, for layouts that lack them."""
+    return (b"", b"", *match.groups()) if match is not None else None
+
+
+def _rows_by_field(chunk: bytes, lines: int) -> list[Row] | None:
+    """Rows of a chunk not in the exact json_detailed layout, one scan per field."""
+    times = _TIME_RE.findall(chunk)
+    if len(times) != lines:
+        return None
+    requests = _REQUEST_RE.findall(chunk)
+    if len(requests) != lines:
+        requests = [(b"", b"", *fields) for fields in _FIELDS_RE.findall(chunk)]
+        if len(requests) != lines:
+            return None
+    agents = _AGENT_RE.findall(chunk)
+    if len(agents) != lines:
+        agents = [b""] * lines
+    return [(ts, *request, agent) for ts, request, agent in zip(times, requests, agents)]
+
+
+def scan_chunk(agg: TrafficBuckets, chunk: bytes) -> None:
+    """Aggregate a buffer of complete lines."""
+    lines = chunk.count(b"\n")
+    rows = _LINE_RE.findall(chunk)
+    if len(rows) != lines:
+        rows = _rows_by_field(chunk, lines)
+    if rows is not None:
+        agg.add_columns(list(zip(*rows)))
+        return
+    for line in chunk.splitlines():
+        _add_line(agg, line)
+
+
+def parse_access_log(
+    path: Path, offset: int, chunk_size: int = CHUNK_SIZE, stop: int | None = None
+) -> tuple[TrafficBuckets, int]:
+    """Aggregate the complete lines of *path* between *offset* and *stop* into buckets.
+
+    Returns the buckets and the offset just past the last complete line.
+    Without *stop* the file is read to its end.
+    """
+    agg = TrafficBuckets()
+    with open(path, "rb") as f:
+        f.seek(offset)
+        tail = b""
+        remaining = stop - offset if stop is not None else None
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            data = f.read(size)
+            if not data:
+                break
+            if remaining is not None:
+                remaining -= len(data)
+            buf = tail + data
+            cut = buf.rfind(b"\n") + 1
+            if cut == 0:
+                tail = buf
+                continue
+            scan_chunk(agg, buf[:cut])
+            offset += cut
+            tail = buf[cut:]
+    return agg, offset
+
+
+def split_ranges(path: Path, start: int, stop: int, parts: int) -> list[int]:
+    """Boundaries splitting ``[start, stop)`` into up to *parts* line-aligned ranges.
+
+    Every inner boundary is the start of a line, so each range can be parsed
+    independently and the results merged in order.
+    """
+    bounds = [start]
+    step = (stop - start) // parts
+    with open(path, "rb") as f:
+        for i in range(1, parts):
+            f.seek(max(start + i * step - 1, bounds[-1]))
+            f.readline()
+            pos = f.tell()
+            if bounds[-1] < pos < stop:
+                bounds.append(pos)
+    bounds.append(stop)
+    return bounds
@@ -0,0 +1,150 @@
+"""Agent self-instrumentation in the Prometheus text exposition format.
+
+The agent counts how long each collector takes, how much access log it
+read, what it sent to the hub and how long the hub took to answer. After
+every cycle the registry is written to a node-exporter textfile
+(``--collector.textfile.directory``), which the observability stack
+already scrapes, so no port is opened on the VPS. Counters start from zero
+in every process, which ``rate()`` and ``increase()`` handle like any
+exporter restart.
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+# name -> (type, help). Summaries are exported as ``<name>_sum`` and
+# ``<name>_count``.
+METRICS: dict[str, tuple[str, str]] = {
+    "vsa_agent_cycle_duration_seconds": ("summary", "Wall time of a sync cycle."),
+    "vsa_agent_last_cycle_timestamp_seconds": (
+        "gauge",
+        "Unix time the last sync cycle finished.",
+    ),
+    "vsa_agent_collect_duration_seconds": ("summary", "Time spent in a collector."),
+    "vsa_agent_collect_total": (
+        "counter",
+        "Collector runs by result (ok, empty, error).",
+    ),
+    "vsa_agent_last_success_timestamp_seconds": (
+        "gauge",
+        "Unix time a collector last finished without error.",
+    ),
+    "vsa_agent_log_read_bytes_total": ("counter", "Access-log bytes parsed."),
+    "vsa_agent_log_lines_total": ("counter", "Access-log requests parsed."),
+    "vsa_agent_log_backlog_bytes": (
+        "gauge",
+        "Unread access-log bytes when the traffic collector last started.",
+    ),
+    "vsa_agent_http_request_duration_seconds": ("summary", "Hub request latency."),
+    "vsa_agent_http_requests_total": (
+        "counter",
+        "Hub requests by endpoint and HTTP status (error: no response).",
+    ),
+    "vsa_agent_http_payload_bytes": (
+        "summary",
+        "Serialised request bodies before compression.",
+    ),
+    "vsa_agent_http_sent_bytes": ("summary", "Request bodies as sent on the wire."),
+    "vsa_agent_outbox_sections": ("gauge", "Sections waiting in the outbox."),
+    "vsa_agent_outbox_bytes": ("gauge", "Bytes waiting in the outbox."),
+}
+
+Labels = tuple[tuple[str, str], ...]
+Snapshot = dict[tuple[str, Labels], float]
+
+
+def _labels(labels: dict[str, str]) -> Labels:
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format(value: float) -> str:
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _family(sample: str) -> str:
+    if sample in METRICS:
+        return sample
+    return sample.rsplit("_", 1)[0]
+
+
+class Registry:
+    """Thread-safe counters, gauges and summaries keyed by name and labels."""
+
+    def __init__(self) -> None:
+        self._values: Snapshot = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[(name, _labels(labels))] = float(value)
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Add one observation to the summary *name*."""
+        key = _labels(labels)
+        with self._lock:
+            for sample, amount in ((f"{name}_sum", value), (f"{name}_count", 1.0)):
+                self._values[(sample, key)] = self._values.get((sample, key), 0.0) + amount
+
+    def snapshot(self) -> Snapshot:
+        with self._lock:
+            return dict(self._values)
+
+    def by_label(
+        self, sample: str, label: str, since: Snapshot | None = None
+    ) -> dict[str, float]:
+        """Increase of *sample* since the *since* snapshot, per value of *label*."""
+        since = since or {}
+        totals: dict[str, float] = {}
+        for (name, labels), value in self.snapshot().items():
+            if name != sample:
+                continue
+            key = dict(labels).get(label, "")
+            totals[key] = totals.get(key, 0.0) + value - since.get((name, labels), 0.0)
+        return totals
+
+    def total(self, sample: str, since: Snapshot | None = None) -> float:
+        """Increase of *sample* (all label sets) since the *since* snapshot."""
+        return sum(self.by_label(sample, "", since).values())
+
+    def render(self) -> str:
+        """The registry in the Prometheus text format."""
+        families: dict[str, list[str]] = {}
+        for (name, labels), value in sorted(self.snapshot().items()):
+            rendered = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+            sample = f"{name}{{{rendered}}}" if rendered else name
+            families.setdefault(_family(name), []).append(f"{sample} {_format(value)}")
+        lines: list[str] = []
+        for family, samples in families.items():
+            kind, help_text = METRICS.get(family, ("untyped", ""))
+            lines.append(f"# HELP {family} {help_text}")
+            lines.append(f"# TYPE {family} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: Path) -> None:
+        """Atomically replace *path*, so node-exporter never reads a partial file."""
+        fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", dir=path.parent)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.render())
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+metrics = Registry()
@@ -0,0 +1,190 @@
+"""Durable outbox for agent sections the hub has not acknowledged.
+
+When the hub is unreachable, section bodies are spooled to a local SQLite
+file instead of being dropped, and replayed oldest-first once the hub
+answers again. Delta sections (audit events, traffic aggregates) are kept
+one row per cycle; snapshot sections only keep their latest body, since an
+older snapshot is superseded by a newer one. The spool is capped in bytes
+and evicts its oldest rows first.
+
+Retries back off exponentially with jitter so that a fleet of agents does
+not hammer a hub that is just coming back. Given a ``StateStore``, the
+backoff survives agent restarts.
+"""
+
+from __future__ import annotations
+
+import json
+import random
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+if TYPE_CHECKING:
+    from vsa.services.agent_state import StateStore
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+BACKOFF_BASE = 5.0
+BACKOFF_CAP = 300.0
+
+
+class Entry(NamedTuple):
+    """One spooled section body."""
+
+    id: int
+    name: str
+    endpoint: str
+    body: dict[str, Any]
+
+
+class Outbox:
+    """SQLite-backed FIFO of pending section bodies, with retry backoff."""
+
+    def __init__(
+        self,
+        path: Path,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        state: StateStore | None = None,
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.state = state
+        self.failures = 0
+        self.retry_at = 0.0
+        self._restored = state is None
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        # Opened on first use: agents that never miss a delivery never touch disk.
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "name TEXT NOT NULL, endpoint TEXT NOT NULL, "
+                "latest_only INTEGER NOT NULL, body TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    # -- spool ---------------------------------------------------------------
+
+    def put(self, name: str, endpoint: str, body: dict[str, Any], *, coalesce: bool) -> None:
+        """Spool *body*; with *coalesce*, replace any pending body of the same section."""
+        data = json.dumps(body, separators=(",", ":"))
+        with self._lock:
+            db = self._db()
+            if coalesce:
+                db.execute("DELETE FROM outbox WHERE name = ? AND latest_only = 1", (name,))
+            db.execute(
+                "INSERT INTO outbox (name, endpoint, latest_only, body, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (name, endpoint, int(coalesce), data, time.time()),
+            )
+            self._evict(db)
+            db.commit()
+
+    def _evict(self, db: sqlite3.Connection) -> None:
+        total = db.execute("SELECT COALESCE(SUM(LENGTH(body)), 0) FROM outbox").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = db.execute("SELECT id, LENGTH(body) FROM outbox ORDER BY id").fetchall()
+        for row_id, size in rows:
+            db.execute("DELETE FROM outbox WHERE id = ?", (row_id,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def discard(self, name: str) -> None:
+        """Drop the pending snapshot of *name* (a fresher one is about to be sent)."""
+        if self._conn is None and not self.path.exists():
+            return
+        with self._lock:
+            db = self._db()
+            db.execute("DELETE FROM outbox WHERE name = ? AND latest_only = 1", (name,))
+            db.commit()
+
+    def pending(self) -> list[Entry]:
+        """All spooled bodies, oldest first."""
+        if self._conn is None and not self.path.exists():
+            return []
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT id, name, endpoint, body FROM outbox ORDER BY id"
+            ).fetchall()
+        return [Entry(i, name, endpoint, json.loads(body)) for i, name, endpoint, body in rows]
+
+    def remove(self, entry_id: int) -> None:
+        with self._lock:
+            db = self._db()
+            db.execute("DELETE FROM outbox WHERE id = ?", (entry_id,))
+            db.commit()
+
+    def __len__(self) -> int:
+        return self.stats()[0]
+
+    def stats(self) -> tuple[int, int]:
+        """Number of spooled bodies and their total size in bytes."""
+        if self._conn is None and not self.path.exists():
+            return 0, 0
+        with self._lock:
+            count, size = self._db().execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM outbox"
+            ).fetchone()
+        return count, size
+
+    # -- backoff -------------------------------------------------------------
+
+    def _restore_backoff(self) -> None:
+        if self._restored or self.state is None:
+            return
+        self._restored = True
+        saved = self.state.get("outbox_backoff") or {}
+        self.failures = int(saved.get("failures", 0))
+        # Persisted as wall-clock time; the monotonic clock restarts with the process.
+        remaining = float(saved.get("retry_at", 0.0)) - time.time()
+        self.retry_at = time.monotonic() + remaining if remaining > 0 else 0.0
+
+    def _save_backoff(self, delay: float) -> None:
+        if self.state is not None:
+            retry_at = time.time() + delay if delay else 0.0
+            self.state.update(outbox_backoff={"failures": self.failures, "retry_at": retry_at})
+
+    def backing_off(self) -> bool:
+        """True while the hub should not be contacted after recent failures."""
+        self._restore_backoff()
+        return time.monotonic() < self.retry_at
+
+    def record_failure(self, retry_after: float | None = None) -> float:
+        """Schedule the next attempt; returns the delay in seconds.
+
+        *retry_after* is the hub's own ``Retry-After``: it replaces the
+        exponential delay, plus a little jitter to spread the fleet.
+        """
+        self._restore_backoff()
+        self.failures += 1
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, BACKOFF_BASE)
+        else:
+            ceiling = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** (self.failures - 1))
+            delay = random.uniform(ceiling / 2, ceiling)
+        self.retry_at = time.monotonic() + delay
+        self._save_backoff(delay)
+        return delay
+
+    def record_success(self) -> None:
+        self._restore_backoff()
+        if self.failures:
+            self.failures = 0
+            self.retry_at = 0.0
+            self._save_backoff(0.0)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,139 @@
+"""Transactional agent state: audit cursor, log positions, fingerprints.
+
+Kept in a small SQLite database in WAL mode, so that every change is one
+atomic transaction that only touches the rows it changes: a crash can no
+longer leave a half-written file behind, and concurrent steps (or a
+``vsa agent start`` running next to the daemon) do not overwrite each
+other's keys. Values are JSON. Scalars live in the ``""`` scope; the maps
+listed in ``MAP_KEYS`` get one row per entry.
+
+State written by older agents to ``agent_sync_state.json`` is imported on
+first open and the file renamed to ``*.migrated``.
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any
+
+MAP_KEYS = ("file_offsets", "fingerprints")
+DEFAULTS: dict[str, Any] = {"last_audit_id": 0}
+
+
+class StateStore:
+    """Key/value agent state in SQLite; safe to share between threads."""
+
+    def __init__(self, path: Path, legacy_path: Path | None = None) -> None:
+        self.path = path
+        self.legacy_path = legacy_path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=30.0, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "scope TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "PRIMARY KEY (scope, key))"
+            )
+            conn.commit()
+            self._conn = conn
+            self._migrate_legacy(conn)
+        return self._conn
+
+    def _migrate_legacy(self, conn: sqlite3.Connection) -> None:
+        legacy = self.legacy_path
+        if legacy is None or not legacy.exists():
+            return
+        if conn.execute("SELECT 1 FROM state LIMIT 1").fetchone() is None:
+            try:
+                data = json.loads(legacy.read_text())
+            except (OSError, ValueError):
+                data = None  # Torn write: start over rather than fail every cycle.
+            if isinstance(data, dict):
+                with conn:
+                    self._write(conn, data)
+        legacy.rename(legacy.with_name(legacy.name + ".migrated"))
+
+    # -- read ----------------------------------------------------------------
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """A scalar value, or a whole map for the keys in ``MAP_KEYS``."""
+        with self._lock:
+            db = self._db()
+            if key in MAP_KEYS:
+                rows = db.execute("SELECT key, value FROM state WHERE scope = ?", (key,))
+                return {k: json.loads(v) for k, v in rows}
+            row = db.execute(
+                "SELECT value FROM state WHERE scope = '' AND key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return DEFAULTS.get(key, default)
+        return json.loads(row[0])
+
+    def get_item(self, scope: str, key: str) -> Any:
+        """One entry of a map (e.g. a single fingerprint), or None."""
+        with self._lock:
+            row = self._db().execute(
+                "SELECT value FROM state WHERE scope = ? AND key = ?", (scope, key)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def load(self) -> dict[str, Any]:
+        """The whole state as a dict (the shape of the old JSON file)."""
+        state: dict[str, Any] = {**DEFAULTS, **{key: {} for key in MAP_KEYS}}
+        with self._lock:
+            rows = self._db().execute("SELECT scope, key, value FROM state").fetchall()
+        for scope, key, value in rows:
+            if scope:
+                state.setdefault(scope, {})[key] = json.loads(value)
+            else:
+                state[key] = json.loads(value)
+        return state
+
+    # -- write ---------------------------------------------------------------
+
+    def update(self, **changes: Any) -> None:
+        """Apply *changes* in one transaction.
+
+        For ``MAP_KEYS`` the value is merged entry by entry (``None`` removes
+        an entry); other keys are replaced.
+        """
+        with self._lock:
+            db = self._db()
+            with db:
+                self._write(db, changes)
+
+    @staticmethod
+    def _write(db: sqlite3.Connection, changes: dict[str, Any]) -> None:
+        for key, value in changes.items():
+            if key in MAP_KEYS:
+                for item, item_value in (value or {}).items():
+                    if item_value is None:
+                        db.execute(
+                            "DELETE FROM state WHERE scope = ? AND key = ?", (key, item)
+                        )
+                    else:
+                        db.execute(
+                            "INSERT INTO state (scope, key, value) VALUES (?, ?, ?) "
+                            "ON CONFLICT (scope, key) DO UPDATE SET value = excluded.value",
+                            (key, item, json.dumps(item_value)),
+                        )
+            else:
+                db.execute(
+                    "INSERT INTO state (scope, key, value) VALUES ('', ?, ?) "
+                    "ON CONFLICT (scope, key) DO UPDATE SET value = excluded.value",
+                    (key, json.dumps(value)),
+                )
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
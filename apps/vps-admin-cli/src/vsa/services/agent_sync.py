@@ -2,19 +2,49 @@
 
 from __future__ import annotations
 
+import gzip
+import hashlib
 import json
+import multiprocessing
+import os
 import re
+import signal
 import socket
 import sqlite3
 import subprocess
-from datetime import datetime, timezone
+import threading
+import time
+import zlib
+from collections.abc import Callable
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Any
+from typing import Any, NamedTuple
 
 import httpx
+from cryptography import x509
+from cryptography.x509.oid import NameOID
 from rich.console import Console
 
 from vsa.config import get_config
+from vsa.services import access_log, docker_api
+from vsa.services.agent_metrics import Snapshot, metrics
+from vsa.services.agent_outbox import Outbox
+from vsa.services.agent_state import StateStore
+from vsa.services.log_watch import LogWatcher
+
+try:
+    import zstandard
+except ImportError:  # optional: pip install vsa-cli[compression]
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:  # optional: pip install vsa-cli[compression]
+    msgpack = None
 
 console = Console()
 
@@ -22,24 +52,42 @@ console = Console()
 # Sync state persistence
 # ---------------------------------------------------------------------------
 
+_STATE_DB_PATH = Path("/var/lib/vsa/agent_state.db")
+# Pre-SQLite state file, imported into _STATE_DB_PATH on first use.
 _STATE_PATH = Path("/var/lib/vsa/agent_sync_state.json")
+_OUTBOX_PATH = Path("/var/lib/vsa/agent_outbox.db")
+# node-exporter textfile collector; only written if the directory exists.
+_METRICS_PATH = Path("/var/lib/node_exporter/textfile_collector/vsa_agent.prom")
+
+_STATE_STORES: dict[Path, StateStore] = {}
+_STATE_LOCK = threading.Lock()
+
+
+def _state() -> StateStore:
+    """The process-wide state store (one per path, so tests can swap it)."""
+    with _STATE_LOCK:
+        store = _STATE_STORES.get(_STATE_DB_PATH)
+        if store is None:
+            store = _STATE_STORES[_STATE_DB_PATH] = StateStore(_STATE_DB_PATH, _STATE_PATH)
+        return store
 
 
 def _load_sync_state() -> dict[str, Any]:
-    if _STATE_PATH.exists():
-        return json.loads(_STATE_PATH.read_text())
-    return {"last_audit_id": 0, "file_offsets": {}}
+    return _state().load()
 
 
-def _save_sync_state(state: dict[str, Any]) -> None:
-    _STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
-    _STATE_PATH.write_text(json.dumps(state))
+def _update_sync_state(**changes: Any) -> None:
+    """Write *changes* to the persisted sync state in one transaction."""
+    _state().update(**changes)
 
 
 # ---------------------------------------------------------------------------
 # Data collectors (pure-ish functions, testable)
 # ---------------------------------------------------------------------------
 
+# Upper bound for docker CLI calls so a wedged daemon cannot pin a worker.
+_SUBPROCESS_TIMEOUT = 60.0
+
 
 def collect_heartbeat() -> dict[str, str]:
     """Return heartbeat payload with vps_id, hostname, and ip_address."""
@@ -57,12 +105,24 @@ def collect_heartbeat() -> dict[str, str]:
 
 
 def collect_containers() -> list[dict[str, str]]:
-    """List all Docker containers via ``docker ps -a``."""
+    """List all Docker containers (Engine API, or ``docker ps -a`` as fallback)."""
+    if docker_api.available():
+        return [
+            {
+                "name": docker_api.container_name(c),
+                "image": c.get("Image", ""),
+                "status": c.get("Status", ""),
+                "ports": docker_api.format_ports(c.get("Ports") or []),
+            }
+            for c in docker_api.list_containers(all=True)
+        ]
+
     result = subprocess.run(
         ["docker", "ps", "-a", "--format", "{{json .}}"],
         capture_output=True,
         text=True,
         check=False,
+        timeout=_SUBPROCESS_TIMEOUT,
     )
     if result.returncode != 0:
         return []
@@ -82,8 +142,82 @@ def collect_containers() -> list[dict[str, str]]:
     return containers
 
 
-def collect_certificates(compose_file: Path) -> list[dict[str, str]]:
-    """List certificate info by running openssl inside the nginx container."""
+# path -> ((st_dev, st_ino, st_mtime_ns), parsed cert info). ``live/*/cert.pem``
+# is a symlink into ``archive/``; stat() follows it, so a renewal (new target
+# file) changes the key and the cert is re-parsed, otherwise it never is.
+_CERT_CACHE: dict[str, tuple[tuple[int, int, int], dict[str, Any]]] = {}
+
+
+def _cert_issuer(cert: x509.Certificate) -> str:
+    for oid in (NameOID.ORGANIZATION_NAME, NameOID.COMMON_NAME):
+        attrs = cert.issuer.get_attributes_for_oid(oid)
+        if attrs:
+            return str(attrs[0].value)
+    return cert.issuer.rfc4514_string()
+
+
+def _cert_sans(cert: x509.Certificate) -> list[str]:
+    try:
+        ext = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName)
+    except x509.ExtensionNotFound:
+        return []
+    return ext.value.get_values_for_type(x509.DNSName)
+
+
+def read_certificate(path: Path) -> dict[str, Any]:
+    """Parse a PEM certificate into expiry (ISO), issuer and DNS SANs."""
+    cert = x509.load_pem_x509_certificate(path.read_bytes())
+    return {
+        "expiry": cert.not_valid_after_utc.isoformat(),
+        "issuer": _cert_issuer(cert),
+        "sans": _cert_sans(cert),
+    }
+
+
+def collect_certificates(live_dir: Path) -> list[dict[str, Any]]:
+    """Read ``<live_dir>/*/cert.pem`` on the host, re-parsing only changed files."""
+    certs: list[dict[str, Any]] = []
+    seen: set[str] = set()
+    now = datetime.now(UTC)
+    for cert_path in sorted(live_dir.glob("*/cert.pem")):
+        domain = cert_path.parent.name
+        key = str(cert_path)
+        try:
+            st = cert_path.stat()
+        except OSError:
+            continue
+        stamp = (st.st_dev, st.st_ino, st.st_mtime_ns)
+        seen.add(key)
+
+        cached = _CERT_CACHE.get(key)
+        if cached is not None and cached[0] == stamp:
+            info = cached[1]
+        else:
+            try:
+                info = read_certificate(cert_path)
+            except (OSError, ValueError):
+                info = {"expiry": "", "issuer": "", "sans": []}
+            _CERT_CACHE[key] = (stamp, info)
+
+        if not info["expiry"]:
+            status = "unknown"
+        elif datetime.fromisoformat(info["expiry"]) < now:
+            status = "expired"
+        else:
+            status = "valid"
+        certs.append({"domain": domain, **info, "status": status})
+
+    for stale in set(_CERT_CACHE) - seen:
+        if stale.startswith(f"{live_dir}/"):
+            del _CERT_CACHE[stale]
+    return certs
+
+
+def collect_certificates_via_nginx(compose_file: Path) -> list[dict[str, str]]:
+    """List certificate info by running openssl inside the nginx container.
+
+    Only used when the certbot ``live/`` directory is not present on the host.
+    """
     result = subprocess.run(
         [
             "docker", "compose", "-f", str(compose_file),
@@ -104,6 +238,7 @@ def collect_certificates(compose_file: Path) -> list[dict[str, str]]:
         capture_output=True,
         text=True,
         check=False,
+        timeout=_SUBPROCESS_TIMEOUT,
     )
     return parse_cert_output(result.stdout)
 
@@ -121,8 +256,8 @@ def parse_cert_output(raw: str) -> list[dict[str, str]]:
         status = "valid"
         try:
             expiry_dt = datetime.strptime(expiry_raw, "%b %d %H:%M:%S %Y %Z")
-            expiry_dt = expiry_dt.replace(tzinfo=timezone.utc)
-            if expiry_dt < datetime.now(timezone.utc):
+            expiry_dt = expiry_dt.replace(tzinfo=UTC)
+            if expiry_dt < datetime.now(UTC):
                 status = "expired"
             expiry_iso = expiry_dt.isoformat()
         except (ValueError, TypeError):
@@ -165,9 +300,9 @@ def collect_domains(vhost_dir: Path) -> list[dict[str, Any]]:
 
 
 def collect_unsent_audit_events(
-    db_path: Path, last_id: int
+    db_path: Path, last_id: int, limit: int = 500
 ) -> tuple[list[dict[str, Any]], int]:
-    """Read audit events from local SQLite that haven't been synced yet."""
+    """Read the next *limit* audit events after *last_id* (keyset pagination)."""
     if not db_path.exists():
         return [], last_id
 
@@ -175,8 +310,8 @@ def collect_unsent_audit_events(
     conn.row_factory = sqlite3.Row
     try:
         rows = conn.execute(
-            "SELECT * FROM audit_logs WHERE id > ? ORDER BY id LIMIT 500",
-            (last_id,),
+            "SELECT * FROM audit_logs WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, limit),
         ).fetchall()
     except sqlite3.OperationalError:
         return [], last_id
@@ -193,249 +328,1095 @@ def collect_unsent_audit_events(
 
 
 # ---------------------------------------------------------------------------
-# HTTP client helpers
+# Traffic stats collector
 # ---------------------------------------------------------------------------
 
+_DEFAULT_LOG_DIR = Path("/var/log/nginx/domains")
 
-def _post(
-    client: httpx.Client, url: str, payload: dict[str, Any]
-) -> httpx.Response:
-    """POST JSON to the hub with a 30s timeout."""
-    return client.post(url, json=payload, timeout=30.0)
+
+# Logs with less unread data than this are parsed in-process; above it the
+# work goes to a process pool, split into byte ranges of about _RANGE_BYTES.
+_PARALLEL_MIN_BYTES = 16 * 1024 * 1024
+_RANGE_BYTES = 64 * 1024 * 1024
+
+
+@lru_cache(maxsize=1)
+def _traffic_pool() -> ProcessPoolExecutor:
+    """Worker processes for log parsing, started once and reused across cycles."""
+    # The agent is multi-threaded: forking it could copy held locks.
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(
+        max_workers=os.cpu_count() or 1, mp_context=multiprocessing.get_context(method)
+    )
+
+
+def collect_traffic_stats(
+    log_dir: Path, file_offsets: dict[str, Any]
+) -> tuple[list[dict[str, Any]], dict[str, Any]]:
+    """Parse per-domain JSON access logs incrementally and aggregate stats.
+
+    Returns one stat entry per domain and one-minute bucket, and the updated
+    read positions (see ``_log_position``). Only complete lines are consumed
+    (see ``access_log.parse_access_log``). When a log was rotated since the
+    last run, the rest of the rotated file is read before the new one (see
+    ``_pending_ranges``). When there is enough unread data, files and byte
+    ranges within large files are parsed in parallel by ``_traffic_pool``
+    and the partial aggregates merged in file order; a log's position only
+    moves if every one of its ranges was parsed.
+    """
+    stats: list[dict[str, Any]] = []
+    new_offsets = dict(file_offsets)
+
+    if not log_dir.is_dir():
+        return stats, new_offsets
+
+    logs: list[tuple[Path, os.stat_result, int]] = []
+    work: list[tuple[Path, int, int]] = []
+    for log_file in sorted(log_dir.glob("*.access.json")):
+        try:
+            st = log_file.stat()
+            ranges = _pending_ranges(log_file, st, file_offsets.get(log_file.name))
+        except OSError:
+            continue
+        if ranges:
+            logs.append((log_file, st, len(ranges)))
+            work.extend(ranges)
+
+    pending = sum(stop - start for _, start, stop in work)
+    metrics.set("vsa_agent_log_backlog_bytes", pending)
+    if pending >= _PARALLEL_MIN_BYTES and (os.cpu_count() or 1) > 1:
+        parsed = _parse_parallel(work)
+    else:
+        parsed = [_parse_serial(*item) for item in work]
+
+    results = iter(zip(work, parsed))
+    for log_file, st, count in logs:
+        done = [next(results) for _ in range(count)]
+        if any(result is None for _, result in done):
+            continue
+        buckets = done[0][1][0]
+        for _, (part, _) in done[1:]:
+            buckets.merge(part)
+        # The position always describes the live file. Right after a rotation
+        # it may still be empty, and then only rotated siblings were read.
+        (path, _, _), (_, end) = done[-1]
+        offset = end if path == log_file else 0
+        try:
+            new_offsets[log_file.name] = _log_position(log_file, st, offset)
+        except OSError:
+            continue
+        read = sum(end - start for (_, start, _), (_, end) in done)
+        metrics.inc("vsa_agent_log_read_bytes_total", read)
+        metrics.inc("vsa_agent_log_lines_total", buckets.requests)
+        stats.extend(buckets.to_stats(log_file.name.replace(".access.json", "")))
+
+    return stats, new_offsets
+
+
+# Positions remember a checksum of the first bytes of the file, so that a
+# log truncated in place and grown past the old offset is still noticed.
+_HEAD_BYTES = 256
+_COMPRESSED_SUFFIXES = (".gz", ".bz2", ".xz", ".zst")
+
+
+def _head_checksum(path: Path, length: int) -> int:
+    with open(path, "rb") as f:
+        return zlib.crc32(f.read(length))
+
+
+def _log_position(log_file: Path, st: os.stat_result, offset: int) -> dict[str, int]:
+    """Persisted read position of a log: its ``(dev, ino)`` identity and offset."""
+    length = min(offset, _HEAD_BYTES)
+    return {
+        "dev": st.st_dev,
+        "ino": st.st_ino,
+        "offset": offset,
+        "head": _head_checksum(log_file, length),
+    }
+
+
+def _same_head(path: Path, position: dict[str, int]) -> bool:
+    length = min(position["offset"], _HEAD_BYTES)
+    return _head_checksum(path, length) == position.get("head")
+
+
+def _rotated_siblings(log_file: Path) -> list[tuple[Path, os.stat_result]]:
+    """Uncompressed rotated copies of *log_file* (``x.access.json.1``, ``-20260101``...)."""
+    siblings = []
+    for path in log_file.parent.glob(log_file.name + "?*"):
+        if path.name.endswith(_COMPRESSED_SUFFIXES):
+            continue
+        try:
+            siblings.append((path, path.stat()))
+        except OSError:
+            continue
+    # Most recently rotated first.
+    siblings.sort(key=lambda item: item[1].st_mtime, reverse=True)
+    return siblings
+
+
+def _pending_ranges(
+    log_file: Path, st: os.stat_result, position: dict[str, int] | int | None
+) -> list[tuple[Path, int, int]]:
+    """Byte ranges still to read for one log, oldest first, ending with the live file.
+
+    With ``create`` rotation the file read last time was renamed: it is found
+    again among the rotated siblings by its ``(dev, ino)`` and finished from
+    the saved offset. With ``copytruncate`` the live file keeps its inode but
+    shrinks (or no longer starts with the same bytes); the lines written
+    before the copy are read from the sibling that matches the saved head.
+    Either way the live file is then read from the start. Offsets saved by
+    older agents (a bare int) are assumed to belong to the live file.
+    """
+    if position is None:
+        return [(log_file, 0, st.st_size)] if st.st_size else []
+    if isinstance(position, int):
+        position = {"dev": st.st_dev, "ino": st.st_ino, "offset": position}
+    offset = position["offset"]
+
+    renamed = (position["dev"], position["ino"]) != (st.st_dev, st.st_ino)
+    if not renamed and st.st_size >= offset:
+        if "head" not in position or _same_head(log_file, position):
+            return [(log_file, offset, st.st_size)] if st.st_size > offset else []
+
+    ranges = []
+    for path, sibling in _rotated_siblings(log_file):
+        if renamed:
+            found = (sibling.st_dev, sibling.st_ino) == (position["dev"], position["ino"])
+        else:
+            found = sibling.st_size >= offset and "head" in position and _same_head(
+                path, position
+            )
+        if found:
+            if sibling.st_size > offset:
+                ranges.append((path, offset, sibling.st_size))
+            break
+    if st.st_size:
+        ranges.append((log_file, 0, st.st_size))
+    return ranges
+
+
+def _parse_serial(
+    log_file: Path, start: int, stop: int
+) -> tuple[access_log.TrafficBuckets, int] | None:
+    try:
+        return access_log.parse_access_log(log_file, start, access_log.CHUNK_SIZE, stop)
+    except OSError:
+        return None
+
+
+def _parse_parallel(
+    work: list[tuple[Path, int, int]],
+) -> list[tuple[access_log.TrafficBuckets, int] | None]:
+    """Parse every file's unread range in the process pool, split into line-aligned parts.
+
+    If a worker dies (e.g. killed by the OOM killer) the pool is unusable:
+    it is shut down and dropped so the next cycle starts a new one, and this
+    cycle's work is parsed in-process instead.
+    """
+    pool = _traffic_pool()
+    try:
+        return _parse_in_pool(pool, work)
+    except BrokenProcessPool:
+        _traffic_pool.cache_clear()
+        pool.shutdown(wait=False, cancel_futures=True)
+        return [_parse_serial(*item) for item in work]
+
+
+def _parse_in_pool(
+    pool: ProcessPoolExecutor, work: list[tuple[Path, int, int]]
+) -> list[tuple[access_log.TrafficBuckets, int] | None]:
+    workers = os.cpu_count() or 1
+    jobs: list[list[Future[tuple[access_log.TrafficBuckets, int]]] | None] = []
+    for log_file, offset, size in work:
+        parts = max(1, min(workers, -(-(size - offset) // _RANGE_BYTES)))
+        try:
+            bounds = access_log.split_ranges(log_file, offset, size, parts)
+        except OSError:
+            jobs.append(None)
+            continue
+        jobs.append(
+            [
+                pool.submit(
+                    access_log.parse_access_log, log_file, start, access_log.CHUNK_SIZE, stop
+                )
+                for start, stop in zip(bounds, bounds[1:])
+            ]
+        )
+
+    results: list[tuple[access_log.TrafficBuckets, int] | None] = []
+    for futures in jobs:
+        if futures is None:
+            results.append(None)
+            continue
+        try:
+            parts_done = [future.result() for future in futures]
+        except BrokenProcessPool:
+            raise
+        except Exception:
+            results.append(None)
+            continue
+        buckets = parts_done[0][0]
+        for part, _ in parts_done[1:]:
+            buckets.merge(part)
+        results.append((buckets, parts_done[-1][1]))
+    return results
 
 
 # ---------------------------------------------------------------------------
-# Sync functions (collect → POST)
+# Sync sections (collect → payload for the hub)
 # ---------------------------------------------------------------------------
 
 
-def sync_heartbeat(client: httpx.Client, hub_url: str) -> None:
-    data = collect_heartbeat()
-    resp = _post(client, f"{hub_url}/agent/heartbeat", data)
-    resp.raise_for_status()
+class Section(NamedTuple):
+    """A collected payload ready to be sent to the hub.
 
+    ``name`` is the key in the ``/agent/sync`` bundle, ``endpoint`` the
+    per-section route used with hubs that predate the bundle. ``on_ack`` runs
+    only once the hub has accepted the section (e.g. to advance a cursor).
+    Snapshot sections carry a ``fingerprint`` of their content so that an
+    unchanged snapshot can be sent as the fingerprint alone. ``more`` means
+    the collector has a backlog and should run again as soon as this section
+    is acknowledged. ``append`` marks delta sections (audit events, traffic
+    aggregates) whose every payload must reach the hub; for the others only
+    the latest one matters.
+    """
 
-def sync_containers(client: httpx.Client, hub_url: str) -> None:
-    cfg = get_config()
-    containers = collect_containers()
-    resp = _post(
-        client,
-        f"{hub_url}/agent/containers-sync",
-        {"vps_id": cfg.vps_id, "containers": containers},
+    name: str
+    endpoint: str
+    payload: dict[str, Any]
+    on_ack: Callable[[], None] | None = None
+    fingerprint: str | None = None
+    more: bool = False
+    append: bool = False
+
+
+def snapshot_fingerprint(items: list[dict[str, Any]]) -> str:
+    """Stable content hash of a snapshot (independent of key order)."""
+    canonical = json.dumps(items, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _snapshot_section(name: str, endpoint: str, items: list[dict[str, Any]]) -> Section:
+    return Section(
+        name,
+        endpoint,
+        {"vps_id": get_config().vps_id, name: items},
+        fingerprint=snapshot_fingerprint(items),
     )
-    resp.raise_for_status()
 
 
-def sync_certificates(client: httpx.Client, hub_url: str) -> None:
+def heartbeat_section() -> Section:
+    return Section("heartbeat", "/agent/heartbeat", collect_heartbeat())
+
+
+def containers_section() -> Section:
+    return _snapshot_section("containers", "/agent/containers-sync", collect_containers())
+
+
+def certificates_section() -> Section:
     cfg = get_config()
-    compose_file = cfg.reverse_proxy_compose
-    certs = collect_certificates(compose_file)
-    resp = _post(
-        client,
-        f"{hub_url}/agent/certs-sync",
-        {"vps_id": cfg.vps_id, "certs": certs},
-    )
-    resp.raise_for_status()
+    if cfg.letsencrypt_live_dir.is_dir():
+        certs = collect_certificates(cfg.letsencrypt_live_dir)
+    else:
+        certs = collect_certificates_via_nginx(cfg.reverse_proxy_compose)
+    return _snapshot_section("certs", "/agent/certs-sync", certs)
 
 
-def sync_domains(client: httpx.Client, hub_url: str) -> None:
+def domains_section() -> Section:
     cfg = get_config()
-    vhost_dir = cfg.repo_vhost_dir
-    domains = collect_domains(vhost_dir)
-    resp = _post(
-        client,
-        f"{hub_url}/agent/domains-sync",
-        {"vps_id": cfg.vps_id, "domains": domains},
-    )
-    resp.raise_for_status()
+    return _snapshot_section("domains", "/agent/domains-sync", collect_domains(cfg.repo_vhost_dir))
+
+
+# Audit batches are sized to roughly this many JSON bytes, adapting to the
+# observed size of recent events.
+_AUDIT_BATCH_BYTES = 256 * 1024
+_AUDIT_BATCH_MIN = 50
+_AUDIT_BATCH_MAX = 5000
+_audit_batch_size = 500
+
 
+def _next_audit_batch_size(events: list[dict[str, Any]]) -> int:
+    avg = max(1, len(json.dumps(events, separators=(",", ":"))) // len(events))
+    return max(_AUDIT_BATCH_MIN, min(_AUDIT_BATCH_MAX, _AUDIT_BATCH_BYTES // avg))
+
+
+def audit_section() -> Section | None:
+    """Next batch of unsent audit events; the cursor moves only on hub ack."""
+    global _audit_batch_size
 
-def sync_audit_events(client: httpx.Client, hub_url: str) -> None:
     cfg = get_config()
-    state = _load_sync_state()
-    last_id = state.get("last_audit_id", 0)
+    last_id = _state().get("last_audit_id")
 
-    events, new_last_id = collect_unsent_audit_events(cfg.audit_db_path, last_id)
+    limit = _audit_batch_size
+    events, new_last_id = collect_unsent_audit_events(cfg.audit_db_path, last_id, limit)
     if not events:
-        return
-
-    resp = _post(
-        client, f"{hub_url}/agent/audit-sync", {"events": events}
+        return None
+    _audit_batch_size = _next_audit_batch_size(events)
+
+    return Section(
+        "audit",
+        "/agent/audit-sync",
+        {"vps_id": cfg.vps_id, "events": events},
+        lambda: _update_sync_state(last_audit_id=new_last_id),
+        more=len(events) == limit,
+        append=True,
     )
-    resp.raise_for_status()
 
-    state["last_audit_id"] = new_last_id
-    _save_sync_state(state)
+
+def traffic_batch_id(before: dict[str, Any], moved: dict[str, Any]) -> str:
+    """Identity of a traffic batch: the log positions it was read between.
+
+    The hub skips a batch id it has already applied, so a batch resent after
+    a lost response or replayed from the outbox is not counted twice.
+    """
+    ranges = [[name, before.get(name), position] for name, position in sorted(moved.items())]
+    canonical = json.dumps(ranges, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def traffic_section() -> Section | None:
+    cfg = get_config()
+    file_offsets = _state().get("file_offsets")
+
+    stats, new_offsets = collect_traffic_stats(_DEFAULT_LOG_DIR, file_offsets)
+    # Only the logs that moved are rewritten.
+    moved = {name: pos for name, pos in new_offsets.items() if file_offsets.get(name) != pos}
+    if not stats:
+        if moved:
+            _update_sync_state(file_offsets=moved)
+        return None
+
+    return Section(
+        "traffic",
+        "/agent/traffic-sync",
+        {
+            "vps_id": cfg.vps_id,
+            "stats": stats,
+            "batch_id": traffic_batch_id(file_offsets, moved),
+        },
+        lambda: _update_sync_state(file_offsets=moved),
+        append=True,
+    )
 
 
 # ---------------------------------------------------------------------------
-# Traffic stats collector
+# HTTP client helpers
 # ---------------------------------------------------------------------------
 
-_DEFAULT_LOG_DIR = Path("/var/log/nginx/domains")
+_BUNDLE_ENDPOINT = "/agent/sync"
+_CAPABILITIES_ENDPOINT = "/agent/capabilities"
 
+_MSGPACK_MEDIA_TYPE = "application/msgpack"
+# Bodies smaller than this are sent uncompressed (not worth the CPU).
+_COMPRESS_MIN_BYTES = 1024
+
+# Hub URLs that answered 404/405 on the bundle endpoint (older hub releases).
+_LEGACY_HUBS: set[str] = set()
+
+# Per hub URL, the body of GET /agent/capabilities ({} for older hubs).
+_HUB_CAPABILITIES: dict[str, dict[str, Any]] = {}
+
+# What the handshake learnt is trusted this long, so that a long-running
+# daemon notices a hub upgrade (or downgrade) without a restart.
+_HANDSHAKE_TTL = 3600.0
+# Per hub URL, when its handshake expires (time.monotonic()).
+_HANDSHAKE_EXPIRES: dict[str, float] = {}
 
-def collect_traffic_stats(
-    log_dir: Path, file_offsets: dict[str, int]
-) -> tuple[list[dict[str, Any]], dict[str, int]]:
-    """Parse per-domain JSON access logs incrementally and aggregate stats.
 
-    Returns a list of stat entries and updated file offsets.
+def _forget_hub(hub_url: str) -> None:
+    """Drop the cached handshake and bundle fallback; the next request re-handshakes."""
+    _HUB_CAPABILITIES.pop(hub_url, None)
+    _HANDSHAKE_EXPIRES.pop(hub_url, None)
+    _LEGACY_HUBS.discard(hub_url)
+
+
+def _capabilities(client: httpx.Client, hub_url: str) -> dict[str, Any]:
+    """Return the hub's advertised capabilities, cached for ``_HANDSHAKE_TTL``.
+
+    Hubs without the handshake endpoint get plain, uncompressed JSON.
+    Transport errors are not cached so the handshake is retried next time.
+    When the cache expires the bundle endpoint is tried again as well.
     """
-    stats: list[dict[str, Any]] = []
-    new_offsets = dict(file_offsets)
+    caps = _HUB_CAPABILITIES.get(hub_url)
+    if caps is not None:
+        if time.monotonic() < _HANDSHAKE_EXPIRES.get(hub_url, float("inf")):
+            return caps
+        _forget_hub(hub_url)
+    try:
+        resp = client.get(f"{hub_url}{_CAPABILITIES_ENDPOINT}", timeout=10.0)
+    except httpx.HTTPError:
+        return {}
+    if resp.status_code == 200:
+        caps = resp.json()
+    elif resp.status_code in (404, 405):
+        caps = {}
+    else:
+        return {}
+    _HUB_CAPABILITIES[hub_url] = caps
+    _HANDSHAKE_EXPIRES[hub_url] = time.monotonic() + _HANDSHAKE_TTL
+    return caps
+
+
+def _serialise(payload: dict[str, Any], caps: dict[str, Any]) -> tuple[bytes, dict[str, str]]:
+    """Serialise *payload* in the most compact format the hub accepts."""
+    if msgpack is not None and _MSGPACK_MEDIA_TYPE in caps.get("formats", []):
+        return msgpack.packb(payload), {"Content-Type": _MSGPACK_MEDIA_TYPE}
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    return body, {"Content-Type": "application/json"}
+
+
+def _compress(
+    body: bytes, headers: dict[str, str], caps: dict[str, Any]
+) -> tuple[bytes, dict[str, str]]:
+    if len(body) >= _COMPRESS_MIN_BYTES:
+        encodings = caps.get("encodings", [])
+        if zstandard is not None and "zstd" in encodings:
+            body = zstandard.ZstdCompressor(level=3).compress(body)
+            headers["Content-Encoding"] = "zstd"
+        elif "gzip" in encodings:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+    return body, headers
 
-    if not log_dir.is_dir():
-        return stats, new_offsets
 
-    for log_file in sorted(log_dir.glob("*.access.json")):
-        domain = log_file.name.replace(".access.json", "")
-        offset = file_offsets.get(log_file.name, 0)
+def _post(
+    client: httpx.Client, hub_url: str, path: str, payload: dict[str, Any]
+) -> httpx.Response:
+    """POST *payload* to the hub (negotiated encoding) with a 30s timeout."""
+    caps = _capabilities(client, hub_url)
+    raw, headers = _serialise(payload, caps)
+    body, headers = _compress(raw, headers, caps)
+    metrics.observe("vsa_agent_http_payload_bytes", len(raw), endpoint=path)
+    metrics.observe("vsa_agent_http_sent_bytes", len(body), endpoint=path)
+    started = time.monotonic()
+    try:
+        resp = client.post(f"{hub_url}{path}", content=body, headers=headers, timeout=30.0)
+    except httpx.HTTPError as exc:
+        metrics.inc("vsa_agent_http_requests_total", endpoint=path, status="error")
+        if isinstance(exc, httpx.TransportError):
+            # The hub may come back as a different release: re-handshake.
+            _forget_hub(hub_url)
+        raise
+    finally:
+        elapsed = time.monotonic() - started
+        metrics.observe("vsa_agent_http_request_duration_seconds", elapsed, endpoint=path)
+    metrics.inc("vsa_agent_http_requests_total", endpoint=path, status=str(resp.status_code))
+    if resp.status_code == 415:
+        # Hub no longer accepts what it advertised (e.g. downgraded): re-handshake.
+        _forget_hub(hub_url)
+    _note_sync_hint(resp)
+    return resp
 
-        try:
-            file_size = log_file.stat().st_size
-        except OSError:
-            continue
 
-        if file_size <= offset:
-            # File was truncated (rotated) — reset offset
-            if file_size < offset:
-                offset = 0
-            else:
-                continue
+# ---------------------------------------------------------------------------
+# Hub backpressure
+# ---------------------------------------------------------------------------
 
-        requests = 0
-        status_2xx = 0
-        status_3xx = 0
-        status_4xx = 0
-        status_5xx = 0
-        bytes_sent = 0
-        total_request_time = 0.0
-        period_start: str | None = None
-        period_end: str | None = None
+_NEXT_SYNC_HEADER = "X-Next-Sync-In"
+# Upper bounds on what the hub can ask for, so a misconfigured hub cannot
+# silence an agent long enough for it to be reported offline.
+_MAX_SYNC_HINT = 300.0
+_MAX_RETRY_AFTER = 3600.0
 
+# Seconds the hub last asked agents to wait between syncs (None: no hint).
+_sync_hint: float | None = None
+
+
+def _note_sync_hint(resp: httpx.Response) -> None:
+    """Remember the hub's suggested interval (``X-Next-Sync-In``) from any response."""
+    global _sync_hint
+    value = resp.headers.get(_NEXT_SYNC_HEADER)
+    if value is None:
+        _sync_hint = None
+        return
+    try:
+        _sync_hint = min(max(float(value), 0.0), _MAX_SYNC_HINT) or None
+    except ValueError:
+        _sync_hint = None
+
+
+def _retry_after(exc: BaseException) -> float | None:
+    """Seconds from a 429/503 ``Retry-After`` header (delta or HTTP date), if any."""
+    if not isinstance(exc, httpx.HTTPStatusError):
+        return None
+    if exc.response.status_code not in (429, 503):
+        return None
+    value = exc.response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
         try:
-            with open(log_file, "r") as f:
-                f.seek(offset)
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    try:
-                        entry = json.loads(line)
-                    except json.JSONDecodeError:
-                        continue
-
-                    requests += 1
-                    status = entry.get("status", 0)
-                    if isinstance(status, str):
-                        try:
-                            status = int(status)
-                        except ValueError:
-                            status = 0
-
-                    if 200 <= status < 300:
-                        status_2xx += 1
-                    elif 300 <= status < 400:
-                        status_3xx += 1
-                    elif 400 <= status < 500:
-                        status_4xx += 1
-                    elif 500 <= status < 600:
-                        status_5xx += 1
-
-                    bs = entry.get("body_bytes_sent", 0)
-                    if isinstance(bs, str):
-                        try:
-                            bs = int(bs)
-                        except ValueError:
-                            bs = 0
-                    bytes_sent += bs
-
-                    rt = entry.get("request_time", 0)
-                    if isinstance(rt, str):
-                        try:
-                            rt = float(rt)
-                        except ValueError:
-                            rt = 0.0
-                    total_request_time += rt
-
-                    ts = entry.get("time", "")
-                    if ts:
-                        if period_start is None:
-                            period_start = ts
-                        period_end = ts
-
-                new_offset = f.tell()
-        except OSError:
-            continue
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=UTC)
+        seconds = (when - datetime.now(UTC)).total_seconds()
+    return min(max(seconds, 0.0), _MAX_RETRY_AFTER)
 
-        new_offsets[log_file.name] = new_offset
 
-        if requests > 0:
-            avg_request_time_ms = int((total_request_time / requests) * 1000)
-            stats.append(
-                {
-                    "domain": domain,
-                    "requests": requests,
-                    "status_2xx": status_2xx,
-                    "status_3xx": status_3xx,
-                    "status_4xx": status_4xx,
-                    "status_5xx": status_5xx,
-                    "bytes_sent": bytes_sent,
-                    "avg_request_time_ms": avg_request_time_ms,
-                    "period_start": period_start or "",
-                    "period_end": period_end or "",
-                }
-            )
+def vps_phase(vps_id: str) -> float:
+    """Stable offset in [0, 1) for *vps_id*, used to spread the fleet over time.
 
-    return stats, new_offsets
+    Derived from a hash rather than drawn at random so that a VPS keeps its
+    slot across restarts and agents started together stay apart.
+    """
+    digest = hashlib.sha256(vps_id.encode()).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64
 
 
-def sync_traffic_stats(client: httpx.Client, hub_url: str) -> None:
-    cfg = get_config()
-    state = _load_sync_state()
-    file_offsets = state.get("file_offsets", {})
+def _json_or_empty(resp: httpx.Response) -> dict[str, Any]:
+    try:
+        body = resp.json()
+    except ValueError:
+        return {}
+    return body if isinstance(body, dict) else {}
 
-    stats, new_offsets = collect_traffic_stats(_DEFAULT_LOG_DIR, file_offsets)
-    if not stats:
-        state["file_offsets"] = new_offsets
-        _save_sync_state(state)
-        return
 
-    resp = _post(
-        client,
-        f"{hub_url}/agent/traffic-sync",
-        {"vps_id": cfg.vps_id, "stats": stats},
-    )
+def _send_section(
+    client: httpx.Client, hub_url: str, section: Section, body: dict[str, Any]
+) -> dict[str, Any]:
+    """POST one section body to its dedicated (pre-bundle) endpoint."""
+    resp = _post(client, hub_url, section.endpoint, body)
+    resp.raise_for_status()
+    return _json_or_empty(resp)
+
+
+def _send_bundle(
+    client: httpx.Client, hub_url: str, bodies: dict[str, dict[str, Any]]
+) -> dict[str, dict[str, Any]] | None:
+    """POST all section bodies in one request.
+
+    Returns the per-section results, or None (and remembers it) when the hub
+    has no bundle endpoint.
+    """
+    payload: dict[str, Any] = {"vps_id": get_config().vps_id, **bodies}
+    resp = _post(client, hub_url, _BUNDLE_ENDPOINT, payload)
+    if resp.status_code in (404, 405):
+        _LEGACY_HUBS.add(hub_url)
+        return None
     resp.raise_for_status()
+    sections = _json_or_empty(resp).get("sections") or {}
+    return {name: sections.get(name) or {} for name in bodies}
+
+
+# ---------------------------------------------------------------------------
+# Snapshot fingerprints
+# ---------------------------------------------------------------------------
+
+
+def _acked_fingerprint(name: str) -> str | None:
+    return _state().get_item("fingerprints", name)
+
 
-    state["file_offsets"] = new_offsets
-    _save_sync_state(state)
+def _remember_fingerprint(name: str, fingerprint: str | None) -> None:
+    if _acked_fingerprint(name) != fingerprint:
+        _update_sync_state(fingerprints={name: fingerprint})
+
+
+def _section_body(section: Section, caps: dict[str, Any]) -> dict[str, Any]:
+    """Full payload, or just the fingerprint if the hub already has this snapshot."""
+    if section.fingerprint is None:
+        return section.payload
+    if caps.get("fingerprints") and _acked_fingerprint(section.name) == section.fingerprint:
+        return {"vps_id": section.payload["vps_id"], "fingerprint": section.fingerprint}
+    return {**section.payload, "fingerprint": section.fingerprint}
 
 
 # ---------------------------------------------------------------------------
 # Orchestrator
 # ---------------------------------------------------------------------------
 
-_STEPS: list[tuple[str, Any]] = [
-    ("Heartbeat", sync_heartbeat),
-    ("Containers", sync_containers),
-    ("Certificates", sync_certificates),
-    ("Domains", sync_domains),
-    ("Audit events", sync_audit_events),
-    ("Traffic stats", sync_traffic_stats),
+
+class SyncStep(NamedTuple):
+    """One collector, with its daemon interval and per-run collection timeout."""
+
+    key: str
+    label: str
+    collect: Callable[[], Section | None]
+    interval: float
+    timeout: float = 60.0
+
+
+_STEPS: list[SyncStep] = [
+    SyncStep("heartbeat", "Heartbeat", heartbeat_section, 15.0, 15.0),
+    SyncStep("containers", "Containers", containers_section, 30.0, 60.0),
+    SyncStep("certificates", "Certificates", certificates_section, 3600.0, 120.0),
+    SyncStep("domains", "Domains", domains_section, 300.0, 30.0),
+    SyncStep("audit", "Audit events", audit_section, 30.0, 60.0),
+    SyncStep("traffic", "Traffic stats", traffic_section, 10.0, 120.0),
 ]
 
 
-def run_sync(hub_url: str, token: str) -> None:
-    """Execute one full sync cycle against the hub."""
-    client = httpx.Client(headers={"Authorization": f"Bearer {token}"})
+def _make_client(token: str) -> httpx.Client:
+    """Build the hub client; a single instance is reused across cycles."""
+    return httpx.Client(
+        headers={"Authorization": f"Bearer {token}"},
+        limits=httpx.Limits(max_keepalive_connections=len(_STEPS), keepalive_expiry=300.0),
+    )
+
+
+def _make_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=len(_STEPS), thread_name_prefix="vsa-sync")
+
+
+def _report_ok(step: SyncStep) -> None:
+    console.print(f"  [green]\u2713[/green] {step.label}")
+
+
+def _report_error(step: SyncStep, exc: BaseException | str) -> None:
+    console.print(f"  [red]\u2717[/red] {step.label}: {exc}")
+
+
+def _report_queued(step: SyncStep, reason: str) -> None:
+    console.print(f"  [yellow]\u2026[/yellow] {step.label}: queued ({reason})")
+
+
+def _acknowledge(step: SyncStep, section: Section, result: dict[str, Any]) -> bool:
+    """Run the section's ``on_ack`` and remember its fingerprint.
+
+    A snapshot the hub only queued (``accepted``) may still be lost there,
+    so its fingerprint is forgotten instead: the next cycle sends it in full
+    until the hub reports it ``unchanged``.
+    """
     try:
-        for label, fn in _STEPS:
-            try:
-                fn(client, hub_url)
-                console.print(f"  [green]\u2713[/green] {label}")
-            except Exception as exc:
-                console.print(f"  [red]\u2717[/red] {label}: {exc}")
+        if section.on_ack is not None:
+            section.on_ack()
+        if section.fingerprint is not None:
+            stored = result.get("status") != "accepted"
+            _remember_fingerprint(section.name, section.fingerprint if stored else None)
+    except Exception as exc:
+        _report_error(step, exc)
+        return False
+    _report_ok(step)
+    return True
+
+
+def _post_sections(
+    executor: ThreadPoolExecutor,
+    client: httpx.Client,
+    hub_url: str,
+    collected: list[tuple[SyncStep, Section]],
+    bodies: dict[str, dict[str, Any]],
+) -> dict[str, dict[str, Any] | BaseException]:
+    """Send *bodies* as one bundle, or per endpoint (concurrently) to older hubs."""
+    if hub_url not in _LEGACY_HUBS:
+        try:
+            results = _send_bundle(client, hub_url, bodies)
+        except Exception as exc:
+            return {name: exc for name in bodies}
+        if results is not None:
+            return dict(results)
+
+    futures = {
+        section.name: executor.submit(_send_section, client, hub_url, section, bodies[section.name])
+        for _, section in collected
+    }
+    outcome: dict[str, dict[str, Any] | BaseException] = {}
+    for name, future in futures.items():
+        exc = future.exception()
+        outcome[name] = exc if exc is not None else future.result()
+    return outcome
+
+
+def _retryable(exc: BaseException) -> bool:
+    """Hub outage (worth spooling and retrying) rather than a rejected payload."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return isinstance(exc, httpx.TransportError)
+
+
+def _spool(outbox: Outbox, collected: list[tuple[SyncStep, Section]], reason: str) -> None:
+    """Queue sections in the outbox and acknowledge them locally.
+
+    Once a section is durably spooled its cursors (audit id, log offsets)
+    may advance: the outbox now owns the data.
+    """
+    for step, section in collected:
+        body = section.payload
+        if section.fingerprint is not None:
+            body = {**body, "fingerprint": section.fingerprint}
+        try:
+            outbox.put(section.name, section.endpoint, body, coalesce=not section.append)
+            if section.fingerprint is not None:
+                _remember_fingerprint(section.name, None)
+            if section.on_ack is not None:
+                section.on_ack()
+        except Exception as exc:
+            _report_error(step, exc)
+            continue
+        _report_queued(step, reason)
+
+
+def _replay_outbox(
+    client: httpx.Client, hub_url: str, outbox: Outbox
+) -> BaseException | None:
+    """Send spooled sections oldest-first; the error if the hub is still unavailable."""
+    replayed = 0
+    for entry in outbox.pending():
+        try:
+            _post(client, hub_url, entry.endpoint, entry.body).raise_for_status()
+        except Exception as exc:
+            if _retryable(exc):
+                console.print(f"  [red]\u2717[/red] Outbox replay: {exc}")
+                return exc
+            console.print(f"  [red]\u2717[/red] Outbox: hub rejected queued {entry.name}: {exc}")
+        else:
+            replayed += 1
+        outbox.remove(entry.id)
+    if replayed:
+        console.print(f"  [green]\u2713[/green] Outbox: replayed {replayed} queued section(s)")
+    return None
+
+
+def _deliver(
+    executor: ThreadPoolExecutor,
+    client: httpx.Client,
+    hub_url: str,
+    collected: list[tuple[SyncStep, Section]],
+    outbox: Outbox | None = None,
+) -> list[SyncStep]:
+    """Send collected sections, then acknowledge or report each one.
+
+    Returns the steps whose acknowledged section reported a backlog.
+
+    Unchanged snapshots go out as a bare fingerprint; if the hub's stored
+    fingerprint differs it answers ``resend`` and the full snapshot follows
+    in a second request.
+
+    With an *outbox*, previously queued sections are replayed first, and
+    sections that could not be delivered because the hub is unavailable are
+    queued instead of dropped; while backing off, the hub is not contacted.
+    A ``Retry-After`` from a 429/503 sets the length of that back-off.
+    """
+    if outbox is not None:
+        for _, section in collected:
+            if not section.append:
+                outbox.discard(section.name)
+        if outbox.backing_off():
+            _spool(outbox, collected, "hub backing off")
+            return []
+        error = _replay_outbox(client, hub_url, outbox)
+        if error is not None:
+            delay = outbox.record_failure(_retry_after(error))
+            _spool(outbox, collected, f"hub unavailable, retry in {delay:.0f}s")
+            return []
+
+    caps = _capabilities(client, hub_url)
+    bodies = {section.name: _section_body(section, caps) for _, section in collected}
+    results = _post_sections(executor, client, hub_url, collected, bodies)
+
+    resend = [
+        (step, section)
+        for step, section in collected
+        if isinstance(results[section.name], dict)
+        and results[section.name].get("status") == "resend"
+    ]
+    if resend:
+        full = {
+            section.name: {**section.payload, "fingerprint": section.fingerprint}
+            for _, section in resend
+        }
+        results.update(_post_sections(executor, client, hub_url, resend, full))
+
+    backlog: list[SyncStep] = []
+    undelivered: list[tuple[SyncStep, Section]] = []
+    for step, section in collected:
+        result = results[section.name]
+        if isinstance(result, BaseException):
+            if outbox is not None and _retryable(result):
+                undelivered.append((step, section))
+                continue
+            if section.fingerprint is not None:
+                _remember_fingerprint(section.name, None)
+            _report_error(step, result)
+        elif result.get("status") == "resend":
+            _report_error(step, "hub rejected the full snapshot")
+        elif _acknowledge(step, section, result) and section.more:
+            backlog.append(step)
+
+    if outbox is not None:
+        if undelivered:
+            retry_after = max(
+                (_retry_after(results[section.name]) or 0.0 for _, section in undelivered)
+            )
+            delay = outbox.record_failure(retry_after or None)
+            _spool(outbox, undelivered, f"hub unavailable, retry in {delay:.0f}s")
+        else:
+            outbox.record_success()
+    return backlog
+
+
+def _timed_collect(step: SyncStep) -> Section | None:
+    """Run *step*'s collector, recording its duration and outcome."""
+    started = time.monotonic()
+    result = "error"
+    try:
+        section = step.collect()
+        result = "empty" if section is None else "ok"
+        return section
+    finally:
+        elapsed = time.monotonic() - started
+        metrics.observe("vsa_agent_collect_duration_seconds", elapsed, step=step.key)
+        metrics.inc("vsa_agent_collect_total", step=step.key, result=result)
+        if result != "error":
+            metrics.set("vsa_agent_last_success_timestamp_seconds", time.time(), step=step.key)
+
+
+def _collect(
+    executor: ThreadPoolExecutor, steps: list[SyncStep]
+) -> tuple[list[tuple[SyncStep, Section]], dict[str, Future[Section | None]]]:
+    """Run collectors concurrently, waiting for each up to its own timeout."""
+    started = time.monotonic()
+    futures = {step.key: executor.submit(_timed_collect, step) for step in steps}
+    overdue: dict[str, Future[Section | None]] = {}
+    collected: list[tuple[SyncStep, Section]] = []
+    for step in sorted(steps, key=lambda s: s.timeout):
+        future = futures[step.key]
+        remaining = step.timeout - (time.monotonic() - started)
+        done, _ = wait([future], timeout=max(0.0, remaining))
+        if not done:
+            _report_error(step, f"timed out after {step.timeout:.0f}s")
+            overdue[step.key] = future
+            continue
+        exc = future.exception()
+        if exc is not None:
+            _report_error(step, exc)
+            continue
+        section = future.result()
+        if section is None:
+            _report_ok(step)
+        else:
+            collected.append((step, section))
+    return collected, overdue
+
+
+# Wall-clock budget per cycle for draining backlogs (e.g. audit events after
+# an outage) with back-to-back batches.
+_DRAIN_BUDGET = 20.0
+
+
+def _run_steps(
+    executor: ThreadPoolExecutor,
+    client: httpx.Client,
+    hub_url: str,
+    steps: list[SyncStep],
+    outbox: Outbox | None = None,
+) -> dict[str, Future[Section | None]]:
+    """Collect *steps* concurrently, then deliver what was collected.
+
+    Failures are reported per step. Steps whose section reported a backlog
+    are collected and delivered again until caught up or ``_DRAIN_BUDGET``
+    is spent. Returns the futures of steps that overran their timeout (they
+    keep running in the background and their data is dropped).
+
+    Ends with a one-line summary of the cycle and a refresh of the metrics
+    textfile (see ``_finish_cycle``).
+    """
+    started = time.monotonic()
+    since = metrics.snapshot()
+    overdue: dict[str, Future[Section | None]] = {}
+    while steps:
+        collected, late = _collect(executor, steps)
+        overdue.update(late)
+        if not collected:
+            break
+        steps = _deliver(executor, client, hub_url, collected, outbox)
+        if time.monotonic() - started >= _DRAIN_BUDGET:
+            break
+    _finish_cycle(time.monotonic() - started, since, outbox)
+    return overdue
+
+
+def _size(n: float) -> str:
+    if n < 1024:
+        return f"{n:.0f} B"
+    if n < 1024 * 1024:
+        return f"{n / 1024:.1f} KiB"
+    return f"{n / (1024 * 1024):.1f} MiB"
+
+
+def _finish_cycle(elapsed: float, since: Snapshot, outbox: Outbox | None) -> None:
+    """Record cycle metrics, print the cycle summary and write the textfile."""
+    metrics.observe("vsa_agent_cycle_duration_seconds", elapsed)
+    metrics.set("vsa_agent_last_cycle_timestamp_seconds", time.time())
+    if outbox is not None:
+        sections, size = outbox.stats()
+        metrics.set("vsa_agent_outbox_sections", sections)
+        metrics.set("vsa_agent_outbox_bytes", size)
+
+    durations = metrics.by_label("vsa_agent_collect_duration_seconds_sum", "step", since)
+    slowest = sorted(durations.items(), key=lambda item: -item[1])[:3]
+    collectors = ", ".join(f"{key} {seconds:.2f}s" for key, seconds in slowest if seconds)
+    parts = [f"{elapsed:.2f}s", collectors or "no collectors"]
+    log_bytes = metrics.total("vsa_agent_log_read_bytes_total", since)
+    if log_bytes:
+        lines = metrics.total("vsa_agent_log_lines_total", since)
+        parts.append(f"log {_size(log_bytes)} / {lines:,.0f} lines")
+    requests = metrics.total("vsa_agent_http_request_duration_seconds_count", since)
+    if requests:
+        sent = metrics.total("vsa_agent_http_sent_bytes_sum", since)
+        waited = metrics.total("vsa_agent_http_request_duration_seconds_sum", since)
+        parts.append(f"hub {requests:.0f} req, {_size(sent)} in {waited:.2f}s")
+    console.print(f"[dim]Cycle: {'; '.join(parts)}[/dim]")
+
+    if _METRICS_PATH.parent.is_dir():
+        try:
+            metrics.write_textfile(_METRICS_PATH)
+        except OSError as exc:
+            console.print(f"[yellow]Could not write {_METRICS_PATH}: {exc}[/yellow]")
+
+
+def run_sync(hub_url: str, token: str, splay: float = 0.0) -> None:
+    """Execute one full sync cycle against the hub (all steps, one bundle).
+
+    The cycle starts ``vps_phase * splay`` seconds late so that a fleet
+    fired by the same timer does not hit the hub at once. While an
+    ``X-Next-Sync-In`` the hub sent last time has not elapsed, only the
+    heartbeat is sent (so the node does not look offline) and the other
+    sections wait for the next full cycle.
+    """
+    deferred = time.time() < _state().get("next_sync_at", 0.0)
+    steps = _STEPS
+    if deferred:
+        console.print("[dim]Hub asked to sync later; sending the heartbeat only.[/dim]")
+        steps = [step for step in _STEPS if step.key == "heartbeat"]
+    if splay > 0:
+        time.sleep(vps_phase(get_config().vps_id) * splay)
+
+    client = _make_client(token)
+    executor = _make_executor()
+    outbox = Outbox(_OUTBOX_PATH, state=_state())
+    try:
+        _run_steps(executor, client, hub_url, steps, outbox)
+        # Only a full cycle moves the deadline, or heartbeats could keep
+        # pushing it back and the other sections would never go out.
+        next_sync_at = time.time() + _sync_hint if _sync_hint else 0.0
+        if not deferred and (next_sync_at or _state().get("next_sync_at")):
+            _update_sync_state(next_sync_at=next_sync_at)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        client.close()
+        outbox.close()
+
+
+_TRAFFIC_KEY = "traffic"
+# In streaming mode the traffic timer only catches what inotify missed.
+_STREAM_RESCAN = 60.0
+
+
+def _start_log_watch(stop: threading.Event, wake: threading.Event) -> threading.Thread | None:
+    """Set *wake* whenever an access log changes; None if inotify is unavailable."""
+    try:
+        watcher = LogWatcher(_DEFAULT_LOG_DIR)
+    except OSError as exc:
+        console.print(f"[yellow]Traffic streaming unavailable ({exc}); polling instead.[/yellow]")
+        return None
+
+    def watch() -> None:
+        try:
+            while not stop.is_set():
+                if watcher.wait(1.0):
+                    wake.set()
+                    # Let a burst of appends coalesce into one wake-up.
+                    stop.wait(0.25)
+        finally:
+            watcher.close()
+            wake.set()
+
+    thread = threading.Thread(target=watch, name="vsa-log-watch", daemon=True)
+    thread.start()
+    return thread
+
+
+def run_daemon(
+    hub_url: str,
+    token: str,
+    intervals: dict[str, float] | None = None,
+    *,
+    steps: list[SyncStep] | None = None,
+    stop: threading.Event | None = None,
+    stream_traffic: float | None = None,
+    splay: float = 0.0,
+) -> None:
+    """Run collectors on their own schedules until SIGTERM/SIGINT.
+
+    *intervals* overrides the default interval per step key. Every step runs
+    once at startup, then again whenever its interval has elapsed; steps that
+    fall due together are collected concurrently and sent as one bundle. A
+    step that overran its timeout is not restarted until its previous run
+    has finished. Sections the hub could not take are queued in the outbox
+    and replayed once it is back. The hub client (and
+    its keep-alive connections) lives for the whole process.
+
+    With *stream_traffic* (seconds), the log directory is watched with
+    inotify and the traffic step runs as soon as a log grows, at most once
+    per *stream_traffic* seconds; its timer becomes a rescan safety net
+    (``_STREAM_RESCAN`` unless overridden). Without a traffic step nothing
+    is watched.
+
+    Each step's first run is delayed by ``vps_phase * min(interval, splay)``
+    so agents restarted together keep apart. When the hub sends
+    ``X-Next-Sync-In``, no step runs more often than that.
+    """
+    steps = steps if steps is not None else _STEPS
+    intervals = dict(intervals or {})
+    stop = stop or threading.Event()
+    wake = threading.Event()
+
+    previous_handlers: dict[int, Any] = {}
+    if threading.current_thread() is threading.main_thread():
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            previous_handlers[sig] = signal.signal(sig, lambda *_: (stop.set(), wake.set()))
+
+    streams = stream_traffic and any(step.key == _TRAFFIC_KEY for step in steps)
+    watcher = _start_log_watch(stop, wake) if streams else None
+    if watcher is not None:
+        intervals.setdefault(_TRAFFIC_KEY, _STREAM_RESCAN)
+
+    now = time.monotonic()
+    phase = vps_phase(get_config().vps_id) if splay > 0 else 0.0
+    next_run = {
+        step.key: now + phase * min(intervals.get(step.key, step.interval), splay)
+        for step in steps
+    }
+    started = {step.key: now for step in steps}
+    in_flight: dict[str, Future[Section | None]] = {}
+
+    client = _make_client(token)
+    executor = _make_executor()
+    outbox = Outbox(_OUTBOX_PATH, state=_state())
+    try:
+        while not stop.is_set():
+            now = time.monotonic()
+            # A wake-up with nothing due just waits out the rest of the interval.
+            woke = wake.is_set()
+            wake.clear()
+            if watcher is not None and woke:
+                next_run[_TRAFFIC_KEY] = min(
+                    next_run[_TRAFFIC_KEY],
+                    started[_TRAFFIC_KEY] + max(stream_traffic, _sync_hint or 0.0),
+                )
+            in_flight = {k: f for k, f in in_flight.items() if not f.done()}
+            due = [s for s in steps if next_run[s.key] <= now and s.key not in in_flight]
+            if due:
+                in_flight.update(_run_steps(executor, client, hub_url, due, outbox))
+                for step in due:
+                    interval = intervals.get(step.key, step.interval)
+                    started[step.key] = now
+                    next_run[step.key] = now + max(interval, _sync_hint or 0.0)
+            timeout = max(0.0, min(next_run.values()) - time.monotonic())
+            (wake if watcher is not None else stop).wait(timeout)
     finally:
+        if watcher is not None:
+            stop.set()
+            watcher.join()
+        executor.shutdown(wait=False, cancel_futures=True)
         client.close()
+        outbox.close()
+        for sig, handler in previous_handlers.items():
+            signal.signal(sig, handler)
+        console.print("[bold]Agent stopped.[/bold]")
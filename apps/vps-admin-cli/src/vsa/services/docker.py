@@ -1,11 +1,21 @@
-"""Docker and Docker Compose subprocess wrappers."""
+"""Docker and Docker Compose wrappers.
+
+Container and network operations go through the Engine API on the local
+socket (``docker_api``) when it is reachable, falling back to the ``docker``
+CLI otherwise (e.g. a remote ``DOCKER_HOST``). Compose always uses the CLI.
+"""
 
 from __future__ import annotations
 
 import subprocess
 from pathlib import Path
 
+from rich.console import Console
+
 from vsa.errors import ContainerNotFoundError, DockerError
+from vsa.services import docker_api
+
+console = Console(stderr=True)
 
 
 def _run(cmd: list[str], *, check: bool = True, capture: bool = True) -> subprocess.CompletedProcess[str]:
@@ -49,15 +59,28 @@ def compose_exec(compose_file: Path, service: str, *cmd: str) -> subprocess.Comp
 
 
 def network_exists(name: str) -> bool:
+    if docker_api.available():
+        return docker_api.network_exists(name)
     result = _run(["docker", "network", "inspect", name], check=False)
     return result.returncode == 0
 
 
 def network_create(name: str) -> None:
+    if docker_api.available():
+        docker_api.network_create(name)
+        return
     _run(["docker", "network", "create", name])
 
 
 def network_connect(network: str, container: str) -> None:
+    if docker_api.available():
+        info = docker_api.inspect_container(container)
+        if info is None:
+            raise ContainerNotFoundError(f"Container '{container}' not found")
+        if network in (info.get("NetworkSettings", {}).get("Networks") or {}):
+            return
+        docker_api.network_connect(network, container)
+        return
     # Check if already connected
     result = _run(
         ["docker", "inspect", "-f", "{{json .NetworkSettings.Networks}}", container],
@@ -70,17 +93,38 @@ def network_connect(network: str, container: str) -> None:
 
 def network_disconnect(network: str, container: str) -> None:
     """Disconnect a container from a Docker network (no error if not connected)."""
+    if docker_api.available():
+        docker_api.network_disconnect(network, container)
+        return
     _run(["docker", "network", "disconnect", network, container], check=False)
 
 
 def container_stop_remove(name: str) -> None:
-    """Stop and remove a container."""
+    """Stop and remove a container.
+
+    Best effort, like ``docker stop``/``docker rm`` without ``check``: a
+    failure is reported as a warning and does not abort the caller.
+    """
+    if docker_api.available():
+        for step in (docker_api.stop_container, docker_api.remove_container):
+            try:
+                step(name)
+            except DockerError as exc:
+                console.print(f"[yellow]Warning: {exc}[/yellow]")
+        return
     _run(["docker", "stop", name], check=False)
     _run(["docker", "rm", name], check=False)
 
 
 def find_container_by_port(external_port: int) -> str:
     """Find a running container publishing the given host port."""
+    if docker_api.available():
+        for summary in docker_api.list_containers():
+            for port in summary.get("Ports") or []:
+                if port.get("PublicPort") == external_port and port.get("IP") == "0.0.0.0":
+                    return docker_api.container_name(summary)
+        raise ContainerNotFoundError(f"No container found publishing port {external_port}")
+
     result = _run(["docker", "ps", "--format", "{{.Names}}\t{{.Ports}}"])
     for line in result.stdout.strip().splitlines():
         parts = line.split("\t", 1)
@@ -90,6 +134,9 @@ def find_container_by_port(external_port: int) -> str:
 
 
 def container_running(name: str) -> bool:
+    if docker_api.available():
+        info = docker_api.inspect_container(name)
+        return bool(info and info.get("State", {}).get("Running"))
     result = _run(
         ["docker", "inspect", "-f", "{{.State.Running}}", name],
         check=False,
@@ -0,0 +1,139 @@
+"""Docker Engine API client over the local unix socket.
+
+Talks HTTP to ``/var/run/docker.sock`` (or the ``unix://`` path in
+``DOCKER_HOST``) through one pooled ``httpx.Client``, so container and network
+operations cost a socket round-trip instead of a ``docker`` CLI process.
+Compose operations are not part of the Engine API and stay in ``docker.py``.
+"""
+
+from __future__ import annotations
+
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+import httpx
+
+from vsa.errors import DockerError
+
+DEFAULT_SOCKET = Path("/var/run/docker.sock")
+
+
+def socket_path() -> Path:
+    """Resolve the Docker daemon socket (``DOCKER_HOST=unix://...`` wins)."""
+    host = os.environ.get("DOCKER_HOST", "")
+    if host.startswith("unix://"):
+        return Path(host[len("unix://"):])
+    return DEFAULT_SOCKET
+
+
+def available() -> bool:
+    """True when the Engine API can be reached through a local unix socket."""
+    host = os.environ.get("DOCKER_HOST", "")
+    if host and not host.startswith("unix://"):
+        return False
+    return socket_path().is_socket()
+
+
+@lru_cache(maxsize=1)
+def get_client() -> httpx.Client:
+    """Return the shared Engine API client (created once, kept alive)."""
+    transport = httpx.HTTPTransport(uds=str(socket_path()))
+    return httpx.Client(transport=transport, base_url="http://docker", timeout=30.0)
+
+
+def _request(
+    method: str,
+    path: str,
+    *,
+    params: dict[str, Any] | None = None,
+    json: dict[str, Any] | None = None,
+    ok: tuple[int, ...] = (200, 201, 204, 304),
+) -> httpx.Response:
+    try:
+        resp = get_client().request(method, path, params=params, json=json)
+    except httpx.HTTPError as exc:
+        raise DockerError(f"Docker API {method} {path} failed: {exc}") from exc
+    if resp.status_code not in ok:
+        try:
+            message = resp.json().get("message", resp.text)
+        except ValueError:
+            message = resp.text
+        raise DockerError(f"Docker API {method} {path} returned {resp.status_code}: {message}")
+    return resp
+
+
+# ---------------------------------------------------------------------------
+# Containers
+# ---------------------------------------------------------------------------
+
+
+def list_containers(*, all: bool = False) -> list[dict[str, Any]]:
+    """``GET /containers/json`` — same data as ``docker ps [-a]``."""
+    return _request("GET", "/containers/json", params={"all": "1" if all else "0"}).json()
+
+
+def inspect_container(name: str) -> dict[str, Any] | None:
+    """``GET /containers/{name}/json``; None if the container does not exist."""
+    resp = _request("GET", f"/containers/{name}/json", ok=(200, 404))
+    return resp.json() if resp.status_code == 200 else None
+
+
+def stop_container(name: str) -> None:
+    """Stop a container (no error if it is missing or already stopped)."""
+    _request("POST", f"/containers/{name}/stop", ok=(204, 304, 404))
+
+
+def remove_container(name: str) -> None:
+    """Remove a container (no error if it is missing or already being removed)."""
+    _request("DELETE", f"/containers/{name}", ok=(204, 404, 409))
+
+
+# ---------------------------------------------------------------------------
+# Networks
+# ---------------------------------------------------------------------------
+
+
+def network_exists(name: str) -> bool:
+    return _request("GET", f"/networks/{name}", ok=(200, 404)).status_code == 200
+
+
+def network_create(name: str) -> None:
+    _request("POST", "/networks/create", json={"Name": name, "CheckDuplicate": True})
+
+
+def network_connect(network: str, container: str) -> None:
+    _request("POST", f"/networks/{network}/connect", json={"Container": container})
+
+
+def network_disconnect(network: str, container: str) -> None:
+    _request(
+        "POST",
+        f"/networks/{network}/disconnect",
+        json={"Container": container},
+        ok=(200, 403, 404),
+    )
+
+
+# ---------------------------------------------------------------------------
+# Formatting helpers (match ``docker ps`` output)
+# ---------------------------------------------------------------------------
+
+
+def container_name(summary: dict[str, Any]) -> str:
+    """First name of a container summary, without the leading slash."""
+    names = summary.get("Names") or [""]
+    return names[0].lstrip("/")
+
+
+def format_ports(ports: list[dict[str, Any]]) -> str:
+    """Render the ``Ports`` list like the ``docker ps`` PORTS column."""
+    rendered: list[str] = []
+    for p in ports or []:
+        private = f"{p.get('PrivatePort', '')}/{p.get('Type', 'tcp')}"
+        if p.get("PublicPort"):
+            rendered.append(f"{p.get('IP', '')}:{p['PublicPort']}->{private}")
+        else:
+            rendered.append(private)
+    return ", ".join(dict.fromkeys(rendered))
@@ -0,0 +1,97 @@
+"""inotify watcher for the per-domain nginx log directory (Linux only).
+
+Used by ``vsa agent run --stream-traffic`` to parse new access-log lines as
+soon as nginx appends them, instead of waiting for the traffic timer. The
+watcher only signals that some log changed: the traffic step then stats
+every log and reads just the bytes each one gained, which is cheap enough
+that tracking the changed names is not worth it.
+Talks to the kernel through ctypes so that no extra dependency is needed.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+from pathlib import Path
+
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# Appends, plus the renames/creations of a logrotate run.
+WATCH_MASK = IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+
+_EVENT = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+
+def _libc() -> ctypes.CDLL:
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        raise OSError(errno.ENOSYS, "inotify is not available on this platform")
+    return libc
+
+
+class LogWatcher:
+    """Reports when an ``*.access.json`` log in *directory* changed.
+
+    Raises OSError if inotify is unavailable or the directory cannot be
+    watched; callers fall back to periodic scanning.
+    """
+
+    def __init__(self, directory: Path, marker: str = ".access.json") -> None:
+        self.directory = directory
+        self.marker = marker
+        libc = _libc()
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        if libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK) < 0:
+            err = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(err, os.strerror(err), str(directory))
+
+    def wait(self, timeout: float) -> bool:
+        """Block up to *timeout* seconds; return True if any log changed.
+
+        Also True when the kernel queue overflowed or the directory itself
+        went away, since any log may have changed then.
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return False
+        changed = False
+        while True:
+            try:
+                data = os.read(self._fd, _READ_SIZE)
+            except BlockingIOError:
+                break
+            changed = self._decode(data) or changed
+        return changed
+
+    def _decode(self, data: bytes) -> bool:
+        changed = False
+        pos = 0
+        while pos + _EVENT.size <= len(data):
+            _, mask, _, length = _EVENT.unpack_from(data, pos)
+            pos += _EVENT.size
+            name = data[pos : pos + length].rstrip(b"\0").decode(errors="replace")
+            pos += length
+            if mask & (IN_Q_OVERFLOW | IN_DELETE_SELF) or self.marker in name:
+                changed = True
+        return changed
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
@@ -0,0 +1,213 @@
+"""Tests for the fast json_detailed access-log parser."""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import pytest
+from vsa_common import HyperLogLog, LatencyHistogram, TopK
+
+from vsa.services.access_log import (
+    TrafficBuckets,
+    bucket_start,
+    parse_access_log,
+    scan_chunk,
+    split_ranges,
+)
+
+
+def _nginx_line(ts: str, status: int, sent: int, rt: str, uri: str = "/") -> str:
+    return (
+        f'{{"time":"{ts}","domain":"example.com","remote_addr":"203.0.113.7",'
+        f'"method":"GET","uri":"{uri}","status":{status},"body_bytes_sent":{sent},'
+        f'"request_time":{rt},"upstream_response_time":"0.001","upstream_addr":"",'
+        f'"http_referer":"","http_user_agent":"curl/8","http_x_forwarded_for":"",'
+        f'"server_protocol":"HTTP/1.1"}}\n'
+    )
+
+
+class TestScanChunk:
+    def test_fast_path(self):
+        chunk = (
+            _nginx_line("2026-01-01T10:00:00+00:00", 200, 100, "0.010")
+            + _nginx_line("2026-01-01T10:00:01+00:00", 404, 50, "0.020")
+            + _nginx_line("2026-01-01T10:00:02+00:00", 502, 0, "1.500")
+        ).encode()
+        agg = TrafficBuckets()
+        scan_chunk(agg, chunk)
+        stat = agg.total().to_stat("example.com")
+        assert stat["requests"] == 3
+        assert (stat["status_2xx"], stat["status_4xx"], stat["status_5xx"]) == (1, 1, 1)
+        assert stat["bytes_sent"] == 150
+        assert stat["avg_request_time_ms"] == 510
+        assert stat["period_start"] == "2026-01-01T10:00:00+00:00"
+        assert stat["period_end"] == "2026-01-01T10:00:02+00:00"
+
+    def test_escaped_keys_in_values_are_ignored(self):
+        uri = '/?q=\\"status\\":999,\\"body_bytes_sent\\":1'
+        agg = TrafficBuckets()
+        scan_chunk(agg, _nginx_line("2026-01-01T10:00:00+00:00", 200, 7, "0.001", uri).encode())
+        total = agg.total()
+        assert total.requests == 1
+        assert total.status_2xx == 1
+        assert total.bytes_sent == 7
+
+    def test_mixed_layouts_fall_back_per_line(self):
+        chunk = (
+            _nginx_line("2026-01-01T10:00:00+00:00", 301, 10, "0.001")
+            + "\n"
+            + json.dumps({"status": "500", "body_bytes_sent": "20", "time": "t2"})
+            + "\nnot json\n"
+        ).encode()
+        agg = TrafficBuckets()
+        scan_chunk(agg, chunk)
+        total = agg.total()
+        assert total.requests == 2
+        assert total.status_3xx == 1
+        assert total.status_5xx == 1
+        assert total.bytes_sent == 30
+        # Unparseable times keep their raw period in the "" bucket.
+        assert agg.buckets[""].period_end == "t2"
+
+    def test_layout_without_domain_is_scanned_per_field(self):
+        chunk = "".join(
+            _nginx_line(f"2026-01-01T10:00:0{i}+00:00", 200, 1, "0.001", uri=f"/{i % 2}")
+            .replace('"domain":"example.com",', "")
+            for i in range(3)
+        ).encode()
+        agg = TrafficBuckets()
+        scan_chunk(agg, chunk)
+        [stat] = agg.to_stats("example.com")
+        assert stat["requests"] == 3
+        assert TopK.from_dict(stat["top"]["uri"]).top(1) == [("/0", 2, 0)]
+        assert TopK.from_dict(stat["top"]["user_agent"]).top() == [("curl/8", 3, 0)]
+
+
+class TestParseAccessLog:
+    def test_chunk_boundaries_and_partial_tail(self, tmp_path: Path):
+        log = tmp_path / "example.com.access.json"
+        lines = [
+            _nginx_line(f"2026-01-01T10:00:{i:02d}+00:00", 200, i, "0.001") for i in range(20)
+        ]
+        partial = _nginx_line("2026-01-01T10:01:00+00:00", 200, 999, "0.001")[:40]
+        log.write_text("".join(lines) + partial)
+
+        agg, offset = parse_access_log(log, 0, chunk_size=64)
+        assert agg.requests == 20
+        assert agg.total().bytes_sent == sum(range(20))
+        # The half-written line is left for the next run.
+        assert offset == len("".join(lines))
+
+        agg, offset2 = parse_access_log(log, offset)
+        assert agg.requests == 0
+        assert offset2 == offset
+
+
+class TestBuckets:
+    def test_bucket_start(self):
+        assert bucket_start("2026-01-01T10:04:59+01:00") == "2026-01-01T10:04:00+01:00"
+        assert bucket_start("2026-01-01T10:04:59Z") == "2026-01-01T10:04:00Z"
+        assert bucket_start("2026-01-01T10:04:59.250+00:00") == "2026-01-01T10:04:00+00:00"
+        assert bucket_start("2026-01-01 10:04:59") == "2026-01-01T10:04:00"
+        assert bucket_start("t1") == ""
+
+    def test_lines_split_into_minute_buckets(self):
+        chunk = (
+            _nginx_line("2026-01-01T10:00:58+00:00", 200, 1, "0.100")
+            + _nginx_line("2026-01-01T10:00:59+00:00", 200, 2, "0.100")
+            + _nginx_line("2026-01-01T10:01:00+00:00", 500, 4, "2.000")
+        ).encode()
+        agg = TrafficBuckets()
+        scan_chunk(agg, chunk)
+        stats = agg.to_stats("example.com")
+        assert [(s["period_start"], s["period_end"], s["requests"]) for s in stats] == [
+            ("2026-01-01T10:00:00+00:00", "2026-01-01T10:01:00+00:00", 2),
+            ("2026-01-01T10:01:00+00:00", "2026-01-01T10:02:00+00:00", 1),
+        ]
+        # The spike stays in its own minute instead of being averaged away.
+        assert stats[1]["status_5xx"] == 1
+        assert stats[1]["avg_request_time_ms"] == 2000
+        assert stats[0]["request_time_ms_total"] == 200
+
+    def test_merge_adds_up(self):
+        a, b = TrafficBuckets(), TrafficBuckets()
+        scan_chunk(a, _nginx_line("2026-01-01T10:00:10+00:00", 200, 5, "0.010").encode())
+        scan_chunk(b, _nginx_line("2026-01-01T10:00:20+00:00", 404, 7, "0.030").encode())
+        a.merge(b)
+        [stat] = a.to_stats("example.com")
+        assert stat["requests"] == 2
+        assert stat["bytes_sent"] == 12
+        assert stat["request_time_ms_total"] == 40
+
+    def test_latency_histograms_per_bucket(self):
+        line = _nginx_line("2026-01-01T10:00:00+00:00", 200, 1, "0.250")
+        line = line.replace(
+            '"upstream_response_time":"0.001"', '"upstream_response_time":"0.100, 0.050"'
+        )
+        no_upstream = _nginx_line("2026-01-01T10:00:01+00:00", 502, 1, "0.004").replace(
+            '"upstream_response_time":"0.001"', '"upstream_response_time":"-"'
+        )
+        agg = TrafficBuckets()
+        scan_chunk(agg, (line + no_upstream).encode())
+        [stat] = agg.to_stats("example.com")
+        latency = LatencyHistogram.from_dict(stat["latency"])
+        upstream = LatencyHistogram.from_dict(stat["upstream_latency"])
+        assert latency.count == 2
+        assert latency.quantile(1.0) == pytest.approx(250, rel=0.02)
+        # Two upstreams tried: their times add up; "-" never reached one.
+        assert upstream.count == 1
+        assert upstream.quantile(0.5) == pytest.approx(150, rel=0.02)
+
+
+    def test_top_keys_per_bucket(self):
+        lines = [
+            _nginx_line("2026-01-01T10:00:00+00:00", 200, 1, "0.001", uri="/a"),
+            _nginx_line("2026-01-01T10:00:01+00:00", 200, 1, "0.001", uri='/q?s=\\"x\\"'),
+            _nginx_line("2026-01-01T10:00:02+00:00", 200, 1, "0.001", uri="/a"),
+        ]
+        lines[1] = lines[1].replace("203.0.113.7", "198.51.100.2")
+        agg = TrafficBuckets()
+        scan_chunk(agg, "".join(lines).encode())
+        [stat] = agg.to_stats("example.com")
+        uris = TopK.from_dict(stat["top"]["uri"])
+        clients = TopK.from_dict(stat["top"]["remote_addr"])
+        agents = TopK.from_dict(stat["top"]["user_agent"])
+        assert uris.top() == [("/a", 2, 0), ('/q?s="x"', 1, 0)]
+        assert clients.top(1) == [("203.0.113.7", 2, 0)]
+        assert agents.top() == [("curl/8", 3, 0)]
+
+
+    def test_unique_visitors_merge_across_buckets(self):
+        a, b = TrafficBuckets(), TrafficBuckets()
+        line = _nginx_line("2026-01-01T10:00:00+00:00", 200, 1, "0.001")
+        scan_chunk(a, (line + line.replace("203.0.113.7", "198.51.100.2")).encode())
+        scan_chunk(b, line.replace("10:00:00", "10:00:30").encode())
+        a.merge(b)
+        [stat] = a.to_stats("example.com")
+        assert HyperLogLog.from_dict(stat["visitors"]).estimate() == 2
+
+
+class TestSplitRanges:
+    def test_ranges_are_line_aligned_and_merge_to_whole(self, tmp_path: Path):
+        log = tmp_path / "example.com.access.json"
+        lines = [
+            _nginx_line(ts, 200 + i % 4 * 100, i, "0.002")
+            for i in range(300)
+            for ts in [f"2026-01-01T10:{i // 60:02d}:{i % 60:02d}+00:00"]
+        ]
+        data = "".join(lines)
+        log.write_text(data)
+        whole, end = parse_access_log(log, 0)
+
+        bounds = split_ranges(log, 0, len(data), 7)
+        assert bounds[0] == 0 and bounds[-1] == len(data)
+        assert all(data[b - 1] == "\n" for b in bounds[1:-1])
+
+        merged = TrafficBuckets()
+        last = 0
+        for start, stop in zip(bounds, bounds[1:]):
+            part, last = parse_access_log(log, start, 64, stop)
+            merged.merge(part)
+        assert last == end
+        assert merged.to_stats("example.com") == whole.to_stats("example.com")
@@ -0,0 +1,49 @@
+"""Tests for the agent's Prometheus textfile metrics."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+from vsa.services.agent_metrics import Registry
+
+
+class TestRegistry:
+    def test_render_text_format(self):
+        reg = Registry()
+        reg.inc("vsa_agent_collect_total", step="traffic", result="ok")
+        reg.inc("vsa_agent_collect_total", step="traffic", result="ok")
+        reg.observe("vsa_agent_collect_duration_seconds", 0.25, step="traffic")
+        reg.observe("vsa_agent_collect_duration_seconds", 0.5, step="traffic")
+        reg.set("vsa_agent_outbox_sections", 3)
+        reg.inc("vsa_agent_http_requests_total", endpoint='/a"b', status="200")
+        text = reg.render()
+        assert "# TYPE vsa_agent_collect_duration_seconds summary\n" in text
+        assert 'vsa_agent_collect_duration_seconds_sum{step="traffic"} 0.75\n' in text
+        assert 'vsa_agent_collect_duration_seconds_count{step="traffic"} 2\n' in text
+        assert 'vsa_agent_collect_total{result="ok",step="traffic"} 2\n' in text
+        assert "# TYPE vsa_agent_outbox_sections gauge\nvsa_agent_outbox_sections 3\n" in text
+        assert 'endpoint="/a\\"b"' in text
+        # One HELP/TYPE header per family.
+        assert text.count("# TYPE vsa_agent_collect_duration_seconds ") == 1
+
+    def test_deltas_since_snapshot(self):
+        reg = Registry()
+        reg.observe("vsa_agent_collect_duration_seconds", 1.0, step="a")
+        since = reg.snapshot()
+        reg.observe("vsa_agent_collect_duration_seconds", 0.5, step="a")
+        reg.observe("vsa_agent_collect_duration_seconds", 2.0, step="b")
+        assert reg.by_label("vsa_agent_collect_duration_seconds_sum", "step", since) == {
+            "a": 0.5,
+            "b": 2.0,
+        }
+        assert reg.total("vsa_agent_collect_duration_seconds_count", since) == 2
+        assert reg.total("vsa_agent_log_lines_total") == 0
+
+    def test_write_textfile_replaces_atomically(self, tmp_path: Path):
+        reg = Registry()
+        target = tmp_path / "vsa_agent.prom"
+        target.write_text("stale\n")
+        reg.inc("vsa_agent_log_lines_total", 42)
+        reg.write_textfile(target)
+        assert target.read_text().endswith("vsa_agent_log_lines_total 42\n")
+        assert [p.name for p in tmp_path.iterdir()] == ["vsa_agent.prom"]
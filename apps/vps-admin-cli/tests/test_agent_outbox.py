@@ -0,0 +1,76 @@
+"""Tests for the agent outbox — spooling, coalescing, eviction and backoff."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+from vsa.services.agent_outbox import BACKOFF_CAP, Outbox
+from vsa.services.agent_state import StateStore
+
+
+class TestOutbox:
+    def test_fifo_roundtrip(self, tmp_path: Path):
+        outbox = Outbox(tmp_path / "outbox.db")
+        outbox.put("audit", "/agent/audit-sync", {"events": [1]}, coalesce=False)
+        outbox.put("audit", "/agent/audit-sync", {"events": [2]}, coalesce=False)
+        entries = outbox.pending()
+        assert [e.body["events"] for e in entries] == [[1], [2]]
+        outbox.remove(entries[0].id)
+        assert len(outbox) == 1
+        outbox.close()
+
+        # Survives a restart.
+        reopened = Outbox(tmp_path / "outbox.db")
+        assert [e.body["events"] for e in reopened.pending()] == [[2]]
+        reopened.close()
+
+    def test_snapshots_keep_latest_only(self, tmp_path: Path):
+        outbox = Outbox(tmp_path / "outbox.db")
+        outbox.put("containers", "/agent/containers-sync", {"v": 1}, coalesce=True)
+        outbox.put("traffic", "/agent/traffic-sync", {"v": 1}, coalesce=False)
+        outbox.put("containers", "/agent/containers-sync", {"v": 2}, coalesce=True)
+        assert [(e.name, e.body["v"]) for e in outbox.pending()] == [
+            ("traffic", 1),
+            ("containers", 2),
+        ]
+        outbox.discard("containers")
+        assert [e.name for e in outbox.pending()] == ["traffic"]
+        outbox.close()
+
+    def test_evicts_oldest_over_cap(self, tmp_path: Path):
+        outbox = Outbox(tmp_path / "outbox.db", max_bytes=100)
+        for i in range(5):
+            outbox.put("traffic", "/agent/traffic-sync", {"i": i, "pad": "x" * 30}, coalesce=False)
+        kept = [e.body["i"] for e in outbox.pending()]
+        assert kept == [3, 4]
+        outbox.close()
+
+    def test_missing_file_is_empty(self, tmp_path: Path):
+        outbox = Outbox(tmp_path / "nope" / "outbox.db")
+        assert outbox.pending() == []
+        outbox.discard("containers")
+        assert not (tmp_path / "nope").exists()
+
+    def test_backoff_grows_with_jitter_and_resets(self, tmp_path: Path):
+        outbox = Outbox(tmp_path / "outbox.db")
+        assert not outbox.backing_off()
+        delays = [outbox.record_failure() for _ in range(12)]
+        assert outbox.backing_off()
+        assert 2.5 <= delays[0] <= 5.0
+        assert delays[3] > delays[0]
+        assert all(d <= BACKOFF_CAP for d in delays)
+        outbox.record_success()
+        assert not outbox.backing_off()
+
+    def test_backoff_survives_restart(self, tmp_path: Path):
+        state = StateStore(tmp_path / "state.db")
+        outbox = Outbox(tmp_path / "outbox.db", state=state)
+        outbox.record_failure()
+        outbox.record_failure()
+        outbox.close()
+
+        restarted = Outbox(tmp_path / "outbox.db", state=StateStore(tmp_path / "state.db"))
+        assert restarted.backing_off()
+        assert restarted.failures == 2
+        restarted.record_success()
+        assert state.get("outbox_backoff") == {"failures": 0, "retry_at": 0.0}
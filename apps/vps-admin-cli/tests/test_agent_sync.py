@@ -3,7 +3,9 @@
 from __future__ import annotations
 
 import json
+import os
 import sqlite3
+import time
 from pathlib import Path
 from unittest.mock import patch
 
@@ -11,7 +13,7 @@ import pytest
 
 from vsa.services.agent_sync import (
     _load_sync_state,
-    _save_sync_state,
+    _update_sync_state,
     collect_domains,
     collect_traffic_stats,
     collect_unsent_audit_events,
@@ -102,25 +104,172 @@ class TestParseCertOutput:
         assert result == []
 
 
+class TestCollectCertificates:
+    def _write_cert(
+        self, live_dir: Path, domain: str, *, days: int = 90, issuer_o: str = "Test CA"
+    ):
+        from datetime import UTC, datetime, timedelta
+
+        from cryptography import x509
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import ec
+        from cryptography.x509.oid import NameOID
+
+        key = ec.generate_private_key(ec.SECP256R1())
+        now = datetime.now(UTC)
+        cert = (
+            x509.CertificateBuilder()
+            .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, domain)]))
+            .issuer_name(
+                x509.Name(
+                    [
+                        x509.NameAttribute(NameOID.ORGANIZATION_NAME, issuer_o),
+                        x509.NameAttribute(NameOID.COMMON_NAME, "R11"),
+                    ]
+                )
+            )
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - timedelta(days=1))
+            .not_valid_after(now + timedelta(days=days))
+            .add_extension(
+                x509.SubjectAlternativeName([x509.DNSName(domain), x509.DNSName(f"www.{domain}")]),
+                critical=False,
+            )
+            .sign(key, hashes.SHA256())
+        )
+        (live_dir / domain).mkdir(parents=True, exist_ok=True)
+        path = live_dir / domain / "cert.pem"
+        path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+        return path
+
+    def test_reads_issuer_sans_and_status(self, tmp_path: Path):
+        from vsa.services.agent_sync import collect_certificates
+
+        live = tmp_path / "live"
+        self._write_cert(live, "example.com", issuer_o="Let's Encrypt")
+        self._write_cert(live, "old.com", days=-1)
+        (live / "README").write_text("readme")
+
+        result = {c["domain"]: c for c in collect_certificates(live)}
+        assert set(result) == {"example.com", "old.com"}
+        assert result["example.com"]["issuer"] == "Let's Encrypt"
+        assert result["example.com"]["sans"] == ["example.com", "www.example.com"]
+        assert result["example.com"]["status"] == "valid"
+        assert result["old.com"]["status"] == "expired"
+        assert result["old.com"]["issuer"] == "Test CA"
+
+    def test_unchanged_cert_not_reparsed(self, tmp_path: Path):
+        import os
+
+        from vsa.services import agent_sync
+
+        live = tmp_path / "live"
+        path = self._write_cert(live, "example.com")
+        agent_sync._CERT_CACHE.clear()
+
+        with patch.object(
+            agent_sync, "read_certificate", wraps=agent_sync.read_certificate
+        ) as spy:
+            agent_sync.collect_certificates(live)
+            agent_sync.collect_certificates(live)
+            assert spy.call_count == 1
+
+            # Renewal: new file content and mtime -> parsed again
+            self._write_cert(live, "example.com", days=30)
+            st = path.stat()
+            os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+            agent_sync.collect_certificates(live)
+            assert spy.call_count == 2
+
+    def test_unparseable_cert_unknown(self, tmp_path: Path):
+        from vsa.services.agent_sync import collect_certificates
+
+        (tmp_path / "broken.com").mkdir()
+        (tmp_path / "broken.com" / "cert.pem").write_text("not a cert")
+        result = collect_certificates(tmp_path)
+        assert result == [
+            {"domain": "broken.com", "expiry": "", "issuer": "", "sans": [], "status": "unknown"}
+        ]
+
+
 # ---------------------------------------------------------------------------
 # Sync state persistence
 # ---------------------------------------------------------------------------
 
 
 class TestSyncState:
+    def _paths(self, tmp_path: Path):
+        return (
+            patch("vsa.services.agent_sync._STATE_DB_PATH", tmp_path / "state.db"),
+            patch("vsa.services.agent_sync._STATE_PATH", tmp_path / "state.json"),
+        )
+
     def test_roundtrip(self, tmp_path: Path):
-        state_path = tmp_path / "state.json"
-        state = {"last_audit_id": 42}
-        with patch("vsa.services.agent_sync._STATE_PATH", state_path):
-            _save_sync_state(state)
+        db_patch, json_patch = self._paths(tmp_path)
+        with db_patch, json_patch:
+            _update_sync_state(last_audit_id=42, file_offsets={"a.access.json": {"offset": 7}})
+            _update_sync_state(file_offsets={"b.access.json": {"offset": 9}})
             loaded = _load_sync_state()
         assert loaded["last_audit_id"] == 42
+        # Map keys are merged entry by entry, not replaced.
+        assert loaded["file_offsets"] == {
+            "a.access.json": {"offset": 7},
+            "b.access.json": {"offset": 9},
+        }
 
     def test_missing_file(self, tmp_path: Path):
-        state_path = tmp_path / "nonexistent.json"
-        with patch("vsa.services.agent_sync._STATE_PATH", state_path):
+        db_patch, json_patch = self._paths(tmp_path)
+        with db_patch, json_patch:
+            loaded = _load_sync_state()
+        assert loaded == {"last_audit_id": 0, "file_offsets": {}, "fingerprints": {}}
+
+    def test_migrates_json_state(self, tmp_path: Path):
+        legacy = tmp_path / "state.json"
+        legacy.write_text(
+            json.dumps(
+                {
+                    "last_audit_id": 17,
+                    "file_offsets": {"a.access.json": 120},
+                    "fingerprints": {"domains": "abc"},
+                }
+            )
+        )
+        db_patch, json_patch = self._paths(tmp_path)
+        with db_patch, json_patch:
+            loaded = _load_sync_state()
+        assert loaded == {
+            "last_audit_id": 17,
+            "file_offsets": {"a.access.json": 120},
+            "fingerprints": {"domains": "abc"},
+        }
+        assert not legacy.exists()
+        assert (tmp_path / "state.json.migrated").exists()
+
+    def test_torn_json_state_is_dropped(self, tmp_path: Path):
+        (tmp_path / "state.json").write_text('{"last_audit_id": 1')
+        db_patch, json_patch = self._paths(tmp_path)
+        with db_patch, json_patch:
+            assert _load_sync_state()["last_audit_id"] == 0
+
+    def test_concurrent_updates_keep_every_key(self, tmp_path: Path):
+        import threading
+
+        db_patch, json_patch = self._paths(tmp_path)
+        with db_patch, json_patch:
+
+            def write(i: int) -> None:
+                for j in range(20):
+                    _update_sync_state(fingerprints={f"s{i}": str(j)}, last_audit_id=j)
+
+            threads = [threading.Thread(target=write, args=(i,)) for i in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
             loaded = _load_sync_state()
-        assert loaded == {"last_audit_id": 0, "file_offsets": {}}
+        assert loaded["fingerprints"] == {f"s{i}": "19" for i in range(4)}
+        assert loaded["last_audit_id"] == 19
 
 
 # ---------------------------------------------------------------------------
@@ -238,11 +387,13 @@ class TestCollectTrafficStats:
         assert s["bytes_sent"] == 1024 + 256 + 512
         # avg = (0.05 + 0.15 + 1.0) / 3 * 1000 ~ 400ms (allow float rounding)
         assert 399 <= s["avg_request_time_ms"] <= 400
+        # One-minute bucket containing all three lines.
         assert s["period_start"] == "2026-02-03T10:00:00+01:00"
-        assert s["period_end"] == "2026-02-03T10:00:02+01:00"
+        assert s["period_end"] == "2026-02-03T10:01:00+01:00"
+        assert s["request_time_ms_total"] == 1200
         # Offset should be set
         assert "example.com.access.json" in offsets
-        assert offsets["example.com.access.json"] > 0
+        assert offsets["example.com.access.json"]["offset"] > 0
 
     def test_incremental_offset(self, tmp_path: Path):
         """Second call with saved offset should return no new stats."""
@@ -308,6 +459,249 @@ class TestCollectTrafficStats:
         assert stats[0]["bytes_sent"] == 500
 
 
+class TestTrafficMetrics:
+    def test_bytes_lines_and_backlog(self, tmp_path: Path):
+        from vsa.services.agent_metrics import metrics
+        from vsa.services.agent_sync import collect_traffic_stats
+
+        line = (
+            '{"time":"2026-01-01T10:00:00+00:00","status":200,'
+            '"body_bytes_sent":1,"request_time":0.001}\n'
+        )
+        (tmp_path / "a.com.access.json").write_text(line * 3)
+        since = metrics.snapshot()
+        collect_traffic_stats(tmp_path, {})
+        assert metrics.total("vsa_agent_log_read_bytes_total", since) == len(line) * 3
+        assert metrics.total("vsa_agent_log_lines_total", since) == 3
+        assert metrics.snapshot()[("vsa_agent_log_backlog_bytes", ())] == len(line) * 3
+
+
+class TestTrafficBatchId:
+    def test_same_range_same_id(self, tmp_path: Path, tmp_config):
+        from vsa.services.agent_sync import traffic_section
+
+        line = (
+            '{"time":"2026-01-01T10:00:00+00:00","status":200,'
+            '"body_bytes_sent":1,"request_time":0.001}\n'
+        )
+        log = tmp_path / "logs" / "a.com.access.json"
+        log.parent.mkdir()
+        log.write_text(line * 2)
+        with (
+            patch("vsa.services.agent_sync.get_config", return_value=tmp_config),
+            patch("vsa.services.agent_sync._STATE_DB_PATH", tmp_path / "state.db"),
+            patch("vsa.services.agent_sync._STATE_PATH", tmp_path / "state.json"),
+            patch("vsa.services.agent_sync._DEFAULT_LOG_DIR", log.parent),
+        ):
+            # Not acknowledged: the same range is read again, with the same id.
+            first = traffic_section()
+            again = traffic_section()
+            assert first.payload["batch_id"] == again.payload["batch_id"]
+
+            again.on_ack()
+            with open(log, "a") as f:
+                f.write(line)
+            following = traffic_section()
+        assert following.payload["batch_id"] != first.payload["batch_id"]
+        assert following.payload["stats"][0]["requests"] == 1
+
+    def test_id_depends_on_positions_not_order(self):
+        from vsa.services.agent_sync import traffic_batch_id
+
+        a = {"dev": 1, "ino": 2, "offset": 10, "head": 3}
+        b = {"dev": 1, "ino": 2, "offset": 20, "head": 3}
+        assert traffic_batch_id({}, {"x": a, "y": b}) == traffic_batch_id({}, {"y": b, "x": a})
+        assert traffic_batch_id({}, {"x": b}) != traffic_batch_id({"x": a}, {"x": b})
+
+
+class TestLogRotation:
+    def _append(self, log: Path, statuses: list[int]) -> None:
+        with open(log, "a") as f:
+            for status in statuses:
+                entry = {"time": "t", "status": status, "body_bytes_sent": 1, "request_time": 0}
+                f.write(json.dumps(entry) + "\n")
+
+    def _requests(self, stats: list[dict]) -> int:
+        return sum(s["requests"] for s in stats)
+
+    def test_rename_finishes_rotated_file_first(self, tmp_path: Path):
+        log = tmp_path / "example.com.access.json"
+        self._append(log, [200] * 3)
+        _, offsets = collect_traffic_stats(tmp_path, {})
+
+        # Written after our last read, then renamed away by logrotate.
+        self._append(log, [500] * 2)
+        log.rename(tmp_path / "example.com.access.json.1")
+        # The new file is already bigger than the old offset.
+        self._append(log, [404] * 10)
+
+        stats, offsets = collect_traffic_stats(tmp_path, offsets)
+        assert self._requests(stats) == 12
+        assert sum(s["status_5xx"] for s in stats) == 2
+        assert sum(s["status_4xx"] for s in stats) == 10
+        assert offsets["example.com.access.json"]["ino"] == log.stat().st_ino
+
+        stats, _ = collect_traffic_stats(tmp_path, offsets)
+        assert stats == []
+
+    def test_rename_then_empty_live_file(self, tmp_path: Path):
+        log = tmp_path / "example.com.access.json"
+        self._append(log, [200] * 3)
+        _, offsets = collect_traffic_stats(tmp_path, {})
+
+        self._append(log, [500] * 2)
+        log.rename(tmp_path / "example.com.access.json.1")
+        log.touch()  # nginx reopened its log but has not written yet
+
+        stats, offsets = collect_traffic_stats(tmp_path, offsets)
+        assert self._requests(stats) == 2
+        position = offsets["example.com.access.json"]
+        assert (position["ino"], position["offset"]) == (log.stat().st_ino, 0)
+
+        self._append(log, [404] * 4)
+        stats, offsets = collect_traffic_stats(tmp_path, offsets)
+        assert self._requests(stats) == 4
+        assert sum(s["status_4xx"] for s in stats) == 4
+        assert collect_traffic_stats(tmp_path, offsets)[0] == []
+
+    def test_copytruncate_then_empty_live_file(self, tmp_path: Path):
+        log = tmp_path / "example.com.access.json"
+        self._append(log, [200] * 3)
+        _, offsets = collect_traffic_stats(tmp_path, {})
+        self._append(log, [500])
+
+        (tmp_path / "example.com.access.json.1").write_bytes(log.read_bytes())
+        with open(log, "r+") as f:
+            f.truncate(0)
+
+        stats, offsets = collect_traffic_stats(tmp_path, offsets)
+        assert self._requests(stats) == 1
+        assert offsets["example.com.access.json"]["offset"] == 0
+
+        self._append(log, [301] * 2)
+        stats, _ = collect_traffic_stats(tmp_path, offsets)
+        assert self._requests(stats) == 2
+
+    def test_rotated_file_already_compressed(self, tmp_path: Path):
+        log = tmp_path / "example.com.access.json"
+        self._append(log, [200] * 3)
+        _, offsets = collect_traffic_stats(tmp_path, {})
+        log.rename(tmp_path / "example.com.access.json.1.gz")
+        self._append(log, [200])
+
+        stats, _ = collect_traffic_stats(tmp_path, offsets)
+        assert self._requests(stats) == 1
+
+    def test_copytruncate(self, tmp_path: Path):
+        log = tmp_path / "example.com.access.json"
+        self._append(log, [200] * 5)
+        _, offsets = collect_traffic_stats(tmp_path, {})
+        self._append(log, [500] * 2)
+
+        # logrotate copies the file, then truncates it in place (same inode).
+        (tmp_path / "example.com.access.json.1").write_bytes(log.read_bytes())
+        with open(log, "r+") as f:
+            f.truncate(0)
+        self._append(log, [301])
+
+        stats, offsets = collect_traffic_stats(tmp_path, offsets)
+        assert self._requests(stats) == 3
+        assert sum(s["status_5xx"] for s in stats) == 2
+        assert offsets["example.com.access.json"]["offset"] == log.stat().st_size
+
+    def test_copytruncate_regrown_past_offset(self, tmp_path: Path):
+        log = tmp_path / "example.com.access.json"
+        self._append(log, [200] * 2)
+        _, offsets = collect_traffic_stats(tmp_path, {})
+
+        (tmp_path / "example.com.access.json.1").write_bytes(log.read_bytes())
+        with open(log, "r+") as f:
+            f.truncate(0)
+        # The new content starts differently and is longer than the old offset.
+        self._append(log, [404] * 6)
+
+        stats, _ = collect_traffic_stats(tmp_path, offsets)
+        assert self._requests(stats) == 6
+        assert sum(s["status_4xx"] for s in stats) == 6
+
+    def test_legacy_integer_offset(self, tmp_path: Path):
+        log = tmp_path / "example.com.access.json"
+        self._append(log, [200] * 2)
+        first_two = log.stat().st_size
+        self._append(log, [500])
+
+        stats, offsets = collect_traffic_stats(tmp_path, {log.name: first_two})
+        assert self._requests(stats) == 1
+        assert offsets[log.name]["offset"] == log.stat().st_size
+
+
+class TestCollectTrafficStatsParallel:
+    def test_process_pool_matches_serial(self, tmp_path: Path):
+        from vsa.services import agent_sync
+
+        log_dir = tmp_path / "domains"
+        log_dir.mkdir()
+        for domain, n in (("a.com", 400), ("b.com", 50)):
+            with open(log_dir / f"{domain}.access.json", "w") as f:
+                for i in range(n):
+                    f.write(
+                        json.dumps(
+                            {
+                                "time": f"2026-02-03T10:{i // 60:02d}:{i % 60:02d}+01:00",
+                                "status": 200 if i % 5 else 503,
+                                "body_bytes_sent": i,
+                                "request_time": 0.01 * (i % 7),
+                            }
+                        )
+                        + "\n"
+                    )
+            # A line still being written must not be consumed by either path.
+            with open(log_dir / f"{domain}.access.json", "a") as f:
+                f.write('{"time":"2026-02-03T11:00:00+01:00","sta')
+
+        serial = collect_traffic_stats(log_dir, {})
+        try:
+            with (
+                patch.object(agent_sync, "_PARALLEL_MIN_BYTES", 0),
+                patch.object(agent_sync, "_RANGE_BYTES", 4096),
+                patch("vsa.services.agent_sync.os.cpu_count", return_value=4),
+            ):
+                parallel = collect_traffic_stats(log_dir, {})
+        finally:
+            agent_sync._traffic_pool().shutdown()
+            agent_sync._traffic_pool.cache_clear()
+        assert parallel == serial
+        assert sum(s["requests"] for s in serial[0]) == 450
+
+    def test_dead_worker_falls_back_and_restarts_pool(self, tmp_path: Path):
+        from concurrent.futures.process import BrokenProcessPool
+
+        from vsa.services import agent_sync
+
+        log = tmp_path / "a.com.access.json"
+        with open(log, "w") as f:
+            for i in range(100):
+                f.write(json.dumps({"time": f"2026-02-03T10:00:{i % 60:02d}+01:00"}) + "\n")
+
+        broken = agent_sync._traffic_pool()
+        with pytest.raises(BrokenProcessPool):
+            broken.submit(os._exit, 1).result()
+        try:
+            with (
+                patch.object(agent_sync, "_PARALLEL_MIN_BYTES", 0),
+                patch.object(agent_sync, "_RANGE_BYTES", 1024),
+                patch("vsa.services.agent_sync.os.cpu_count", return_value=2),
+            ):
+                fallback, _ = collect_traffic_stats(tmp_path, {})
+                assert agent_sync._traffic_pool() is not broken
+                following, _ = collect_traffic_stats(tmp_path, {})
+        finally:
+            agent_sync._traffic_pool().shutdown()
+            agent_sync._traffic_pool.cache_clear()
+        assert sum(s["requests"] for s in fallback) == 100
+        assert following == fallback
+
+
 # ---------------------------------------------------------------------------
 # Container collection (mocked subprocess)
 # ---------------------------------------------------------------------------
@@ -322,7 +716,10 @@ class TestCollectContainers:
             '{"Names":"api","Image":"myapi:latest","Status":"Up 1 hour","Ports":"8000/tcp"}\n'
         )
         fake_result = type("R", (), {"returncode": 0, "stdout": docker_output, "stderr": ""})()
-        with patch("vsa.services.agent_sync.subprocess.run", return_value=fake_result):
+        with (
+            patch("vsa.services.agent_sync.docker_api.available", return_value=False),
+            patch("vsa.services.agent_sync.subprocess.run", return_value=fake_result),
+        ):
             result = collect_containers()
         assert len(result) == 2
         assert result[0]["name"] == "nginx"
@@ -333,6 +730,886 @@ class TestCollectContainers:
         from vsa.services.agent_sync import collect_containers
 
         fake_result = type("R", (), {"returncode": 1, "stdout": "", "stderr": "error"})()
-        with patch("vsa.services.agent_sync.subprocess.run", return_value=fake_result):
+        with (
+            patch("vsa.services.agent_sync.docker_api.available", return_value=False),
+            patch("vsa.services.agent_sync.subprocess.run", return_value=fake_result),
+        ):
             result = collect_containers()
         assert result == []
+
+
+# ---------------------------------------------------------------------------
+# Daemon scheduling
+# ---------------------------------------------------------------------------
+
+
+class TestRunDaemon:
+    def test_per_step_intervals(self):
+        import threading
+
+        from vsa.services.agent_sync import SyncStep, run_daemon
+
+        stop = threading.Event()
+        calls: dict[str, int] = {"fast": 0, "slow": 0}
+
+        def fast():
+            calls["fast"] += 1
+            if calls["fast"] >= 4:
+                stop.set()
+
+        def slow():
+            calls["slow"] += 1
+
+        steps = [
+            SyncStep("fast", "Fast", fast, 0.01),
+            SyncStep("slow", "Slow", slow, 60.0),
+        ]
+        run_daemon("http://hub", "tok", steps=steps, stop=stop)
+        assert calls["fast"] == 4
+        assert calls["slow"] == 1
+
+    def test_interval_override_and_failure_isolated(self):
+        import threading
+
+        from vsa.services.agent_sync import SyncStep, run_daemon
+
+        stop = threading.Event()
+        calls = {"ok": 0}
+
+        def boom():
+            raise RuntimeError("hub down")
+
+        def ok():
+            calls["ok"] += 1
+            if calls["ok"] >= 2:
+                stop.set()
+
+        steps = [
+            SyncStep("boom", "Boom", boom, 0.01),
+            SyncStep("ok", "Ok", ok, 60.0),
+        ]
+        run_daemon("http://hub", "tok", {"ok": 0.01}, steps=steps, stop=stop)
+        assert calls["ok"] == 2
+
+    def test_stream_traffic_runs_on_log_append(self, tmp_path: Path):
+        import threading
+        import time
+
+        from vsa.services.agent_sync import SyncStep, run_daemon
+
+        log = tmp_path / "example.com.access.json"
+        log.write_text("")
+        stop = threading.Event()
+        runs: list[float] = []
+
+        def traffic():
+            runs.append(time.monotonic())
+            if len(runs) == 1:
+                # Appended after the first scan; the 60 s rescan is far away.
+                threading.Timer(0.1, lambda: log.write_text("{}\n")).start()
+            else:
+                stop.set()
+
+        steps = [SyncStep("traffic", "Traffic", traffic, 60.0)]
+        watchdog = threading.Timer(10.0, stop.set)
+        watchdog.start()
+        try:
+            with patch("vsa.services.agent_sync._DEFAULT_LOG_DIR", tmp_path):
+                run_daemon("http://hub", "tok", steps=steps, stop=stop, stream_traffic=0.05)
+        finally:
+            watchdog.cancel()
+        assert len(runs) == 2
+        assert runs[1] - runs[0] < 5.0
+
+    def test_stream_traffic_without_traffic_step_watches_nothing(self):
+        import threading
+
+        from vsa.services.agent_sync import SyncStep, run_daemon
+
+        stop = threading.Event()
+        calls = {"beat": 0}
+
+        def beat():
+            calls["beat"] += 1
+            if calls["beat"] >= 3:
+                stop.set()
+
+        steps = [SyncStep("heartbeat", "Heartbeat", beat, 0.05)]
+        with patch("vsa.services.agent_sync._start_log_watch") as start_watch:
+            run_daemon("http://hub", "tok", steps=steps, stop=stop, stream_traffic=0.05)
+        start_watch.assert_not_called()
+        assert calls["beat"] == 3
+
+
+# ---------------------------------------------------------------------------
+# Concurrent step execution
+# ---------------------------------------------------------------------------
+
+
+class TestRunSteps:
+    def test_steps_run_concurrently(self):
+        import time
+
+        from vsa.services.agent_sync import SyncStep, _make_executor, _run_steps
+
+        def slow():
+            time.sleep(0.2)
+
+        steps = [SyncStep(f"s{i}", f"S{i}", slow, 1.0, 5.0) for i in range(4)]
+        executor = _make_executor()
+        started = time.monotonic()
+        overdue = _run_steps(executor, None, "http://hub", steps)
+        elapsed = time.monotonic() - started
+        executor.shutdown()
+        assert overdue == {}
+        assert elapsed < 0.6
+
+    def test_timeout_is_per_step(self):
+        import threading
+
+        from vsa.services.agent_sync import SyncStep, _make_executor, _run_steps
+
+        release = threading.Event()
+        finished: list[str] = []
+
+        def hung():
+            release.wait(5)
+
+        def quick():
+            finished.append("quick")
+
+        steps = [
+            SyncStep("hung", "Hung", hung, 1.0, 0.05),
+            SyncStep("quick", "Quick", quick, 1.0, 5.0),
+        ]
+        executor = _make_executor()
+        overdue = _run_steps(executor, None, "http://hub", steps)
+        release.set()
+        executor.shutdown()
+        assert list(overdue) == ["hung"]
+        assert finished == ["quick"]
+
+    def test_cycle_writes_metrics_textfile(self, tmp_path: Path, tmp_config, capsys):
+        import httpx
+
+        from vsa.services.agent_sync import (
+            _HUB_CAPABILITIES,
+            _LEGACY_HUBS,
+            Section,
+            SyncStep,
+            _make_executor,
+            _run_steps,
+        )
+
+        _HUB_CAPABILITIES["http://hub"] = {}
+        _LEGACY_HUBS.clear()
+
+        def broken():
+            raise RuntimeError("boom")
+
+        steps = [
+            SyncStep("beat", "Beat", lambda: Section("heartbeat", "/agent/heartbeat", {}), 1.0),
+            SyncStep("broken", "Broken", broken, 1.0),
+        ]
+        client = httpx.Client(
+            transport=httpx.MockTransport(lambda request: httpx.Response(200, json={}))
+        )
+        target = tmp_path / "textfile" / "vsa_agent.prom"
+        target.parent.mkdir()
+        executor = _make_executor()
+        with (
+            patch("vsa.services.agent_sync._METRICS_PATH", target),
+            patch("vsa.services.agent_sync.get_config", return_value=tmp_config),
+        ):
+            _run_steps(executor, client, "http://hub", steps)
+        executor.shutdown()
+
+        text = target.read_text()
+        assert 'vsa_agent_collect_total{result="ok",step="beat"}' in text
+        assert 'vsa_agent_collect_total{result="error",step="broken"}' in text
+        assert 'vsa_agent_http_requests_total{endpoint="/agent/sync",status="200"}' in text
+        assert 'vsa_agent_http_sent_bytes_count{endpoint="/agent/sync"}' in text
+        assert "vsa_agent_cycle_duration_seconds_count" in text
+        assert "Cycle: " in capsys.readouterr().out
+
+
+# ---------------------------------------------------------------------------
+# Bundle delivery with legacy fallback
+# ---------------------------------------------------------------------------
+
+
+class TestDeliver:
+    def _run(self, tmp_config, handler, sections):
+        import httpx
+
+        from vsa.services.agent_sync import _HUB_CAPABILITIES, SyncStep, _make_executor, _run_steps
+
+        _HUB_CAPABILITIES["http://hub"] = {}
+        steps = [
+            SyncStep(name, name, (lambda sec=sec: sec), 1.0, 5.0) for name, sec in sections
+        ]
+        client = httpx.Client(transport=httpx.MockTransport(handler))
+        executor = _make_executor()
+        with patch("vsa.services.agent_sync.get_config", return_value=tmp_config):
+            _run_steps(executor, client, "http://hub", steps)
+        executor.shutdown()
+
+    def test_bundle_single_request(self, tmp_config):
+        from vsa.services.agent_sync import _LEGACY_HUBS, Section
+
+        _LEGACY_HUBS.clear()
+        seen: list[tuple[str, dict]] = []
+        acked: list[str] = []
+
+        def handler(request):
+            import httpx
+
+            seen.append((request.url.path, json.loads(request.content)))
+            return httpx.Response(200, json={"status": "ok"})
+
+        self._run(
+            tmp_config,
+            handler,
+            [
+                ("heartbeat", Section("heartbeat", "/agent/heartbeat", {"vps_id": "test-vps"})),
+                (
+                    "audit",
+                    Section(
+                        "audit", "/agent/audit-sync", {"events": []}, lambda: acked.append("a")
+                    ),
+                ),
+            ],
+        )
+        assert [path for path, _ in seen] == ["/agent/sync"]
+        body = seen[0][1]
+        assert body["vps_id"] == "test-vps"
+        assert set(body) == {"vps_id", "heartbeat", "audit"}
+        assert acked == ["a"]
+
+    def test_falls_back_to_legacy_endpoints(self, tmp_config):
+        import httpx
+
+        from vsa.services.agent_sync import _LEGACY_HUBS, Section
+
+        _LEGACY_HUBS.clear()
+        paths: list[str] = []
+        acked: list[str] = []
+
+        def handler(request):
+            paths.append(request.url.path)
+            if request.url.path == "/agent/sync":
+                return httpx.Response(404)
+            if request.url.path == "/agent/certs-sync":
+                return httpx.Response(500)
+            return httpx.Response(200, json={"synced": 1})
+
+        sections = [
+            ("domains", Section("domains", "/agent/domains-sync", {}, lambda: acked.append("d"))),
+            ("certs", Section("certs", "/agent/certs-sync", {}, lambda: acked.append("c"))),
+        ]
+        self._run(tmp_config, handler, sections)
+        assert "http://hub" in _LEGACY_HUBS
+        assert sorted(paths) == ["/agent/certs-sync", "/agent/domains-sync", "/agent/sync"]
+        assert acked == ["d"]
+
+        # The fallback is remembered: no further bundle attempts.
+        paths.clear()
+        self._run(tmp_config, handler, sections[:1])
+        assert paths == ["/agent/domains-sync"]
+        _LEGACY_HUBS.clear()
+
+    def test_bundle_failure_skips_ack(self, tmp_config):
+        import httpx
+
+        from vsa.services.agent_sync import _LEGACY_HUBS, Section
+
+        _LEGACY_HUBS.clear()
+        acked: list[str] = []
+
+        def handler(request):
+            return httpx.Response(503)
+
+        self._run(
+            tmp_config,
+            handler,
+            [("traffic", Section("traffic", "/agent/traffic-sync", {}, lambda: acked.append("t")))],
+        )
+        assert acked == []
+
+    def test_expired_handshake_notices_hub_upgrade(self, tmp_config):
+        import httpx
+
+        from vsa.services.agent_sync import (
+            _HANDSHAKE_EXPIRES,
+            _HUB_CAPABILITIES,
+            _LEGACY_HUBS,
+            Section,
+            SyncStep,
+            _make_executor,
+            _run_steps,
+        )
+
+        _HUB_CAPABILITIES.clear()
+        _LEGACY_HUBS.clear()
+        upgraded = [False]
+        paths: list[str] = []
+
+        def handler(request):
+            paths.append(request.url.path)
+            if request.url.path == "/agent/capabilities":
+                if not upgraded[0]:
+                    return httpx.Response(404)
+                return httpx.Response(200, json={"bundle": True, "encodings": [], "formats": []})
+            if request.url.path == "/agent/sync" and not upgraded[0]:
+                return httpx.Response(404)
+            return httpx.Response(200, json={"status": "ok"})
+
+        beat = Section("heartbeat", "/agent/heartbeat", {"vps_id": "test-vps"})
+        steps = [SyncStep("heartbeat", "Heartbeat", lambda: beat, 1.0, 5.0)]
+        client = httpx.Client(transport=httpx.MockTransport(handler))
+        executor = _make_executor()
+
+        def cycle() -> list[str]:
+            paths.clear()
+            with patch("vsa.services.agent_sync.get_config", return_value=tmp_config):
+                _run_steps(executor, client, "http://hub", steps)
+            return list(paths)
+
+        assert cycle() == ["/agent/capabilities", "/agent/sync", "/agent/heartbeat"]
+        upgraded[0] = True
+        assert cycle() == ["/agent/heartbeat"]  # still within the TTL
+        _HANDSHAKE_EXPIRES["http://hub"] = 0.0
+        assert cycle() == ["/agent/capabilities", "/agent/sync"]
+        executor.shutdown()
+        _HUB_CAPABILITIES.clear()
+        _LEGACY_HUBS.clear()
+
+
+class TestAuditDrain:
+    def _seed(self, db_path: Path, n: int) -> None:
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        TestCollectUnsentAuditEvents()._create_db(db_path, n=n)
+
+    def _run(self, tmp_config, tmp_path, handler):
+        import httpx
+
+        from vsa.services.agent_sync import (
+            _HUB_CAPABILITIES,
+            _LEGACY_HUBS,
+            SyncStep,
+            _make_executor,
+            _run_steps,
+            audit_section,
+        )
+
+        _LEGACY_HUBS.clear()
+        _HUB_CAPABILITIES["http://hub"] = {}
+        client = httpx.Client(transport=httpx.MockTransport(handler))
+        executor = _make_executor()
+        with (
+            patch("vsa.services.agent_sync.get_config", return_value=tmp_config),
+            patch("vsa.services.agent_sync._STATE_DB_PATH", tmp_path / "state.db"),
+            patch("vsa.services.agent_sync._STATE_PATH", tmp_path / "state.json"),
+            patch("vsa.services.agent_sync._audit_batch_size", 2),
+        ):
+            step = SyncStep("audit", "Audit", audit_section, 1.0, 5.0)
+            _run_steps(executor, client, "http://hub", [step])
+            state = _load_sync_state()
+        executor.shutdown()
+        _HUB_CAPABILITIES.clear()
+        return state
+
+    def test_drains_backlog_in_batches(self, tmp_config, tmp_path: Path):
+        import httpx
+
+        self._seed(tmp_config.audit_db_path, 5)
+        batches: list[list[str]] = []
+
+        def handler(request):
+            events = json.loads(request.content)["audit"]["events"]
+            batches.append([e["action"] for e in events])
+            return httpx.Response(200, json={"status": "ok"})
+
+        state = self._run(tmp_config, tmp_path, handler)
+        assert batches[0] == ["action.1", "action.2"]
+        assert [a for batch in batches for a in batch] == [f"action.{i}" for i in range(1, 6)]
+        assert state["last_audit_id"] == 5
+
+    def test_cursor_stops_at_last_ack(self, tmp_config, tmp_path: Path):
+        import httpx
+
+        self._seed(tmp_config.audit_db_path, 5)
+        calls = 0
+
+        def handler(request):
+            nonlocal calls
+            calls += 1
+            return httpx.Response(200 if calls == 1 else 503, json={"status": "ok"})
+
+        state = self._run(tmp_config, tmp_path, handler)
+        assert calls == 2
+        assert state["last_audit_id"] == 2
+
+    def test_batch_size_adapts_to_event_size(self):
+        from vsa.services.agent_sync import (
+            _AUDIT_BATCH_MAX,
+            _AUDIT_BATCH_MIN,
+            _next_audit_batch_size,
+        )
+
+        assert _next_audit_batch_size([{"a": "x"}]) == _AUDIT_BATCH_MAX
+        assert _next_audit_batch_size([{"a": "x" * 100_000}]) == _AUDIT_BATCH_MIN
+        mid = _next_audit_batch_size([{"a": "x" * 500}])
+        assert _AUDIT_BATCH_MIN < mid < _AUDIT_BATCH_MAX
+
+
+class TestOutboxDelivery:
+    def _run(self, tmp_config, outbox, handler, sections):
+        import httpx
+
+        from vsa.services.agent_sync import (
+            _HUB_CAPABILITIES,
+            _LEGACY_HUBS,
+            SyncStep,
+            _make_executor,
+            _run_steps,
+        )
+
+        _LEGACY_HUBS.clear()
+        _HUB_CAPABILITIES["http://hub"] = {}
+        steps = [SyncStep(sec.name, sec.name, (lambda sec=sec: sec), 1.0, 5.0) for sec in sections]
+        client = httpx.Client(transport=httpx.MockTransport(handler))
+        executor = _make_executor()
+        with patch("vsa.services.agent_sync.get_config", return_value=tmp_config):
+            _run_steps(executor, client, "http://hub", steps, outbox)
+        executor.shutdown()
+        _HUB_CAPABILITIES.clear()
+
+    def test_outage_spools_then_replays_in_order(self, tmp_config, tmp_path: Path):
+        import httpx
+
+        from vsa.services.agent_outbox import Outbox
+        from vsa.services.agent_sync import Section
+
+        outbox = Outbox(tmp_path / "outbox.db")
+        acked: list[int] = []
+
+        def traffic(n):
+            return Section(
+                "traffic",
+                "/agent/traffic-sync",
+                {"vps_id": "test-vps", "stats": [n]},
+                lambda: acked.append(n),
+                append=True,
+            )
+
+        def down(request):
+            raise httpx.ConnectError("refused")
+
+        self._run(tmp_config, outbox, down, [traffic(1)])
+        assert acked == [1]  # spooled durably, so the offsets may advance
+        assert len(outbox) == 1
+        assert outbox.backing_off()
+
+        # Still backing off: queued without contacting the hub.
+        self._run(tmp_config, outbox, down, [traffic(2)])
+        assert [e.body["stats"] for e in outbox.pending()] == [[1], [2]]
+
+        outbox.record_success()
+        seen: list[tuple[str, dict]] = []
+
+        def up(request):
+            seen.append((request.url.path, json.loads(request.content)))
+            return httpx.Response(200, json={"status": "ok"})
+
+        self._run(tmp_config, outbox, up, [traffic(3)])
+        assert [path for path, _ in seen] == [
+            "/agent/traffic-sync",
+            "/agent/traffic-sync",
+            "/agent/sync",
+        ]
+        assert [body["stats"] for _, body in seen[:2]] == [[1], [2]]
+        assert seen[2][1]["traffic"]["stats"] == [3]
+        assert len(outbox) == 0
+        assert not outbox.backing_off()
+        outbox.close()
+
+    def test_fresh_snapshot_supersedes_queued_one(self, tmp_config, tmp_path: Path):
+        import httpx
+
+        from vsa.services.agent_outbox import Outbox
+        from vsa.services.agent_sync import Section
+
+        outbox = Outbox(tmp_path / "outbox.db")
+        outbox.put("domains", "/agent/domains-sync", {"domains": ["old"]}, coalesce=True)
+        paths: list[str] = []
+
+        def up(request):
+            paths.append(request.url.path)
+            return httpx.Response(200, json={"status": "ok"})
+
+        section = Section("domains", "/agent/domains-sync", {"vps_id": "test-vps", "domains": []})
+        self._run(tmp_config, outbox, up, [section])
+        assert paths == ["/agent/sync"]
+        assert len(outbox) == 0
+        outbox.close()
+
+    def test_rejected_payload_is_not_spooled(self, tmp_config, tmp_path: Path):
+        import httpx
+
+        from vsa.services.agent_outbox import Outbox
+        from vsa.services.agent_sync import Section
+
+        outbox = Outbox(tmp_path / "outbox.db")
+        acked: list[str] = []
+
+        def bad_request(request):
+            return httpx.Response(422)
+
+        section = Section(
+            "audit", "/agent/audit-sync", {"events": []}, lambda: acked.append("a"), append=True
+        )
+        self._run(tmp_config, outbox, bad_request, [section])
+        assert acked == []
+        assert len(outbox) == 0
+        assert not outbox.backing_off()
+        outbox.close()
+
+
+# ---------------------------------------------------------------------------
+# Payload encoding negotiation
+# ---------------------------------------------------------------------------
+
+
+class TestBackpressure:
+    def test_vps_phase_is_stable_and_spread(self):
+        from vsa.services.agent_sync import vps_phase
+
+        phases = [vps_phase(f"vps-{i:02d}") for i in range(50)]
+        assert all(0 <= p < 1 for p in phases)
+        assert vps_phase("vps-01") == phases[1]
+        # Roughly uniform: every fifth of the interval gets some agents.
+        assert {int(p * 5) for p in phases} == set(range(5))
+
+    def test_retry_after_parsing(self):
+        from datetime import UTC, datetime, timedelta
+        from email.utils import format_datetime
+
+        import httpx
+
+        from vsa.services.agent_sync import _retry_after
+
+        def error(status, value):
+            resp = httpx.Response(status, headers={"Retry-After": value} if value else {})
+            resp.request = httpx.Request("POST", "http://hub/agent/sync")
+            return httpx.HTTPStatusError("x", request=resp.request, response=resp)
+
+        later = format_datetime(datetime.now(UTC) + timedelta(seconds=120), usegmt=True)
+        assert _retry_after(error(503, "30")) == 30
+        assert 100 < _retry_after(error(429, later)) <= 120
+        assert _retry_after(error(503, "soon")) is None
+        assert _retry_after(error(500, "30")) is None
+        assert _retry_after(error(503, None)) is None
+        assert _retry_after(httpx.ConnectError("refused")) is None
+
+    def test_503_retry_after_sets_backoff_and_hint(self, tmp_config, tmp_path: Path):
+        import httpx
+
+        from vsa.services import agent_sync
+        from vsa.services.agent_outbox import Outbox
+        from vsa.services.agent_sync import Section
+
+        outbox = Outbox(tmp_path / "outbox.db")
+
+        def busy(request):
+            return httpx.Response(
+                503, headers={"Retry-After": "120", "X-Next-Sync-In": "45"}, json={}
+            )
+
+        section = Section("traffic", "/agent/traffic-sync", {"stats": [1]}, None, append=True)
+        with patch("vsa.services.agent_outbox.random.uniform", return_value=0.0):
+            TestOutboxDelivery()._run(tmp_config, outbox, busy, [section])
+        assert len(outbox) == 1
+        assert outbox.retry_at - time.monotonic() > 100
+        assert agent_sync._sync_hint == 45.0
+
+        def ok(request):
+            return httpx.Response(200, json={"status": "ok"})
+
+        outbox.record_success()
+        TestOutboxDelivery()._run(tmp_config, outbox, ok, [section])
+        assert agent_sync._sync_hint is None
+        outbox.close()
+
+    def test_pending_hint_sends_heartbeat_only(self, tmp_config, tmp_path: Path):
+        from vsa.services import agent_sync
+
+        sent: list[list[str]] = []
+
+        def run_steps(executor, client, hub_url, steps, outbox):
+            sent.append([step.key for step in steps])
+            return {}
+
+        with (
+            patch("vsa.services.agent_sync.get_config", return_value=tmp_config),
+            patch("vsa.services.agent_sync._STATE_DB_PATH", tmp_path / "state.db"),
+            patch("vsa.services.agent_sync._STATE_PATH", tmp_path / "state.json"),
+            patch("vsa.services.agent_sync._OUTBOX_PATH", tmp_path / "outbox.db"),
+            patch("vsa.services.agent_sync._run_steps", side_effect=run_steps),
+            patch("vsa.services.agent_sync._sync_hint", 120.0),
+        ):
+            deadline = time.time() + 60
+            agent_sync._update_sync_state(next_sync_at=deadline)
+            agent_sync.run_sync("http://hub", "tok")
+            assert agent_sync._state().get("next_sync_at") == deadline
+
+            agent_sync._update_sync_state(next_sync_at=time.time() - 1)
+            agent_sync.run_sync("http://hub", "tok")
+            assert agent_sync._state().get("next_sync_at") > deadline
+        assert sent == [["heartbeat"], [step.key for step in agent_sync._STEPS]]
+
+
+class TestEncodeBody:
+    _PAYLOAD = {"vps_id": "vps-01", "events": [{"action": f"a.{i}"} for i in range(200)]}
+
+    @staticmethod
+    def _send(payload: dict, caps: dict) -> tuple[bytes, dict[str, str]]:
+        """POST through ``_post`` to a hub advertising *caps*; the request as sent."""
+        import httpx
+
+        from vsa.services.agent_sync import _HUB_CAPABILITIES, _post
+
+        sent: list[httpx.Request] = []
+
+        def handler(request):
+            sent.append(request)
+            return httpx.Response(200, json={})
+
+        _HUB_CAPABILITIES["http://hub"] = caps
+        try:
+            client = httpx.Client(transport=httpx.MockTransport(handler))
+            _post(client, "http://hub", "/agent/audit-sync", payload)
+        finally:
+            _HUB_CAPABILITIES.clear()
+        (request,) = sent
+        assert request.url.path == "/agent/audit-sync"
+        headers = {
+            k: v
+            for k, v in request.headers.items()
+            if k.lower() in ("content-type", "content-encoding")
+        }
+        return request.content, headers
+
+    def test_legacy_hub_gets_plain_json(self):
+        body, headers = self._send(self._PAYLOAD, {})
+        assert headers == {"content-type": "application/json"}
+        assert json.loads(body) == self._PAYLOAD
+
+    def test_gzip_when_advertised(self):
+        import gzip
+
+        with patch("vsa.services.agent_sync.zstandard", None):
+            body, headers = self._send(self._PAYLOAD, {"encodings": ["zstd", "gzip"]})
+        assert headers["content-encoding"] == "gzip"
+        assert json.loads(gzip.decompress(body)) == self._PAYLOAD
+
+    def test_small_body_not_compressed(self):
+        body, headers = self._send({"vps_id": "x"}, {"encodings": ["gzip"]})
+        assert "content-encoding" not in headers
+        assert json.loads(body) == {"vps_id": "x"}
+
+    def test_zstd_msgpack_when_available(self):
+        msgpack = pytest.importorskip("msgpack")
+        zstandard = pytest.importorskip("zstandard")
+
+        caps = {
+            "encodings": ["zstd", "gzip"],
+            "formats": ["application/json", "application/msgpack"],
+        }
+        body, headers = self._send(self._PAYLOAD, caps)
+        assert headers == {"content-type": "application/msgpack", "content-encoding": "zstd"}
+        raw = zstandard.ZstdDecompressor().stream_reader(body).read()
+        assert msgpack.unpackb(raw) == self._PAYLOAD
+
+    def test_handshake_cached_per_hub(self):
+        import httpx
+
+        from vsa.services.agent_sync import _HUB_CAPABILITIES, _post
+
+        _HUB_CAPABILITIES.clear()
+        calls: list[str] = []
+
+        def handler(request):
+            calls.append(request.url.path)
+            if request.url.path == "/agent/capabilities":
+                return httpx.Response(200, json={"encodings": ["gzip"], "formats": []})
+            assert request.headers["Content-Encoding"] == "gzip"
+            return httpx.Response(200, json={})
+
+        client = httpx.Client(transport=httpx.MockTransport(handler))
+        with patch("vsa.services.agent_sync.zstandard", None):
+            _post(client, "http://hub", "/agent/audit-sync", self._PAYLOAD)
+            _post(client, "http://hub", "/agent/audit-sync", self._PAYLOAD)
+        assert calls == ["/agent/capabilities", "/agent/audit-sync", "/agent/audit-sync"]
+        _HUB_CAPABILITIES.clear()
+
+    def test_connection_error_forgets_handshake(self):
+        import httpx
+
+        from vsa.services.agent_sync import _HUB_CAPABILITIES, _post
+
+        _HUB_CAPABILITIES.clear()
+        calls: list[str] = []
+
+        def handler(request):
+            calls.append(request.url.path)
+            if request.url.path == "/agent/capabilities":
+                return httpx.Response(200, json={"encodings": [], "formats": []})
+            if len(calls) == 2:
+                raise httpx.ConnectError("refused")
+            return httpx.Response(200, json={})
+
+        client = httpx.Client(transport=httpx.MockTransport(handler))
+        with pytest.raises(httpx.ConnectError):
+            _post(client, "http://hub", "/agent/audit-sync", self._PAYLOAD)
+        assert "http://hub" not in _HUB_CAPABILITIES
+        _post(client, "http://hub", "/agent/audit-sync", self._PAYLOAD)
+        assert calls == [
+            "/agent/capabilities",
+            "/agent/audit-sync",
+            "/agent/capabilities",
+            "/agent/audit-sync",
+        ]
+        _HUB_CAPABILITIES.clear()
+
+
+# ---------------------------------------------------------------------------
+# Fingerprint-gated snapshots
+# ---------------------------------------------------------------------------
+
+
+class TestSnapshotFingerprints:
+    def test_fingerprint_is_order_independent(self):
+        from vsa.services.agent_sync import snapshot_fingerprint
+
+        a = [{"name": "x", "image": "i"}]
+        b = [{"image": "i", "name": "x"}]
+        assert snapshot_fingerprint(a) == snapshot_fingerprint(b)
+        assert snapshot_fingerprint(a) != snapshot_fingerprint([{"name": "y", "image": "i"}])
+
+    def test_unchanged_snapshot_sends_fingerprint_only(self, tmp_path: Path, tmp_config):
+        import httpx
+
+        from vsa.services.agent_sync import (
+            _HUB_CAPABILITIES,
+            _LEGACY_HUBS,
+            SyncStep,
+            _make_executor,
+            _run_steps,
+            _snapshot_section,
+        )
+
+        _LEGACY_HUBS.clear()
+        _HUB_CAPABILITIES["http://hub"] = {"bundle": True, "fingerprints": True}
+        hub_fp: dict[str, str] = {}
+        bodies: list[dict] = []
+
+        def handler(request):
+            # As the hub answers: a stored fingerprint is unchanged whether or
+            # not the items came along; other full snapshots are queued.
+            body = json.loads(request.content)["domains"]
+            bodies.append(body)
+            if body["fingerprint"] == hub_fp.get("domains"):
+                result = {"status": "unchanged"}
+            elif "domains" not in body:
+                result = {"status": "resend"}
+            else:
+                hub_fp["domains"] = body["fingerprint"]
+                result = {"synced": len(body["domains"])}
+            return httpx.Response(200, json={"status": "ok", "sections": {"domains": result}})
+
+        items = [{"domain": "a.com", "container": "a", "port": 80}]
+        step = SyncStep(
+            "domains",
+            "Domains",
+            lambda: _snapshot_section("domains", "/agent/domains-sync", items),
+            1.0,
+            5.0,
+        )
+        client = httpx.Client(transport=httpx.MockTransport(handler))
+        executor = _make_executor()
+        with (
+            patch("vsa.services.agent_sync.get_config", return_value=tmp_config),
+            patch("vsa.services.agent_sync._STATE_DB_PATH", tmp_path / "state.db"),
+            patch("vsa.services.agent_sync._STATE_PATH", tmp_path / "state.json"),
+        ):
+            _run_steps(executor, client, "http://hub", [step])  # first: full
+            _run_steps(executor, client, "http://hub", [step])  # unchanged: bare
+            hub_fp.clear()  # hub lost its copy
+            _run_steps(executor, client, "http://hub", [step])  # bare -> resend -> full
+        executor.shutdown()
+        _HUB_CAPABILITIES.clear()
+
+        assert ["domains" in b for b in bodies] == [True, False, False, True]
+        assert len({b["fingerprint"] for b in bodies}) == 1
+
+    def test_accepted_snapshot_is_resent_until_stored(self, tmp_path: Path, tmp_config):
+        import httpx
+
+        from vsa.services.agent_sync import (
+            _HUB_CAPABILITIES,
+            _LEGACY_HUBS,
+            SyncStep,
+            _make_executor,
+            _run_steps,
+            _snapshot_section,
+        )
+
+        _LEGACY_HUBS.clear()
+        _HUB_CAPABILITIES["http://hub"] = {"bundle": True, "fingerprints": True}
+        hub_fp: dict[str, str] = {}
+        bodies: list[dict] = []
+        lose_writes = [True]
+
+        def handler(request):
+            # As the hub answers: a stored fingerprint is unchanged whether or
+            # not the items came along; other full snapshots are queued.
+            body = json.loads(request.content)["domains"]
+            bodies.append(body)
+            if body["fingerprint"] == hub_fp.get("domains"):
+                result = {"status": "unchanged"}
+            elif "domains" not in body:
+                result = {"status": "resend"}
+            else:
+                # Queued by the hub; a lost write never stores the fingerprint.
+                if not lose_writes[0]:
+                    hub_fp["domains"] = body["fingerprint"]
+                accepted = {"status": "accepted"}
+                return httpx.Response(202, json={**accepted, "sections": {"domains": accepted}})
+            return httpx.Response(200, json={"status": "ok", "sections": {"domains": result}})
+
+        items = [{"domain": "a.com", "container": "a", "port": 80}]
+        step = SyncStep(
+            "domains",
+            "Domains",
+            lambda: _snapshot_section("domains", "/agent/domains-sync", items),
+            1.0,
+            5.0,
+        )
+        client = httpx.Client(transport=httpx.MockTransport(handler))
+        executor = _make_executor()
+        with (
+            patch("vsa.services.agent_sync.get_config", return_value=tmp_config),
+            patch("vsa.services.agent_sync._STATE_DB_PATH", tmp_path / "state.db"),
+            patch("vsa.services.agent_sync._STATE_PATH", tmp_path / "state.json"),
+        ):
+            _run_steps(executor, client, "http://hub", [step])  # accepted, lost
+            _run_steps(executor, client, "http://hub", [step])  # full again, lost
+            lose_writes[0] = False
+            _run_steps(executor, client, "http://hub", [step])  # accepted, stored
+            _run_steps(executor, client, "http://hub", [step])  # full -> unchanged
+            _run_steps(executor, client, "http://hub", [step])  # bare -> unchanged
+        executor.shutdown()
+        _HUB_CAPABILITIES.clear()
+
+        assert ["domains" in b for b in bodies] == [True, True, True, True, False]
@@ -0,0 +1,199 @@
+"""Tests for the Docker Engine API client against a fake unix-socket daemon."""
+
+from __future__ import annotations
+
+import json
+import shutil
+import socketserver
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+
+import pytest
+
+from vsa.errors import ContainerNotFoundError
+from vsa.services import docker, docker_api
+
+_CONTAINERS = [
+    {
+        "Names": ["/nginx"],
+        "Image": "nginx:1.25",
+        "Status": "Up 2 hours",
+        "State": "running",
+        "Ports": [
+            {"IP": "0.0.0.0", "PrivatePort": 80, "PublicPort": 80, "Type": "tcp"},
+            {"IP": "::", "PrivatePort": 80, "PublicPort": 80, "Type": "tcp"},
+        ],
+    },
+    {
+        "Names": ["/api"],
+        "Image": "myapi:latest",
+        "Status": "Exited (0) 1 hour ago",
+        "State": "exited",
+        "Ports": [{"PrivatePort": 8000, "Type": "tcp"}],
+    },
+]
+
+
+class _FakeDockerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests: list[tuple[str, str, dict]] = []
+    networks: dict[str, list[str]] = {}
+    failures: dict[str, int] = {}  # container name -> status to answer with
+
+    def log_message(self, *args):  # keep pytest output clean
+        pass
+
+    def _reply(self, status: int, body=None) -> None:
+        data = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _route(self, method: str) -> None:
+        body = self._body()
+        path = self.path.split("?")[0]
+        self.requests.append((method, self.path, body))
+        parts = path.strip("/").split("/")
+
+        if method == "GET" and path == "/containers/json":
+            running_only = "all=0" in self.path
+            items = [c for c in _CONTAINERS if not running_only or c["State"] == "running"]
+            return self._reply(200, items)
+        if parts[0] == "containers" and len(parts) >= 2:
+            name = parts[1]
+            if name in self.failures:
+                return self._reply(self.failures[name], {"message": "daemon error"})
+            exists = any(c["Names"][0] == f"/{name}" for c in _CONTAINERS)
+            if not exists:
+                return self._reply(404, {"message": f"No such container: {name}"})
+            if method == "GET":
+                nets = {n: {} for n, members in self.networks.items() if name in members}
+                return self._reply(
+                    200,
+                    {"State": {"Running": name == "nginx"}, "NetworkSettings": {"Networks": nets}},
+                )
+            return self._reply(204)
+        if parts[0] == "networks":
+            if method == "POST" and parts[1] == "create":
+                self.networks[body["Name"]] = []
+                return self._reply(201, {"Id": "abc"})
+            name = parts[1]
+            if name not in self.networks:
+                return self._reply(404, {"message": "network not found"})
+            if method == "GET":
+                return self._reply(200, {"Name": name})
+            if parts[2] == "connect":
+                self.networks[name].append(body["Container"])
+            return self._reply(200)
+        return self._reply(404, {"message": "page not found"})
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def fake_docker(monkeypatch):
+    # AF_UNIX paths are length-limited, so avoid pytest's long tmp_path.
+    tmp = Path(tempfile.mkdtemp(prefix="vsa-", dir="/tmp"))
+    sock = tmp / "docker.sock"
+    server = _UnixHTTPServer(str(sock), _FakeDockerHandler)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+
+    _FakeDockerHandler.requests = []
+    _FakeDockerHandler.networks = {}
+    _FakeDockerHandler.failures = {}
+    monkeypatch.setenv("DOCKER_HOST", f"unix://{sock}")
+    docker_api.get_client.cache_clear()
+    yield _FakeDockerHandler
+
+    docker_api.get_client().close()
+    docker_api.get_client.cache_clear()
+    server.shutdown()
+    server.server_close()
+    shutil.rmtree(tmp)
+
+
+class TestDockerApi:
+    def test_available(self, fake_docker):
+        assert docker_api.available()
+
+    def test_remote_docker_host_not_available(self, monkeypatch):
+        monkeypatch.setenv("DOCKER_HOST", "tcp://10.0.0.1:2375")
+        assert not docker_api.available()
+
+    def test_collect_containers_uses_socket(self, fake_docker):
+        from vsa.services.agent_sync import collect_containers
+
+        result = collect_containers()
+        assert result[0] == {
+            "name": "nginx",
+            "image": "nginx:1.25",
+            "status": "Up 2 hours",
+            "ports": "0.0.0.0:80->80/tcp, :::80->80/tcp",
+        }
+        assert result[1]["ports"] == "8000/tcp"
+        assert [r[1] for r in fake_docker.requests] == ["/containers/json?all=1"]
+
+    def test_find_container_by_port(self, fake_docker):
+        assert docker.find_container_by_port(80) == "nginx"
+        with pytest.raises(ContainerNotFoundError):
+            docker.find_container_by_port(8000)
+
+    def test_container_running(self, fake_docker):
+        assert docker.container_running("nginx")
+        assert not docker.container_running("api")
+        assert not docker.container_running("missing")
+
+    def test_network_lifecycle(self, fake_docker):
+        assert not docker.network_exists("flowbiz_ext")
+        docker.network_create("flowbiz_ext")
+        assert docker.network_exists("flowbiz_ext")
+
+        docker.network_connect("flowbiz_ext", "api")
+        docker.network_connect("flowbiz_ext", "api")  # already connected: no-op
+        connects = [r for r in fake_docker.requests if r[1].endswith("/connect")]
+        assert connects == [("POST", "/networks/flowbiz_ext/connect", {"Container": "api"})]
+
+    def test_network_connect_missing_container(self, fake_docker):
+        docker.network_create("flowbiz_ext")
+        with pytest.raises(ContainerNotFoundError):
+            docker.network_connect("flowbiz_ext", "missing")
+
+    def test_stop_remove_reuses_connection(self, fake_docker):
+        docker.container_stop_remove("api")
+        docker.container_stop_remove("missing")  # tolerated like the CLI path
+        methods = [(m, p) for m, p, _ in fake_docker.requests]
+        assert methods == [
+            ("POST", "/containers/api/stop"),
+            ("DELETE", "/containers/api"),
+            ("POST", "/containers/missing/stop"),
+            ("DELETE", "/containers/missing"),
+        ]
+
+    # 409 on DELETE means removal is already in progress and is not reported.
+    @pytest.mark.parametrize(("status", "warnings"), [(409, 1), (500, 2)])
+    def test_stop_remove_tolerates_daemon_errors(self, fake_docker, status, warnings, capsys):
+        fake_docker.failures["api"] = status
+        docker.container_stop_remove("api")  # does not raise, like the CLI path
+        methods = [(m, p) for m, p, _ in fake_docker.requests]
+        assert methods == [("POST", "/containers/api/stop"), ("DELETE", "/containers/api")]
+        assert capsys.readouterr().err.count("Warning") == warnings
@@ -0,0 +1,45 @@
+"""Tests for the inotify log-directory watcher."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from vsa.services.log_watch import LogWatcher
+
+try:
+    LogWatcher(Path("/")).close()
+except OSError:  # pragma: no cover - non-Linux
+    pytest.skip("inotify unavailable", allow_module_level=True)
+
+
+class TestLogWatcher:
+    def test_reports_appended_logs_only(self, tmp_path: Path):
+        log = tmp_path / "example.com.access.json"
+        log.write_text("")
+        watcher = LogWatcher(tmp_path)
+        try:
+            assert watcher.wait(0.01) is False
+            (tmp_path / "notes.txt").write_text("ignored")
+            assert watcher.wait(0.1) is False
+            with open(log, "a") as f:
+                f.write('{"status":200}\n')
+            assert watcher.wait(1.0) is True
+        finally:
+            watcher.close()
+
+    def test_sees_rotation(self, tmp_path: Path):
+        log = tmp_path / "example.com.access.json"
+        log.write_text("x\n")
+        watcher = LogWatcher(tmp_path)
+        try:
+            log.rename(tmp_path / "example.com.access.json.1")
+            log.write_text("")
+            assert watcher.wait(1.0) is True
+        finally:
+            watcher.close()
+
+    def test_missing_directory_raises(self, tmp_path: Path):
+        with pytest.raises(OSError):
+            LogWatcher(tmp_path / "nope")
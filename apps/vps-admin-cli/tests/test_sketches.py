@@ -0,0 +1,148 @@
+"""Tests for the shared mergeable sketches."""
+
+from __future__ import annotations
+
+import json
+import random
+
+import pytest
+from vsa_common import HyperLogLog, LatencyHistogram, TopK
+from vsa_common.sketches import HLL_PRECISION, RELATIVE_ACCURACY
+
+
+class TestLatencyHistogram:
+    def test_quantiles_within_relative_accuracy(self):
+        rng = random.Random(7)
+        values = sorted(rng.lognormvariate(3, 1.2) for _ in range(20_000))
+        hist = LatencyHistogram()
+        for v in values:
+            hist.add(v)
+        for q in (0.5, 0.9, 0.95, 0.99):
+            exact = values[int(q * (len(values) - 1))]
+            assert hist.quantile(q) == pytest.approx(exact, rel=RELATIVE_ACCURACY + 0.005)
+
+    def test_merge_equals_single_histogram(self):
+        a, b, both = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+        for v in range(1, 500):
+            (a if v % 3 else b).add(float(v))
+            both.add(float(v))
+        a.merge(b)
+        assert a.to_dict() == both.to_dict()
+        assert a.percentiles() == both.percentiles()
+
+    def test_zero_bucket_and_empty(self):
+        hist = LatencyHistogram()
+        assert hist.quantile(0.5) is None
+        assert hist.percentiles()["p99"] is None
+        hist.add_many([(0.0, 9), (250.0, 1)])
+        assert hist.count == 10
+        assert hist.quantile(0.5) == 0.0
+        assert hist.quantile(1.0) == 250.0
+
+    def test_json_roundtrip(self):
+        hist = LatencyHistogram()
+        hist.add_many([(3.0, 2), (40.0, 5), (0.1, 1)])
+        restored = LatencyHistogram.from_dict(json.loads(json.dumps(hist.to_dict())))
+        assert restored.to_dict() == hist.to_dict()
+        assert restored.count == 8
+
+    def test_rejects_other_gamma(self):
+        with pytest.raises(ValueError):
+            LatencyHistogram.from_dict({"gamma": 1.1, "bins": []})
+
+
+class TestTopK:
+    def test_exact_under_capacity(self):
+        top = TopK(capacity=4)
+        top.add_many([("/a", 3), ("/b", 1)])
+        top.add("/a")
+        assert top.top() == [("/a", 4, 0), ("/b", 1, 0)]
+
+    def test_heavy_hitters_survive_noise(self):
+        rng = random.Random(3)
+        stream = [f"/hot{i}" for i in range(3) for _ in range(500)]
+        stream += [f"/rare{rng.randrange(5000)}" for _ in range(3000)]
+        rng.shuffle(stream)
+        top = TopK(capacity=8)
+        for key in stream:
+            top.add(key)
+        ranked = top.top(3)
+        assert {key for key, _, _ in ranked} == {"/hot0", "/hot1", "/hot2"}
+        for _, count, error in ranked:
+            assert count - error <= 500 <= count
+
+    def test_merge_bounds_and_roundtrip(self):
+        a, b = TopK(capacity=2), TopK(capacity=2)
+        a.add_many([("/x", 10), ("/y", 5), ("/z", 1)])
+        b.add_many([("/x", 4), ("/w", 6), ("/v", 2)])
+        a.merge(b)
+        restored = TopK.from_dict(json.loads(json.dumps(a.to_dict())))
+        assert restored.to_dict() == a.to_dict()
+        key, count, error = restored.top(1)[0]
+        assert key == "/x"
+        assert count - error <= 14 <= count
+
+
+class TestHyperLogLog:
+    @pytest.mark.parametrize("n", [1, 100, 5_000, 200_000])
+    def test_estimate_within_error(self, n: int):
+        hll = HyperLogLog()
+        hll.add_many(f"198.51.{i >> 8}.{i & 255}" for i in range(n))
+        hll.add_many(f"198.51.{i >> 8}.{i & 255}" for i in range(n))  # duplicates
+        standard_error = 1.04 / (2 ** (HLL_PRECISION / 2))
+        assert hll.estimate() == pytest.approx(n, rel=4 * standard_error)
+
+    def test_union_of_overlapping_sets(self):
+        a, b = HyperLogLog(), HyperLogLog()
+        a.add_many(str(i) for i in range(0, 30_000))
+        b.add_many(str(i) for i in range(20_000, 50_000))
+        a.merge(b)
+        assert a.estimate() == pytest.approx(50_000, rel=0.1)
+
+    def test_json_roundtrip_and_empty(self):
+        hll = HyperLogLog()
+        assert not hll
+        assert hll.estimate() == 0
+        hll.add("203.0.113.7")
+        restored = HyperLogLog.from_dict(json.loads(json.dumps(hll.to_dict())))
+        assert restored.registers == hll.registers
+        assert restored.estimate() == 1
+
+    def test_rejects_other_precision(self):
+        with pytest.raises(ValueError):
+            HyperLogLog.from_dict({**HyperLogLog().to_dict(), "p": HLL_PRECISION + 1})
+
+
+_CORRUPT = [
+    None,
+    "text",
+    {"bins": 3},
+    {"bins": [[1]]},
+    {"bins": [["x", 1]]},
+    {"max_ms": [1]},
+    {"items": [["a", 1]]},
+    {"items": 5},
+    {"capacity": "many"},
+    {"registers": 42},
+    {"registers": "not base64!"},
+    {"registers": "AAAA"},
+]
+
+
+class TestCorruptSketches:
+    """Whatever a damaged column holds, decoding fails with ValueError only."""
+
+    @pytest.mark.parametrize("cls", [LatencyHistogram, TopK, HyperLogLog])
+    @pytest.mark.parametrize("data", _CORRUPT)
+    def test_from_dict_raises_value_error(self, cls, data):
+        if isinstance(data, dict):
+            data = {**cls().to_dict(), **data}
+        try:
+            cls.from_dict(data)
+        except ValueError:
+            pass
+
+    def test_truncated_registers(self):
+        packed = HyperLogLog().to_dict()["registers"]
+        with pytest.raises(ValueError):
+            HyperLogLog.from_dict({"p": HLL_PRECISION, "registers": packed[:-4]})
@@ -17,6 +17,7 @@ from vsa_common.constants import (
 from vsa_common.config import VsaConfig
 from vsa_common.models.audit_event import AuditEvent
 from vsa_common.models.site import SiteConfig
+from vsa_common.sketches import HyperLogLog, LatencyHistogram, TopK
 
 __all__ = [
     "AUDIT_DB_PATH",
@@ -27,11 +28,14 @@ __all__ = [
     "DEFAULT_PROXY_READ_TIMEOUT",
     "DEFAULT_PROXY_SEND_TIMEOUT",
     "DOCKER_NETWORK",
+    "HyperLogLog",
+    "LatencyHistogram",
     "LOG_DIR",
     "NGINX_AUTH_DIR",
     "NGINX_CONF_DIR",
     "NGINX_SNIPPETS_DIR",
     "SRV_BASE",
     "SiteConfig",
+    "TopK",
     "VsaConfig",
 ]
@@ -74,6 +74,11 @@ class VsaConfig(BaseModel):
     def mount_auth_dir(self) -> Path:
         return self.srv_base / "reverse-proxy" / "nginx" / "auth"
 
+    @property
+    def letsencrypt_live_dir(self) -> Path:
+        """Host path of the certbot ``live/`` directory (bind-mounted into NGINX)."""
+        return self.srv_base / "reverse-proxy" / "letsencrypt" / "live"
+
     @property
     def reverse_proxy_compose(self) -> Path:
         return self.reverse_proxy_dir / "compose.yml"
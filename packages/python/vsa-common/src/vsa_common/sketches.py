@@ -0,0 +1,316 @@
+"""Mergeable traffic sketches shared by the agent and the hub.
+
+``LatencyHistogram`` is a log-bucketed histogram (the scheme used by HDR
+histograms and DDSketch): a value ``v`` lands in bucket ``ceil(log_gamma(v))``,
+so every bucket spans a constant ±2% relative range. Two histograms built
+with the same ``gamma`` merge by adding bucket counts, which makes them safe
+to combine across minutes, domains and VPS nodes, unlike averages.
+Values are milliseconds; anything below ``MIN_MS`` is counted as zero.
+
+``TopK`` is a Space-Saving summary of the most frequent keys (URIs, client
+IPs, user agents) in bounded memory. Counts are over-estimates by at most
+the ``floor`` of the summary, so the true heavy hitters are always reported.
+
+``HyperLogLog`` estimates the number of distinct keys (unique client IPs)
+in ``2**HLL_PRECISION`` one-byte registers, whatever the cardinality. Two
+sketches merge by taking the register-wise maximum, so unions over any set
+of buckets, domains or VPS nodes cost the same as a single one.
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import math
+import zlib
+from collections import Counter
+from collections.abc import Iterable
+from operator import itemgetter
+from typing import Any
+
+RELATIVE_ACCURACY = 0.02
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+MIN_MS = 0.5
+
+_LOG_GAMMA = math.log(GAMMA)
+
+# What decoding a malformed ``to_dict`` payload can raise besides ValueError.
+_DECODE_ERRORS = (AttributeError, KeyError, OverflowError, TypeError)
+
+
+class LatencyHistogram:
+    """Log-bucketed histogram of latencies in milliseconds."""
+
+    __slots__ = ("bins", "zero", "count", "max_ms")
+
+    def __init__(self) -> None:
+        self.bins: dict[int, int] = {}
+        self.zero = 0
+        self.count = 0
+        self.max_ms = 0.0
+
+    def __bool__(self) -> bool:
+        return self.count > 0
+
+    def add(self, ms: float, n: int = 1) -> None:
+        """Record *n* observations of *ms* milliseconds."""
+        self.count += n
+        if ms > self.max_ms:
+            self.max_ms = ms
+        if ms < MIN_MS:
+            self.zero += n
+            return
+        index = math.ceil(math.log(ms) / _LOG_GAMMA)
+        self.bins[index] = self.bins.get(index, 0) + n
+
+    def add_many(self, observations: Iterable[tuple[float, int]]) -> None:
+        """Record ``(ms, n)`` pairs; the hot loop of ``add`` without call overhead."""
+        bins = self.bins
+        log, ceil = math.log, math.ceil
+        for ms, n in observations:
+            self.count += n
+            if ms > self.max_ms:
+                self.max_ms = ms
+            if ms < MIN_MS:
+                self.zero += n
+                continue
+            index = ceil(log(ms) / _LOG_GAMMA)
+            bins[index] = bins.get(index, 0) + n
+
+    def merge(self, other: LatencyHistogram) -> None:
+        """Add *other*'s observations to this histogram."""
+        self.count += other.count
+        self.zero += other.zero
+        self.max_ms = max(self.max_ms, other.max_ms)
+        for index, n in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + n
+
+    def quantile(self, q: float) -> float | None:
+        """Value at quantile *q* (0..1) within ±2%, or None if empty."""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if rank < seen:
+                # Bucket (gamma^(i-1), gamma^i]: this estimate is within the bound.
+                return min(2 * GAMMA**index / (GAMMA + 1), self.max_ms)
+        return self.max_ms
+
+    def to_dict(self) -> dict[str, Any]:
+        """Compact JSON-able form: ``bins`` is a list of ``[index, count]``."""
+        return {
+            "gamma": round(GAMMA, 6),
+            "count": self.count,
+            "zero": self.zero,
+            "max_ms": round(self.max_ms, 3),
+            "bins": [[index, self.bins[index]] for index in sorted(self.bins)],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> LatencyHistogram:
+        """Inverse of ``to_dict``; raises ValueError for an incompatible or corrupt sketch."""
+        try:
+            if abs(float(data.get("gamma", 0)) - GAMMA) > 1e-6:
+                raise ValueError(f"Incompatible histogram gamma {data.get('gamma')!r}")
+            hist = cls()
+            hist.zero = int(data.get("zero", 0))
+            hist.max_ms = float(data.get("max_ms", 0.0))
+            for index, n in data.get("bins", []):
+                hist.bins[int(index)] = int(n)
+        except _DECODE_ERRORS as exc:
+            raise ValueError(f"Corrupt histogram: {exc!r}") from exc
+        hist.count = hist.zero + sum(hist.bins.values())
+        return hist
+
+    def percentiles(self, qs: tuple[float, ...] = (0.5, 0.9, 0.95, 0.99)) -> dict[str, Any]:
+        """``{"count": n, "p50": ..., "p99": ..., "max": ...}`` in milliseconds."""
+        result: dict[str, Any] = {"count": self.count}
+        for q in qs:
+            value = self.quantile(q)
+            result[f"p{q * 100:g}"] = round(value, 1) if value is not None else None
+        result["max"] = round(self.max_ms, 1) if self.count else None
+        return result
+
+
+TOP_CAPACITY = 16
+
+
+class TopK:
+    """Space-Saving heavy-hitter summary tracking at most ``capacity`` keys.
+
+    A key seen for the first time starts at ``floor``, the largest count
+    evicted so far, and records it as its ``error``: its true count lies in
+    ``[count - error, count]``. Up to twice ``capacity`` keys are buffered
+    between trims so that adding stays O(1) amortised.
+    """
+
+    __slots__ = ("capacity", "counts", "errors", "floor")
+
+    def __init__(self, capacity: int = TOP_CAPACITY) -> None:
+        self.capacity = capacity
+        self.counts: dict[str, int] = {}
+        self.errors: dict[str, int] = {}
+        self.floor = 0
+
+    def __bool__(self) -> bool:
+        return bool(self.counts)
+
+    def add(self, key: str, n: int = 1) -> None:
+        """Count *n* occurrences of *key*."""
+        count = self.counts.get(key)
+        if count is None:
+            self.counts[key] = self.floor + n
+            self.errors[key] = self.floor
+            if len(self.counts) > 2 * self.capacity:
+                self._trim()
+        else:
+            self.counts[key] = count + n
+
+    def add_many(self, pairs: Iterable[tuple[str, int]]) -> None:
+        """Count ``(key, n)`` pairs (e.g. a ``Counter``'s items), trimming once at the end."""
+        counts, errors, floor = self.counts, self.errors, self.floor
+        for key, n in pairs:
+            count = counts.get(key)
+            if count is None:
+                counts[key] = floor + n
+                errors[key] = floor
+            else:
+                counts[key] = count + n
+        if len(counts) > 2 * self.capacity:
+            self._trim()
+
+    def _trim(self) -> None:
+        ranked = sorted(self.counts.items(), key=itemgetter(1), reverse=True)
+        if len(ranked) <= self.capacity:
+            return
+        self.floor = max(self.floor, ranked[self.capacity][1])
+        for key, _ in ranked[self.capacity :]:
+            del self.counts[key]
+            del self.errors[key]
+
+    def merge(self, other: TopK) -> None:
+        """Combine with *other*; a key missing from one side counts its floor."""
+        for key in self.counts.keys() - other.counts.keys():
+            self.counts[key] += other.floor
+            self.errors[key] += other.floor
+        for key, count in other.counts.items():
+            if key in self.counts:
+                self.counts[key] += count
+                self.errors[key] += other.errors[key]
+            else:
+                self.counts[key] = self.floor + count
+                self.errors[key] = self.floor + other.errors[key]
+        self.floor += other.floor
+        self.capacity = max(self.capacity, other.capacity)
+        self._trim()
+
+    def top(self, n: int | None = None) -> list[tuple[str, int, int]]:
+        """``(key, count, error)`` for the *n* most frequent keys, most frequent first."""
+        self._trim()
+        ranked = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+        return [(key, count, self.errors[key]) for key, count in ranked[:n]]
+
+    def to_dict(self) -> dict[str, Any]:
+        """Compact JSON-able form: ``items`` is a list of ``[key, count, error]``."""
+        return {
+            "capacity": self.capacity,
+            "floor": self.floor,
+            "items": [list(item) for item in self.top()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> TopK:
+        """Inverse of ``to_dict``; raises ValueError for a corrupt summary."""
+        try:
+            summary = cls(int(data.get("capacity", TOP_CAPACITY)))
+            summary.floor = int(data.get("floor", 0))
+            for key, count, error in data.get("items", []):
+                summary.counts[str(key)] = int(count)
+                summary.errors[str(key)] = int(error)
+        except _DECODE_ERRORS as exc:
+            raise ValueError(f"Corrupt top-k summary: {exc!r}") from exc
+        return summary
+
+
+HLL_PRECISION = 11  # 2048 registers: ~2.3% standard error
+
+
+class HyperLogLog:
+    """Distinct-count estimator over 64-bit BLAKE2b hashes of the keys."""
+
+    __slots__ = ("p", "registers")
+
+    def __init__(self, p: int = HLL_PRECISION) -> None:
+        self.p = p
+        self.registers = bytearray(1 << p)
+
+    def __bool__(self) -> bool:
+        return any(self.registers)
+
+    def add(self, key: str) -> None:
+        """Count *key* (adding it again changes nothing)."""
+        h = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+        bits = 64 - self.p
+        index = h >> bits
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def add_many(self, keys: Iterable[str]) -> None:
+        """Count every key of *keys*."""
+        registers, bits = self.registers, 64 - self.p
+        mask = (1 << bits) - 1
+        blake2b, from_bytes = hashlib.blake2b, int.from_bytes
+        for key in keys:
+            h = from_bytes(blake2b(key.encode(), digest_size=8).digest(), "big")
+            index = h >> bits
+            rank = bits - (h & mask).bit_length() + 1
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def merge(self, other: HyperLogLog) -> None:
+        """Union with *other*; raises ValueError if the precisions differ."""
+        if other.p != self.p:
+            raise ValueError(f"Cannot merge HyperLogLog p={other.p} into p={self.p}")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self) -> int:
+        """Estimated number of distinct keys added."""
+        m = len(self.registers)
+        histogram = Counter(self.registers)
+        harmonic = sum(n * 2.0**-rank for rank, n in histogram.items())
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / harmonic
+        zeros = histogram.get(0, 0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range: linear counting over the empty registers is exact-ish.
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def to_dict(self) -> dict[str, Any]:
+        """Compact JSON-able form: the registers zlib-compressed, base64-encoded."""
+        packed = base64.b64encode(zlib.compress(bytes(self.registers), 9)).decode()
+        return {"p": self.p, "registers": packed}
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> HyperLogLog:
+        """Inverse of ``to_dict``; raises ValueError for an incompatible or corrupt sketch."""
+        try:
+            p = data.get("p")
+        except AttributeError as exc:
+            raise ValueError(f"Corrupt HyperLogLog: {exc!r}") from exc
+        if p != HLL_PRECISION:
+            raise ValueError(f"Incompatible HyperLogLog precision {p!r}")
+        sketch = cls()
+        try:
+            # binascii.Error (bad base64) is a ValueError and passes through.
+            registers = zlib.decompress(base64.b64decode(data.get("registers", "")))
+        except (zlib.error, TypeError) as exc:
+            raise ValueError(f"Invalid HyperLogLog registers: {exc}") from exc
+        if len(registers) != len(sketch.registers):
+            raise ValueError(f"Expected {len(sketch.registers)} registers, got {len(registers)}")
+        sketch.registers = bytearray(registers)
+        return sketch